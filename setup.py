@@ -5,42 +5,44 @@ from setuptools import Extension, setup
 
 # Choose build option from toml file
 options = toml.load("pyproject.toml")["build-system"]
-PARALLEL = options["parallel"]
 GUI = options["gui"]
 
-extensions = []
 
-# Lennard-Jones Cython Extension
-cythonfile = "src/cython/force_LJ"
-cythonfile += "_par.pyx" if PARALLEL else ".pyx"
-compileargs = ["-O3", "-ffast-math", "-march=native"]
-compileargs += ["-fopenmp"] if PARALLEL else []
-linkargs = ["-fopenmp"] if PARALLEL else []
-extensions += [
-    Extension(
-        name="pymd.force_LJ",
-        sources=[cythonfile],
-        include_dirs=[get_include()],
-        extra_compile_args=compileargs,
-        extra_link_args=linkargs,
-    )
-]
-
-# Pair Correlation Cython Extension
-cythonfile = "src/cython/pair_corr"
-cythonfile += "_par.pyx" if PARALLEL else ".pyx"
-compileargs = ["-O3", "-lm", "-ffast-math", "-march=native"]
-compileargs += ["-fopenmp"] if PARALLEL else []
-linkargs = ["-fopenmp"] if PARALLEL else []
-extensions += [
-    Extension(
-        name="pymd.pair_corr",
+def cython_extension(name: str, parallel: bool) -> Extension:
+    """
+    Cython extension built from src/cython/name.pyx, or from its OpenMP
+    version name_par.pyx. The two are built side by side, as pymd.name and
+    pymd.name_par, and chosen at runtime with pymd.backend. Extensions
+    are optional: if they can't be built, pymd falls back to its NumPy
+    kernels.
+    """
+    cythonfile = "src/cython/" + name
+    cythonfile += "_par.pyx" if parallel else ".pyx"
+    compileargs = ["-O3", "-lm", "-ffast-math", "-march=native"]
+    compileargs += ["-fopenmp"] if parallel else []
+    linkargs = ["-fopenmp"] if parallel else []
+    return Extension(
+        name="pymd." + name + ("_par" if parallel else ""),
         sources=[cythonfile],
         include_dirs=[get_include()],
         extra_compile_args=compileargs,
         extra_link_args=linkargs,
+        optional=True,
     )
-]
+
+
+extensions = []
+
+# Lennard-Jones Cython Extensions, serial and OpenMP
+extensions += [cython_extension("force_LJ", parallel=False)]
+extensions += [cython_extension("force_LJ", parallel=True)]
+
+# Pair Correlation Cython Extensions, serial and OpenMP
+extensions += [cython_extension("pair_corr", parallel=False)]
+extensions += [cython_extension("pair_corr", parallel=True)]
+
+# Parser and formatter of .xyz files, serial only
+extensions += [cython_extension("xyz_io", parallel=False)]
 
 install_requires = ["numpy", "matplotlib"]
 if GUI:
@@ -1,64 +1,1223 @@
 cimport cython
 import numpy as np
 cimport numpy as np
+from libc.math cimport floor, rint, sqrt
+
+# Floating point type of positions, velocities and forces. Single
+# precision arrays are read into double precision variables, energy,
+# virial and kinetic energy are always accumulated in double precision
+ctypedef fused real:
+    float
+    double
+
+# Force algorithms understood by vv_step
+METHODS = {"n2": 0, "cell": 1, "verlet": 2}
+# Neighbor lists store every pair once
+FULL_LIST = False
+# Types, mixing table and spline tables of a single Lennard-Jones
+# species, see force
+NO_TYPES = np.empty(0, dtype=np.intc)
+NO_MIX = np.empty((0, 0, 3))
+NO_TABLE = np.empty((0, 0, 0, 4))
+# Per-atom energy and virial and virial tensor not computed, see force
+NO_ATOMS = np.empty(0)
+NO_TENSOR = np.empty((0, 0))
+
+
+cdef inline double bc(double dx, double bound) nogil:
+    """
+    Applies periodic boundary condition.
+
+    Args:
+        dx (double): val to apply the boundary
+        bound (double): boundary
+
+    Returns:
+        double: val after applying the boundary condition
+    """
+    if dx>bound/2:
+        dx-=bound
+    elif dx<-bound/2:
+        dx+=bound
+    return dx
+
+
+cdef extern from "math.h" nogil:
+    float rintf(float x)
+
+
+cdef inline real nearest(real x) nogil:
+    """
+    Nearest integer, in the precision of x.
+    """
+    if real is float:
+        return rintf(x)
+    else:
+        return rint(x)
+
+cdef inline bint soa(real[:,:] a) nogil:
+    """
+    True if the (N,3) array a is a view of a C-contiguous (3,N) array,
+    the structure of arrays layout used by the vectorized kernels.
+    """
+    return (a.shape[0] > 1 and a.strides[0] == sizeof(real)
+            and a.strides[1] == a.shape[0]*sizeof(real))
+
+
+cdef empty_forces(real[:,:] r):
+    """
+    Allocates the force array with the same layout and precision of the
+    positions.
+    """
+    dtype = np.float32 if real is float else np.float64
+    if soa(r):
+        return np.empty((3, r.shape[0]), dtype=dtype).T
+    return np.empty((r.shape[0], 3), dtype=dtype)
+
+
+cdef check_tally(int N, double[::1] eatom, double[::1] vatom,
+                 double[:,::1] W):
+    """
+    Checks the shapes of the optional outputs of the force kernels.
+    """
+    if eatom.shape[0] not in (0, N) or vatom.shape[0] not in (0, N):
+        raise ValueError("Per-atom arrays must have one entry per atom")
+    if W.shape[0]!=0 and (W.shape[0]!=3 or W.shape[1]!=3):
+        raise ValueError("Virial tensor must be a 3x3 array")
+
+
+cdef inline void store_tensor(double[:,::1] W, double wxx, double wyy,
+                              double wzz, double wxy, double wxz,
+                              double wyz) nogil:
+    """
+    Writes the symmetric virial tensor from its six components.
+    """
+    W[0,0] = wxx
+    W[1,1] = wyy
+    W[2,2] = wzz
+    W[0,1] = wxy
+    W[1,0] = wxy
+    W[0,2] = wxz
+    W[2,0] = wxz
+    W[1,2] = wyz
+    W[2,1] = wyz
+
+
+cdef no_forces(real[:,:] r):
+    """
+    Empty force array in the precision of the positions: the pair loops
+    given it compute only energy and virial.
+    """
+    dtype = np.float32 if real is float else np.float64
+    return np.empty((0, 3), dtype=dtype)
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def force(double[:,:] r, double L, double rc, double ecor, double ecut):
+@cython.cdivision(True)
+cdef inline double pair(double r2, int a, int b, double[:,:,:] mix,
+                        double[:,:,:,::1] table, double ids, double ecut,
+                        bint mixed, bint tabulated, double* modf) nogil:
     """
-    N^2 algorithm for computing forces, potential energy and virial.
+    Energy of a pair of atoms of types a and b at squared distance r2,
+    with its virial, r times the force, in modf. If tabulated, the pair
+    comes from the spline table of its types, with ids bins per unit of
+    r^2, see force; else it is Lennard-Jones, with the parameters of the
+    mixing table if mixed, or with sigma and epsilon equal to 1 and the
+    energy shifted by ecut.
+    """
+    cdef:
+        int kt, nt = table.shape[2]
+        double s2,eps,ec,x,c0,c1,c2,c3
+    if tabulated:
+        x = r2*ids
+        kt = min(<int>x, nt-1)
+        x = x - kt
+        c0 = table[a,b,kt,0]
+        c1 = table[a,b,kt,1]
+        c2 = table[a,b,kt,2]
+        c3 = table[a,b,kt,3]
+        modf[0] = -2*r2*ids*(c1 + x*(2*c2 + 3*x*c3))
+        return c0 + x*(c1 + x*(c2 + x*c3))
+    if mixed:
+        s2 = mix[a,b,0]
+        eps = mix[a,b,1]
+        ec = mix[a,b,2]
+    else:
+        s2 = 1
+        eps = 1
+        ec = ecut
+    x = s2/r2
+    x = x*x*x
+    modf[0] = 48*eps*(x*x - 0.5*x)
+    return 4*eps*(x*x - x) - ec
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline void scatter(int i, int j, double dx, double dy, double dz,
+                         double r2, double ep, double modf, real[:,:] f,
+                         double[::1] eatom, double[::1] vatom) nogil:
+    """
+    Adds the force of a pair to both its atoms, using Newton's third law,
+    and half its energy and virial to each, if f, eatom and vatom are not
+    empty.
+    """
+    if f.shape[0]>0:
+        f[i,0] += modf*dx/r2
+        f[j,0] -= modf*dx/r2
+        f[i,1] += modf*dy/r2
+        f[j,1] -= modf*dy/r2
+        f[i,2] += modf*dz/r2
+        f[j,2] -= modf*dz/r2
+    if eatom.shape[0]>0:
+        eatom[i] += 0.5*ep
+        eatom[j] += 0.5*ep
+    if vatom.shape[0]>0:
+        vatom[i] += 0.5*modf
+        vatom[j] += 0.5*modf
+
+
+cdef inline int cell_index(double x, double Lc, int M) nogil:
+    """
+    Index of the cell containing coordinate x, wrapped into [0, M).
+
+    Args:
+        x (double): coordinate
+        Lc (double): side of the cell
+        M (int): number of cells per side
+
+    Returns:
+        int: cell index along one axis
+    """
+    cdef int c = <int>floor(x/Lc) % M
+    if c<0:
+        c+=M
+    return c
+
+
+cdef inline bint half_shell(int ox, int oy, int oz) nogil:
+    """
+    True if the neighboring cell at offset (ox,oy,oz) is in the half shell
+    of 13 cells visited using Newton's third law.
+    """
+    return oz>0 or (oz==0 and (oy>0 or (oy==0 and ox>0)))
+
+
+
+cpdef int cells_per_side(double L, double rl) nogil:
+    """
+    Number of cells per side, of side at least rl. If less than 3 cells
+    fit in the box, a single cell is used.
 
     Args:
-        r (double[N,3]): array of vector positions
         L (double): dimension of box
-        rc (double): cutoff distance
-        ecor (double): energy correction
-        ecut (double): energy after cutoff
+        rl (double): minimum side of a cell
+
+    Returns:
+        int: number of cells per side
+    """
+    cdef int M = <int>(L/rl)
+    return M if M>=3 else 1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void bin_atoms(real[:,:] r, double L, int M, int[:] head,
+                    int[:] nxt, int[:,:] cell) nogil:
+    """
+    Bins atoms into M^3 cells, as linked lists: head[c] is the first atom
+    of cell c, nxt[i] the atom after i, -1 ends the list.
+    """
+    cdef:
+        int i,c
+        int N = r.shape[0]
+        double Lc = L/M
+    for c in range(M*M*M):
+        head[c] = -1
+    for i in range(N):
+        cell[i,0] = cell_index(r[i,0],Lc,M)
+        cell[i,1] = cell_index(r[i,1],Lc,M)
+        cell[i,2] = cell_index(r[i,2],Lc,M)
+        c = (cell[i,0]*M + cell[i,1])*M + cell[i,2]
+        nxt[i] = head[c]
+        head[c] = i
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void lj_n2(real[:,:] r, double L, double rc, double ecut,
+                int[:] types, double[:,:,:] mix, double[:,:,:,::1] table,
+                real[:,:] f, double[::1] eatom,
+                double[::1] vatom, double[:,::1] W, double* ev) nogil:
+    """
+    N^2 pair loop, writes forces in f and energy, virial in ev[0], ev[1].
+    If f is empty, only energy and virial are computed, see energy. If
+    types is not empty, the parameters of every pair are looked up in the
+    mixing table; if table is not empty, the energy and force of every
+    pair come from the spline table of its types, see force.
+    eatom, vatom and W, if not empty, get per-atom energy and virial and
+    the virial tensor.
     """
     cdef:
-        size_t i,j
+        int i,j,a=0,b
         int N = r.shape[0]
+        int nt = table.shape[2]
+        bint mixed = types.shape[0]>0
+        bint tabulated = table.shape[0]>0
+        bint forces = f.shape[0]>0
+        bint ea = eatom.shape[0]>0
+        bint va = vatom.shape[0]>0
+        bint wt = W.shape[0]>0
         double rc2 = rc*rc
-        double r3,r6i,modf,dx,dy,dz,r2
+        double ids = nt/rc2
+        double modf,dx,dy,dz,r2,ep
+        double wxx=0,wyy=0,wzz=0,wxy=0,wxz=0,wyz=0
         double e=0,vir=0
-        np.ndarray[double,ndim=2] f = np.zeros((N,3), dtype=np.float64)
 
+    if (soa(r) and soa(f) and not (mixed or tabulated)
+            and not (ea or va or wt)):
+        lj_n2_soa(&r[0,0], &r[0,1], &r[0,2], N, L, rc, ecut,
+                  &f[0,0], &f[0,1], &f[0,2], ev)
+        return
+    for i in range(f.shape[0]):
+        f[i,0] = 0
+        f[i,1] = 0
+        f[i,2] = 0
+    for i in range(eatom.shape[0]):
+        eatom[i] = 0
+    for i in range(vatom.shape[0]):
+        vatom[i] = 0
     # Pair interaction loop
     for i in range(0,N-1):
+        if mixed:
+            a = types[i]
         for j in range(i+1,N):
-            # Calc dr
-            dx = (r[i,0]-r[j,0])
-            dy = (r[i,1]-r[j,1])
-            dz = (r[i,2]-r[j,2])
-
-            # Periodic boundary conditions
-            if dx>L/2:
-                dx-=L
-            elif dx<-L/2:
-                dx+=L
-            if dy>L/2:
-                dy-=L
-            elif dy<-L/2:
-                dy+=L
-            if dz>L/2:
-                dz-=L
-            elif dz<-L/2:
-                dz+=L
+            # Calc dr, with periodic boundary conditions
+            dx = bc(r[i,0]-r[j,0],L)
+            dy = bc(r[i,1]-r[j,1],L)
+            dz = bc(r[i,2]-r[j,2],L)
+            r2 = dx*dx + dy*dy + dz*dz
+            # Consider interaction only if r^2<r_{cutoff}^2
+            if r2<rc2:
+                b = types[j] if mixed else 0
+                ep = pair(r2, a, b, mix, table, ids, ecut,
+                          mixed, tabulated, &modf)
+                scatter(i, j, dx, dy, dz, r2, ep, modf,
+                        f, eatom, vatom)
+                e += ep
+                vir += modf
+                if wt:
+                    modf = modf/r2
+                    wxx += modf*dx*dx
+                    wyy += modf*dy*dy
+                    wzz += modf*dz*dz
+                    wxy += modf*dx*dy
+                    wxz += modf*dx*dz
+                    wyz += modf*dy*dz
+    if wt:
+        store_tensor(W, wxx, wyy, wzz, wxy, wxz, wyz)
+    ev[0] = e
+    ev[1] = vir
+
 
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void lj_n2_soa(real* x, real* y, real* z, int N, double L,
+                    double rc, double ecut, real* fx, real* fy,
+                    real* fz, double* ev) nogil:
+    """
+    N^2 pair loop on the structure of arrays layout, with contiguous
+    coordinates and forces. Every atom loops over all the others without
+    Newton's third law, so the inner loop only reads the other atoms and
+    has no branches: the atom itself and pairs beyond the cutoff are
+    masked out, and the compiler can vectorize it over j. This is faster
+    than the half loop, which scatters forces on the other atoms. Pairs
+    are computed in the precision of the arrays, and the force, energy
+    and virial of every atom are summed in double precision. Writes
+    energy and virial in ev[0], ev[1].
+    """
+    cdef:
+        int i,j
+        real Lr = L
+        real rc2 = rc*rc
+        real iL = 1/L
+        # Constants in the precision of the arrays
+        real ec = ecut
+        real one = 1, half = 0.5, four = 4, c48 = 48
+        real xi,yi,zi,dx,dy,dz,r2,r2i,r6i,m,fr
+        # Sums over the pairs of an atom
+        double fxi,fyi,fzi,ei,viri
+        double e=0,vir=0
+
+    for i in range(N):
+        xi = x[i]
+        yi = y[i]
+        zi = z[i]
+        fxi = 0
+        fyi = 0
+        fzi = 0
+        ei = 0
+        viri = 0
+        for j in range(N):
+            # Minimum image, without branches
+            dx = xi-x[j]
+            dy = yi-y[j]
+            dz = zi-z[j]
+            dx = dx - Lr*nearest(dx*iL)
+            dy = dy - Lr*nearest(dy*iL)
+            dz = dz - Lr*nearest(dz*iL)
             r2 = dx*dx + dy*dy + dz*dz
+            m = one if (r2<rc2 and j!=i) else 0
+            # Masked pairs get a finite 1/r^2, also the atom itself
+            r2i = one/(r2 + one - m)
+            r6i = r2i*r2i*r2i
+            ei = ei + m*(four*(r6i*r6i - r6i) - ec)
+            fr = m*c48*(r6i*r6i - half*r6i)
+            viri = viri + fr
+            fr = fr*r2i
+            fxi = fxi + fr*dx
+            fyi = fyi + fr*dy
+            fzi = fzi + fr*dz
+        fx[i] = <real>fxi
+        fy[i] = <real>fyi
+        fz[i] = <real>fzi
+        e += ei
+        vir += viri
+    # Every pair was counted twice
+    ev[0] = 0.5*e
+    ev[1] = 0.5*vir
+
 
-            # Consider interaction only if r^2<r_{cutoff}^2 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void lj_cell(real[:,:] r, double L, double rc, double ecut,
+                  int[:] types, double[:,:,:] mix, double[:,:,:,::1] table,
+                  int M, int[:] head, int[:] nxt, int[:,:] cell,
+                  real[:,:] f, double[::1] eatom,
+                  double[::1] vatom, double[:,::1] W, double* ev) nogil:
+    """
+    Linked-cell pair loop on atoms binned by bin_atoms, with M>=3. Every
+    atom is checked against the atoms after it in its own cell and in the
+    13 cells of the half shell. Writes forces in f, unless it is empty,
+    and energy, virial in ev[0], ev[1].
+    """
+    cdef:
+        int i,j,cx,cy,cz,ox,oy,oz,a=0,b
+        int N = r.shape[0]
+        int nt = table.shape[2]
+        bint mixed = types.shape[0]>0
+        bint tabulated = table.shape[0]>0
+        bint forces = f.shape[0]>0
+        bint wt = W.shape[0]>0
+        double rc2 = rc*rc
+        double ids = nt/rc2
+        double modf,dx,dy,dz,r2,ep
+        double wxx=0,wyy=0,wzz=0,wxy=0,wxz=0,wyz=0
+        double e=0,vir=0
+
+    for i in range(f.shape[0]):
+        f[i,0] = 0
+        f[i,1] = 0
+        f[i,2] = 0
+    for i in range(eatom.shape[0]):
+        eatom[i] = 0
+    for i in range(vatom.shape[0]):
+        vatom[i] = 0
+    for i in range(N):
+        if mixed:
+            a = types[i]
+        for ox in range(-1,2):
+            cx = (cell[i,0]+ox+M)%M
+            for oy in range(-1,2):
+                cy = (cell[i,1]+oy+M)%M
+                for oz in range(-1,2):
+                    cz = (cell[i,2]+oz+M)%M
+                    # In the same cell, take only the atoms after i
+                    if ox==0 and oy==0 and oz==0:
+                        j = nxt[i]
+                    elif half_shell(ox,oy,oz):
+                        j = head[(cx*M + cy)*M + cz]
+                    else:
+                        continue
+                    while j!=-1:
+                        dx = bc(r[i,0]-r[j,0],L)
+                        dy = bc(r[i,1]-r[j,1],L)
+                        dz = bc(r[i,2]-r[j,2],L)
+                        r2 = dx*dx + dy*dy + dz*dz
+                        # Consider interaction only if r^2<r_{cutoff}^2
+                        if r2<rc2:
+                            b = types[j] if mixed else 0
+                            ep = pair(r2, a, b, mix, table, ids, ecut,
+                                      mixed, tabulated, &modf)
+                            scatter(i, j, dx, dy, dz, r2, ep, modf,
+                                    f, eatom, vatom)
+                            e += ep
+                            vir += modf
+                            if wt:
+                                modf = modf/r2
+                                wxx += modf*dx*dx
+                                wyy += modf*dy*dy
+                                wzz += modf*dz*dz
+                                wxy += modf*dx*dy
+                                wxz += modf*dx*dz
+                                wyz += modf*dy*dz
+                        j = nxt[j]
+    if wt:
+        store_tensor(W, wxx, wyy, wzz, wxy, wxz, wyz)
+    ev[0] = e
+    ev[1] = vir
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef int fill_neighbors(real[:,:] r, double L, double rl, int M,
+                        int[:] head, int[:] nxt, int[:,:] cell,
+                        int[:] start, int[:] nbr) nogil:
+    """
+    Fills a Verlet neighbor list of radius rl from atoms binned by
+    bin_atoms, each pair is stored once. Neighbors past the size of nbr
+    are counted but not stored.
+
+    Returns:
+        int: number of pairs found
+    """
+    cdef:
+        int i,j,cx,cy,cz,ox,oy,oz,k=0
+        int N = r.shape[0]
+        int size = nbr.shape[0]
+        int lo = -1 if M>=3 else 0
+        int hi = 2 if M>=3 else 1
+        double rl2 = rl*rl
+        double dx,dy,dz
+
+    for i in range(N):
+        start[i] = min(k,size)
+        for ox in range(lo,hi):
+            cx = (cell[i,0]+ox+M)%M
+            for oy in range(lo,hi):
+                cy = (cell[i,1]+oy+M)%M
+                for oz in range(lo,hi):
+                    cz = (cell[i,2]+oz+M)%M
+                    j = head[(cx*M + cy)*M + cz]
+                    while j!=-1:
+                        if j>i:
+                            dx = bc(r[i,0]-r[j,0],L)
+                            dy = bc(r[i,1]-r[j,1],L)
+                            dz = bc(r[i,2]-r[j,2],L)
+                            if dx*dx + dy*dy + dz*dz < rl2:
+                                if k<size:
+                                    nbr[k] = j
+                                k += 1
+                        j = nxt[j]
+    start[N] = min(k,size)
+    return k
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void lj_neighbors(real[:,:] r, double L, double rc, double ecut,
+                       int[:] types, double[:,:,:] mix,
+                       double[:,:,:,::1] table, int[:] start, int[:] nbr,
+                       real[:,:] f, double[::1] eatom,
+                       double[::1] vatom, double[:,::1] W, double* ev) nogil:
+    """
+    Neighbor list pair loop, writes forces in f, unless it is empty, and
+    energy, virial in ev[0], ev[1].
+    """
+    cdef:
+        int i,j,k,a=0,b
+        int N = r.shape[0]
+        int nt = table.shape[2]
+        bint mixed = types.shape[0]>0
+        bint tabulated = table.shape[0]>0
+        bint forces = f.shape[0]>0
+        bint wt = W.shape[0]>0
+        double rc2 = rc*rc
+        double ids = nt/rc2
+        double modf,dx,dy,dz,r2,ep
+        double wxx=0,wyy=0,wzz=0,wxy=0,wxz=0,wyz=0
+        double e=0,vir=0
+
+    for i in range(f.shape[0]):
+        f[i,0] = 0
+        f[i,1] = 0
+        f[i,2] = 0
+    for i in range(eatom.shape[0]):
+        eatom[i] = 0
+    for i in range(vatom.shape[0]):
+        vatom[i] = 0
+    for i in range(N):
+        if mixed:
+            a = types[i]
+        for k in range(start[i],start[i+1]):
+            j = nbr[k]
+            dx = bc(r[i,0]-r[j,0],L)
+            dy = bc(r[i,1]-r[j,1],L)
+            dz = bc(r[i,2]-r[j,2],L)
+            r2 = dx*dx + dy*dy + dz*dz
+            # Consider interaction only if r^2<r_{cutoff}^2
             if r2<rc2:
-                r6i = 1/(r2*r2*r2)
-                e += 4 * (r6i * r6i - r6i) - ecut
-                modf = 48 * (r6i * r6i - 0.5 * r6i)
-                f[i,0] += modf*dx/r2
-                f[j,0] -= modf*dx/r2
-                f[i,1] += modf*dy/r2
-                f[j,1] -= modf*dy/r2
-                f[i,2] += modf*dz/r2
-                f[j,2] -= modf*dz/r2
+                b = types[j] if mixed else 0
+                ep = pair(r2, a, b, mix, table, ids, ecut,
+                          mixed, tabulated, &modf)
+                scatter(i, j, dx, dy, dz, r2, ep, modf,
+                        f, eatom, vatom)
+                e += ep
                 vir += modf
+                if wt:
+                    modf = modf/r2
+                    wxx += modf*dx*dx
+                    wyy += modf*dy*dy
+                    wzz += modf*dz*dz
+                    wxy += modf*dx*dy
+                    wxz += modf*dx*dz
+                    wyz += modf*dy*dz
+    if wt:
+        store_tensor(W, wxx, wyy, wzz, wxy, wxz, wyz)
+    ev[0] = e
+    ev[1] = vir
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double max_disp2(real[:,:] r, short[:,:] img, double L,
+                      real[:,:] r0) nogil:
+    """
+    Largest squared displacement from the unfolded positions r0.
+    """
+    cdef:
+        int i
+        int N = r.shape[0]
+        double dx,dy,dz,d2,dmax=0
+    for i in range(N):
+        dx = r[i,0] + img[i,0]*L - r0[i,0]
+        dy = r[i,1] + img[i,1]*L - r0[i,1]
+        dz = r[i,2] + img[i,2]*L - r0[i,2]
+        d2 = dx*dx + dy*dy + dz*dz
+        if d2>dmax:
+            dmax = d2
+    return dmax
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void unfold(real[:,:] r, short[:,:] img, double L,
+                 real[:,:] r0) nogil:
+    """
+    Writes the unfolded positions r+img*L in r0.
+    """
+    cdef int i,k
+    for i in range(r.shape[0]):
+        for k in range(3):
+            r0[i,k] = r[i,k] + img[i,k]*L
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def force(real[:,:] r, double L, double rc, double ecor, double ecut,
+          int[:] types=None, double[:,:,:] mix=None,
+          double[:,:,:,::1] table=None,
+          double[::1] eatom=None, double[::1] vatom=None,
+          double[:,::1] W=None):
+    """
+    N^2 algorithm for computing forces, potential energy and virial.
+    Without types, all the atoms are of the same species, with sigma and
+    epsilon equal to 1. With a mixture, the size, well depth and energy
+    at cutoff of every pair are looked up by the types of the atoms in
+    the mixing table, as mix[a,b] = (sigma_ab^2, epsilon_ab, ecut_ab).
+    With a table, the Lennard-Jones potential is replaced by the
+    tabulated one of the types of the pair: table[a,b] holds the cubic
+    spline coefficients of its energy on n bins of r^2 from 0 to rc^2,
+    see pymd.potential.tabulate.
+    Per-atom energy and virial and the virial tensor are optional outputs
+    of the same pass, filled only if their arrays are given.
+
+    Args:
+        r (real[N,3]): array of vector positions
+        L (double): dimension of box
+        rc (double): cutoff distance
+        ecor (double): energy correction
+        ecut (double): energy after cutoff
+        types (int[N], optional): type of every atom. Defaults to None,
+            a single species.
+        mix (double[T,T,3], optional): mixing table of the types.
+            Defaults to None.
+        table (double[T,T,n,4], optional): spline tables of the types.
+            Defaults to None, the Lennard-Jones potential.
+        eatom (double[N], optional): output energy of every atom, half the
+            energy of each of its pairs, without the correction.
+            Defaults to None.
+        vatom (double[N], optional): output virial of every atom, half
+            the virial of each of its pairs. Defaults to None.
+        W (double[3,3], optional): output virial tensor, sum over the
+            pairs of f_a*r_b. Defaults to None.
+    """
+    cdef:
+        int N = r.shape[0]
+        double ev[2]
+        real[:,:] f = empty_forces(r)
+    if types is None:
+        types = NO_TYPES
+    if mix is None:
+        mix = NO_MIX
+    if table is None:
+        table = NO_TABLE
+    if eatom is None:
+        eatom = NO_ATOMS
+    if vatom is None:
+        vatom = NO_ATOMS
+    if W is None:
+        W = NO_TENSOR
+    check_tally(N, eatom, vatom, W)
+    lj_n2(r, L, rc, ecut, types, mix, table, f, eatom, vatom, W, ev)
+    return np.asarray(f), ev[0]+N*ecor, ev[1]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def force_cell(real[:,:] r, double L, double rc, double ecor, double ecut,
+               int[:] types=None, double[:,:,:] mix=None,
+               double[:,:,:,::1] table=None,
+               double[::1] eatom=None, double[::1] vatom=None,
+               double[:,::1] W=None):
+    """
+    Linked-cell algorithm for computing forces, potential energy and virial.
+    The box is divided in M^3 cells of side L/M >= rc, every atom is
+    checked only against atoms in its own cell and in the 26 neighboring
+    ones (half of them, using Newton's third law). Falls back to the N^2
+    algorithm if less than 3 cells per side fit in the box.
+
+    Args:
+        r (real[N,3]): array of vector positions
+        L (double): dimension of box
+        rc (double): cutoff distance
+        ecor (double): energy correction
+        ecut (double): energy after cutoff
+        types (int[N], optional): type of every atom, see force.
+            Defaults to None.
+        mix (double[T,T,3], optional): mixing table of the types.
+            Defaults to None.
+        table (double[T,T,n,4], optional): spline tables of the types.
+            Defaults to None, the Lennard-Jones potential.
+        eatom (double[N], optional): output energy of every atom, see
+            force. Defaults to None.
+        vatom (double[N], optional): output virial of every atom.
+            Defaults to None.
+        W (double[3,3], optional): output virial tensor. Defaults to
+            None.
+    """
+    cdef:
+        int N = r.shape[0]
+        int M = cells_per_side(L, rc)
+        double ev[2]
+        real[:,:] f = empty_forces(r)
+        int[:] head, nxt
+        int[:,:] cell
+    if types is None:
+        types = NO_TYPES
+    if mix is None:
+        mix = NO_MIX
+    if table is None:
+        table = NO_TABLE
+    if eatom is None:
+        eatom = NO_ATOMS
+    if vatom is None:
+        vatom = NO_ATOMS
+    if W is None:
+        W = NO_TENSOR
+    check_tally(N, eatom, vatom, W)
+    if M<3:
+        lj_n2(r, L, rc, ecut, types, mix, table, f, eatom, vatom, W, ev)
+    else:
+        head = np.empty(M*M*M, dtype=np.intc)
+        nxt = np.empty(N, dtype=np.intc)
+        cell = np.empty((N,3), dtype=np.intc)
+        bin_atoms(r, L, M, head, nxt, cell)
+        lj_cell(r, L, rc, ecut, types, mix, table, M, head, nxt, cell, f,
+                eatom, vatom, W, ev)
+    return np.asarray(f), ev[0]+N*ecor, ev[1]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def energy(real[:,:] r, double L, double rc, double ecor, double ecut,
+           int[:] types=None, double[:,:,:] mix=None,
+           double[:,:,:,::1] table=None):
+    """
+    N^2 algorithm for computing potential energy and virial only, as
+    force without allocating and filling the force array.
+
+    Args:
+        r (real[N,3]): array of vector positions
+        L (double): dimension of box
+        rc (double): cutoff distance
+        ecor (double): energy correction
+        ecut (double): energy after cutoff
+        types (int[N], optional): type of every atom, see force.
+            Defaults to None.
+        mix (double[T,T,3], optional): mixing table of the types.
+            Defaults to None.
+        table (double[T,T,n,4], optional): spline tables of the types.
+            Defaults to None.
+    """
+    cdef:
+        int N = r.shape[0]
+        double ev[2]
+        real[:,:] f = no_forces(r)
+        double[::1] eatom = NO_ATOMS, vatom = NO_ATOMS
+        double[:,::1] W = NO_TENSOR
+    if types is None:
+        types = NO_TYPES
+    if mix is None:
+        mix = NO_MIX
+    if table is None:
+        table = NO_TABLE
+    lj_n2(r, L, rc, ecut, types, mix, table, f, eatom, vatom, W, ev)
+    return ev[0]+N*ecor, ev[1]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def energy_cell(real[:,:] r, double L, double rc, double ecor,
+                double ecut, int[:] types=None, double[:,:,:] mix=None,
+                double[:,:,:,::1] table=None):
+    """
+    Linked-cell algorithm for computing potential energy and virial only,
+    as force_cell without the force array.
+
+    Args:
+        r (real[N,3]): array of vector positions
+        L (double): dimension of box
+        rc (double): cutoff distance
+        ecor (double): energy correction
+        ecut (double): energy after cutoff
+        types (int[N], optional): type of every atom, see force.
+            Defaults to None.
+        mix (double[T,T,3], optional): mixing table of the types.
+            Defaults to None.
+        table (double[T,T,n,4], optional): spline tables of the types.
+            Defaults to None.
+    """
+    cdef:
+        int N = r.shape[0]
+        int M = cells_per_side(L, rc)
+        double ev[2]
+        real[:,:] f = no_forces(r)
+        double[::1] eatom = NO_ATOMS, vatom = NO_ATOMS
+        double[:,::1] W = NO_TENSOR
+        int[:] head, nxt
+        int[:,:] cell
+    if types is None:
+        types = NO_TYPES
+    if mix is None:
+        mix = NO_MIX
+    if table is None:
+        table = NO_TABLE
+    if M<3:
+        lj_n2(r, L, rc, ecut, types, mix, table, f, eatom, vatom, W, ev)
+    else:
+        head = np.empty(M*M*M, dtype=np.intc)
+        nxt = np.empty(N, dtype=np.intc)
+        cell = np.empty((N,3), dtype=np.intc)
+        bin_atoms(r, L, M, head, nxt, cell)
+        lj_cell(r, L, rc, ecut, types, mix, table, M, head, nxt, cell, f,
+                eatom, vatom, W, ev)
+    return ev[0]+N*ecor, ev[1]
+
+
+def build_neighbors_into(real[:,:] r, double L, double rl, int[:] head,
+                         int[:] nxt, int[:,:] cell, int[:] start,
+                         int[:] nbr):
+    """
+    Builds in place a Verlet neighbor list of radius rl using cells, each
+    pair is stored once. The neighbors of atom i are
+    nbr[start[i]:start[i+1]]. If the returned number of pairs is greater
+    than the size of nbr, the list is not complete.
+
+    Args:
+        r (real[N,3]): array of vector positions
+        L (double): dimension of box
+        rl (double): neighbor list radius (cutoff plus skin)
+        head (int[M^3]): buffer for the first atom of every cell, with M
+            given by cells_per_side(L, rl)
+        nxt (int[N]): buffer for the linked lists of the cells
+        cell (int[N,3]): buffer for the cell of every atom
+        start (int[N+1]): start indices of the neighbors of each atom
+        nbr (int[size]): neighbors list
+
+    Returns:
+        int: number of pairs
+    """
+    cdef int M = cells_per_side(L, rl)
+    bin_atoms(r, L, M, head, nxt, cell)
+    return fill_neighbors(r, L, rl, M, head, nxt, cell, start, nbr)
+
+
+def build_neighbors(real[:,:] r, double L, double rl):
+    """
+    Builds a Verlet neighbor list of radius rl using cells, each pair is
+    stored once. The neighbors of atom i are nbr[start[i]:start[i+1]].
+
+    Args:
+        r (real[N,3]): array of vector positions
+        L (double): dimension of box
+        rl (double): neighbor list radius (cutoff plus skin)
+
+    Returns:
+        Tuple[NDArray, NDArray, int]: start indices, neighbors,
+            number of pairs
+    """
+    cdef:
+        int N = r.shape[0]
+        int M = cells_per_side(L, rl)
+        int pairs
+        int[:] head, nxt, start, nbr
+        int[:,:] cell
+    head = np.empty(M*M*M, dtype=np.intc)
+    nxt = np.empty(N, dtype=np.intc)
+    cell = np.empty((N,3), dtype=np.intc)
+    start = np.empty(N+1, dtype=np.intc)
+    # Count the pairs, then fill the list
+    pairs = build_neighbors_into(
+        r, L, rl, head, nxt, cell, start, np.empty(0, dtype=np.intc))
+    nbr = np.empty(max(pairs, 1), dtype=np.intc)
+    fill_neighbors(r, L, rl, M, head, nxt, cell, start, nbr)
+    return np.asarray(start), np.asarray(nbr), pairs
+
+
+def force_neighbors(real[:,:] r, double L, double rc, double ecor,
+                    double ecut, int[:] start, int[:] nbr,
+                    int[:] types=None, double[:,:,:] mix=None,
+                    double[:,:,:,::1] table=None,
+                    double[::1] eatom=None, double[::1] vatom=None,
+                    double[:,::1] W=None):
+    """
+    Neighbor list algorithm for computing forces, potential energy and
+    virial, using a list made by build_neighbors.
+
+    Args:
+        r (real[N,3]): array of vector positions
+        L (double): dimension of box
+        rc (double): cutoff distance
+        ecor (double): energy correction
+        ecut (double): energy after cutoff
+        start (int[N+1]): start of the neighbors of each atom
+        nbr (int[M]): neighbors list
+        types (int[N], optional): type of every atom, see force.
+            Defaults to None.
+        mix (double[T,T,3], optional): mixing table of the types.
+            Defaults to None.
+        table (double[T,T,n,4], optional): spline tables of the types.
+            Defaults to None, the Lennard-Jones potential.
+        eatom (double[N], optional): output energy of every atom, see
+            force. Defaults to None.
+        vatom (double[N], optional): output virial of every atom.
+            Defaults to None.
+        W (double[3,3], optional): output virial tensor. Defaults to
+            None.
+    """
+    cdef:
+        int N = r.shape[0]
+        double ev[2]
+        real[:,:] f = empty_forces(r)
+    if types is None:
+        types = NO_TYPES
+    if mix is None:
+        mix = NO_MIX
+    if table is None:
+        table = NO_TABLE
+    if eatom is None:
+        eatom = NO_ATOMS
+    if vatom is None:
+        vatom = NO_ATOMS
+    if W is None:
+        W = NO_TENSOR
+    check_tally(N, eatom, vatom, W)
+    lj_neighbors(r, L, rc, ecut, types, mix, table, start, nbr, f, eatom,
+                 vatom, W, ev)
+    return np.asarray(f), ev[0]+N*ecor, ev[1]
+
+
+def energy_neighbors(real[:,:] r, double L, double rc, double ecor,
+                     double ecut, int[:] start, int[:] nbr,
+                     int[:] types=None, double[:,:,:] mix=None,
+                     double[:,:,:,::1] table=None):
+    """
+    Neighbor list algorithm for computing potential energy and virial
+    only, as force_neighbors without the force array.
+
+    Args:
+        r (real[N,3]): array of vector positions
+        L (double): dimension of box
+        rc (double): cutoff distance
+        ecor (double): energy correction
+        ecut (double): energy after cutoff
+        start (int[N+1]): start of the neighbors of each atom
+        nbr (int[M]): neighbors list
+        types (int[N], optional): type of every atom, see force.
+            Defaults to None.
+        mix (double[T,T,3], optional): mixing table of the types.
+            Defaults to None.
+        table (double[T,T,n,4], optional): spline tables of the types.
+            Defaults to None.
+    """
+    cdef:
+        int N = r.shape[0]
+        double ev[2]
+        real[:,:] f = no_forces(r)
+        double[::1] eatom = NO_ATOMS, vatom = NO_ATOMS
+        double[:,::1] W = NO_TENSOR
+    if types is None:
+        types = NO_TYPES
+    if mix is None:
+        mix = NO_MIX
+    if table is None:
+        table = NO_TABLE
+    lj_neighbors(r, L, rc, ecut, types, mix, table, start, nbr, f, eatom,
+                 vatom, W, ev)
+    return ev[0]+N*ecor, ev[1]
+
+
+def max_displacement(real[:,:] r, short[:,:] img, double L,
+                     real[:,:] r0):
+    """
+    Largest displacement of an atom from the unfolded reference
+    positions r0, using the box crossing counters.
+
+    Args:
+        r (real[N,3]): array of vector positions
+        img (short[N,3]): box crossing counter array
+        L (double): dimension of box
+        r0 (real[N,3]): unfolded reference positions
+
+    Returns:
+        double: maximum displacement
+    """
+    return sqrt(max_disp2(r, img, L, r0))
+
 
-    return f, e+N*ecor, vir
\ No newline at end of file
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef int vv_core(real[:,:] r, real[:,:] v, real[:,:] f,
+                 short[:,:] img, double L, double dt, double rc,
+                 double ecut, int[:] types, double[:,:,:] mix,
+                 double[:,:,:,::1] table, int method, int[:] head,
+                 int[:] nxt, int[:,:] cell, int[:] start, int[:] nbr,
+                 real[:,:] r0, double skin, double[::1] eatom,
+                 double[::1] vatom, double[:,::1] W, double* out) nogil:
+    """
+    Velocity Verlet step, see vv_step. Writes potential energy (without
+    correction), virial and kinetic energy in out[0], out[1], out[2].
+
+    Returns:
+        int: number of entries of the list if it was rebuilt, else -1
+    """
+    cdef:
+        int i,k,M
+        int N = r.shape[0]
+        int size = -1
+        double h = 0.5*dt
+        double ke = 0
+
+    # First integration half-step and periodic boundary conditions
+    for i in range(N):
+        for k in range(3):
+            v[i,k] += h*f[i,k]
+            r[i,k] += v[i,k]*dt
+            if r[i,k]>L:
+                r[i,k] -= L
+                img[i,k] += 1
+            elif r[i,k]<0:
+                r[i,k] += L
+                img[i,k] -= 1
+
+    # Calculate forces
+    if method==2:
+        if max_disp2(r, img, L, r0) > 0.25*skin*skin:
+            M = cells_per_side(L, rc+skin)
+            bin_atoms(r, L, M, head, nxt, cell)
+            size = fill_neighbors(r, L, rc+skin, M, head, nxt, cell,
+                                  start, nbr)
+            if size<=nbr.shape[0]:
+                unfold(r, img, L, r0)
+            elif M>=3:
+                lj_cell(r, L, rc, ecut, types, mix, table, M, head, nxt,
+                        cell, f, eatom, vatom, W, out)
+            else:
+                lj_n2(r, L, rc, ecut, types, mix, table, f, eatom, vatom, W,
+                      out)
+        if size<=nbr.shape[0]:
+            lj_neighbors(r, L, rc, ecut, types, mix, table, start, nbr, f,
+                         eatom, vatom, W, out)
+    elif method==1:
+        M = cells_per_side(L, rc)
+        if M>=3:
+            bin_atoms(r, L, M, head, nxt, cell)
+            lj_cell(r, L, rc, ecut, types, mix, table, M, head, nxt, cell,
+                    f, eatom, vatom, W, out)
+        else:
+            lj_n2(r, L, rc, ecut, types, mix, table, f, eatom, vatom, W, out)
+    else:
+        lj_n2(r, L, rc, ecut, types, mix, table, f, eatom, vatom, W, out)
+
+    # Second integration half-step, and kinetic energy
+    for i in range(N):
+        for k in range(3):
+            v[i,k] += h*f[i,k]
+            ke += v[i,k]*v[i,k]
+    out[2] = 0.5*ke
+    return size
+
+
+def vv_step(real[:,:] r, real[:,:] v, real[:,:] f, short[:,:] img,
+            double L, double dt, double rc, double ecor, double ecut,
+            int[:] types, double[:,:,:] mix, double[:,:,:,::1] table,
+            int method, int[:] head, int[:] nxt, int[:,:] cell,
+            int[:] start, int[:] nbr, real[:,:] r0,
+            double skin):
+    """
+    Velocity Verlet step, in place on r, v, f and img: half-kick, drift,
+    periodic boundary conditions with box crossing count, forces and
+    second half-kick. With the Verlet list method, the list is rebuilt
+    when an atom moved more than skin/2 from r0; if nbr is too small the
+    forces of the step are computed with the cells and the list must be
+    rebuilt by the caller.
+
+    Args:
+        r (real[N,3]): array of vector positions
+        v (real[N,3]): array of velocities
+        f (real[N,3]): array of forces at the start of the step
+        img (short[N,3]): box crossing counter array
+        L (double): dimension of box
+        dt (double): timestep
+        rc (double): cutoff distance
+        ecor (double): energy correction
+        ecut (double): energy after cutoff
+        types (int[N]): type of every atom, empty for a single species
+        mix (double[T,T,3]): mixing table of the types, see force
+        table (double[T,T,n,4]): spline tables of the types, empty for
+            the Lennard-Jones potential, see force
+        method (int): force algorithm, from METHODS
+        head, nxt, cell: cell buffers, see build_neighbors_into
+        start, nbr: neighbor list, see build_neighbors_into
+        r0 (real[N,3]): unfolded positions at the last list build
+        skin (double): skin of the neighbor list
+
+    Returns:
+        Tuple[float, float, float, int]: potential energy, virial,
+            kinetic energy, number of pairs if the list was rebuilt else -1
+    """
+    cdef:
+        int size
+        double out[3]
+        double[::1] eatom = NO_ATOMS, vatom = NO_ATOMS
+        double[:,::1] W = NO_TENSOR
+    with nogil:
+        size = vv_core(r, v, f, img, L, dt, rc, ecut, types, mix, table,
+                       method, head, nxt, cell, start, nbr, r0, skin,
+                       eatom, vatom, W, out)
+    return out[0]+r.shape[0]*ecor, out[1], out[2], size
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def vv_run(real[:,:] r, real[:,:] v, real[:,:] f, short[:,:] img,
+           double L, double dt, double rc, double ecor, double ecut,
+           int[:] types, double[:,:,:] mix, double[:,:,:,::1] table,
+           int method, int[:] head, int[:] nxt, int[:,:] cell,
+           int[:] start, int[:] nbr, real[:,:] r0,
+           double skin, double[:,:] thermo):
+    """
+    Runs thermo.shape[0] velocity Verlet steps without the GIL, see
+    vv_step for the arguments. Potential energy, virial and kinetic
+    energy of every step are written in the rows of thermo. Stops early
+    if the neighbor list gets full, so the caller can grow it.
+
+    Args:
+        thermo (double[steps,3]): output potential energy, virial and
+            kinetic energy of every step
+
+    Returns:
+        Tuple[int, int, int]: steps done, number of list builds, number of
+            pairs of the last build (-1 if none)
+    """
+    cdef:
+        int s=-1,size
+        int steps = thermo.shape[0]
+        int N = r.shape[0]
+        int builds = 0
+        int last = -1
+        double out[3]
+        double[::1] eatom = NO_ATOMS, vatom = NO_ATOMS
+        double[:,::1] W = NO_TENSOR
+    with nogil:
+        for s in range(steps):
+            size = vv_core(r, v, f, img, L, dt, rc, ecut, types, mix,
+                           table, method, head, nxt, cell, start, nbr, r0,
+                           skin, eatom, vatom, W, out)
+            thermo[s,0] = out[0]+N*ecor
+            thermo[s,1] = out[1]
+            thermo[s,2] = out[2]
+            if size>=0:
+                builds += 1
+                last = size
+                if size>nbr.shape[0]:
+                    break
+    return s+1, builds, last
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def vv_batch(real[:,:,:] r, real[:,:,:] v, real[:,:,:] f,
+             short[:,:,:] img, double[:] L, double dt, double[:] rc,
+             double[:] ecor, double[:] ecut, int[:,:] head,
+             int[:,:] nxt, int[:,:,:] cell, double[:,::1] thermo):
+    """
+    Velocity Verlet step of a batch of independent systems of the same
+    number of atoms of a single Lennard-Jones species, in place on the
+    (B,N,3) arrays, see vv_step. Every system has its own box length and
+    cutoff, and uses the linked-cell list if its box has at least 3 cells
+    per side, else the all-pairs loop.
+
+    Args:
+        r (real[B,N,3]): array of vector positions of every system
+        v (real[B,N,3]): array of velocities
+        f (real[B,N,3]): array of forces at the start of the step
+        img (short[B,N,3]): box crossing counter array
+        L (double[B]): dimension of every box
+        dt (double): timestep
+        rc (double[B]): cutoff distance of every system
+        ecor (double[B]): energy correction of every system
+        ecut (double[B]): energy after cutoff of every system
+        head (int[B,M]): cell heads of every system, M at least the
+            largest number of cells used
+        nxt, cell (int[B,N], int[B,N,3]): cell buffers of every system
+        thermo (double[B,3]): output potential energy, virial and kinetic
+            energy of every system
+    """
+    cdef:
+        int b
+        int N = r.shape[1]
+        int[:] types = NO_TYPES
+        double[:,:,:] mix = NO_MIX
+        double[:,:,:,::1] table = NO_TABLE
+        int[:] nbr = NO_TYPES
+        real[:,:] r0 = no_forces(r[0])
+        double[::1] eatom = NO_ATOMS, vatom = NO_ATOMS
+        double[:,::1] W = NO_TENSOR
+    with nogil:
+        for b in range(r.shape[0]):
+            vv_core(r[b], v[b], f[b], img[b], L[b], dt, rc[b], ecut[b],
+                    types, mix, table, 1, head[b], nxt[b], cell[b], nbr,
+                    nbr, r0, 0.0, eatom, vatom, W, &thermo[b,0])
+            thermo[b,0] += N*ecor[b]
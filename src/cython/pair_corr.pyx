@@ -1,32 +1,109 @@
 cimport cython
 import numpy as np
 cimport numpy as np
-from libc.math cimport sqrt
+from libc.math cimport rint, sqrt
+
+# Floating point type of positions, velocities and forces. Single
+# precision arrays are read into double precision variables, energy,
+# virial and kinetic energy are always accumulated in double precision
+ctypedef fused real:
+    float
+    double
+
+
+# Separations computed at once by the vectorized loop of hist_row_soa
+cdef enum:
+    CHUNK = 64
+
+
+cdef inline bint soa(real[:,:] a) nogil:
+    """
+    True if the (N,3) array a is a view of a C-contiguous (3,N) array,
+    the structure of arrays layout used by the vectorized kernels.
+    """
+    return (a.shape[0] > 1 and a.strides[0] == sizeof(real)
+            and a.strides[1] == a.shape[0]*sizeof(real))
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void hist_row_soa(real* x, real* y, real* z, int i, int j0,
+                       int j1, double L, double rc, double dr,
+                       np.int_t w, np.int_t* H) nogil:
+    """
+    Adds w to the histogram H for every separation of atom i from atoms
+    j0<=j<j1, on the structure of arrays layout. Separations are computed
+    in chunks by a loop without branches, that the compiler can
+    vectorize, and then binned.
+    """
+    cdef:
+        int j,k,n
+        double iL = 1/L
+        double dx,dy,dz
+        double d[CHUNK]
+    j = j0
+    while j<j1:
+        n = min(<int>CHUNK, j1-j)
+        for k in range(n):
+            dx = x[i]-x[j+k]
+            dy = y[i]-y[j+k]
+            dz = z[i]-z[j+k]
+            dx = dx - L*rint(dx*iL)
+            dy = dy - L*rint(dy*iL)
+            dz = dz - L*rint(dz*iL)
+            d[k] = sqrt(dx*dx + dy*dy + dz*dz)
+        for k in range(n):
+            if d[k]<rc:
+                H[<int>(d[k]/dr)] += w
+        j += CHUNK
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
-def calc_hist(double[:,:] r, double L, double rc, double dr):
+def calc_hist(real[:,:] r, double L, double rc, double dr,
+              int[:] types=None, int ntypes=1):
     """
     N^2 algorithm for computing interparticle separations
-    and updating the radial distribution function histogram.
+    and updating the radial distribution function histogram. With the
+    types of the atoms, the partial histograms of every pair of types are
+    filled in the same pass: the separations of atoms of type a from
+    atoms of type b are counted in H[a,b].
 
     Args:
-        r (double[N,3]): array of vector positions
+        r (real[N,3]): array of vector positions
         L (double): dimension of box
         rc (double): cutoff distance
         dr (double): length of bin
+        types (int[N], optional): type of every atom. Defaults to None.
+        ntypes (int, optional): number of types. Defaults to 1.
+
+    Returns:
+        NDArray: histogram, as (nbins), or partial histograms, as
+            (ntypes,ntypes,nbins), if types are given
     """
     cdef:
         size_t i,j
         int N = r.shape[0]
         int nbins = <int>(rc/dr) + 1
+        int bin,a,b
+        bint typed = types is not None
         double dx,dy,dz,modr
-        np.ndarray[np.int_t, ndim=1] H = np.zeros(nbins, dtype=np.int)
+        np.ndarray[np.int_t, ndim=1] H
 
+    if not typed:
+        types = np.zeros(N, dtype=np.intc)
+        ntypes = 1
+    H = np.zeros(ntypes*ntypes*nbins, dtype=np.int)
+    if soa(r) and not typed:
+        for i in range(0,N-1):
+            hist_row_soa(&r[0,0], &r[0,1], &r[0,2], i, i+1, N, L, rc, dr,
+                         2, &H[0])
+        return H
     # Pair interaction loop
     for i in range(0,N-1):
+        a = types[i]
         for j in range(i+1,N):
             # Calc dr
             dx = (r[i,0]-r[j,0])
@@ -49,7 +126,11 @@ def calc_hist(double[:,:] r, double L, double rc, double dr):
             # Consider interaction only if r<r_{cutoff}
             if modr<rc:
                 bin = <int>(modr/dr)
-                H[bin]+=2
+                b = types[j]
+                H[(a*ntypes + b)*nbins + bin] += 1
+                H[(b*ntypes + a)*nbins + bin] += 1
+    if typed:
+        return H.reshape(ntypes, ntypes, nbins)
     return H
 
 
@@ -5,7 +5,63 @@ import numpy as np
 from cython.parallel import parallel, prange
 
 cimport numpy as np
-from libc.math cimport sqrt
+cimport openmp
+from libc.math cimport rint, sqrt
+
+# Floating point type of positions, velocities and forces. Single
+# precision arrays are read into double precision variables, energy,
+# virial and kinetic energy are always accumulated in double precision
+ctypedef fused real:
+    float
+    double
+
+
+# Separations computed at once by the vectorized loop of hist_row_soa
+cdef enum:
+    CHUNK = 64
+
+
+cdef inline bint soa(real[:,:] a) nogil:
+    """
+    True if the (N,3) array a is a view of a C-contiguous (3,N) array,
+    the structure of arrays layout used by the vectorized kernels.
+    """
+    return (a.shape[0] > 1 and a.strides[0] == sizeof(real)
+            and a.strides[1] == a.shape[0]*sizeof(real))
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void hist_row_soa(real* x, real* y, real* z, int i, int j0,
+                       int j1, double L, double rc, double dr,
+                       np.int_t w, np.int_t* H) nogil:
+    """
+    Adds w to the histogram H for every separation of atom i from atoms
+    j0<=j<j1, on the structure of arrays layout. Separations are computed
+    in chunks by a loop without branches, that the compiler can
+    vectorize, and then binned.
+    """
+    cdef:
+        int j,k,n
+        double iL = 1/L
+        double dx,dy,dz
+        double d[CHUNK]
+    j = j0
+    while j<j1:
+        n = min(<int>CHUNK, j1-j)
+        for k in range(n):
+            dx = x[i]-x[j+k]
+            dy = y[i]-y[j+k]
+            dz = z[i]-z[j+k]
+            dx = dx - L*rint(dx*iL)
+            dy = dy - L*rint(dy*iL)
+            dz = dz - L*rint(dz*iL)
+            d[k] = sqrt(dx*dx + dy*dy + dz*dz)
+        for k in range(n):
+            if d[k]<rc:
+                H[<int>(d[k]/dr)] += w
+        j += CHUNK
 
 
 cdef double bc(double dx, double bound) nogil:
@@ -28,51 +84,85 @@ cdef double bc(double dx, double bound) nogil:
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
-def calc_hist(double[:,:] r, double L, double rc, double dr):
+def calc_hist(real[:,:] r, double L, double rc, double dr,
+              int[:] types=None, int ntypes=1):
     """
     N^2 algorithm for computing interparticle separations in parallel
-    and updating the radial distribution function histogram.
+    and updating the radial distribution function histogram. With the
+    types of the atoms, the partial histograms of every pair of types are
+    filled in the same pass: the separations of atoms of type a from
+    atoms of type b are counted in H[a,b].
 
     Args:
-        r (double[N,3]): array of vector positions
+        r (real[N,3]): array of vector positions
         L (double): dimension of box
         rc (double): cutoff distance
         dr (double): length of bin
+        types (int[N], optional): type of every atom. Defaults to None.
+        ntypes (int, optional): number of types. Defaults to 1.
+
+    Returns:
+        NDArray: histogram, as (nbins), or partial histograms, as
+            (ntypes,ntypes,nbins), if types are given
     """
     cdef:
-        int i,j
+        int i,j,bin,a
         int N = r.shape[0]
         int nbins = <int>(rc/dr) + 1
+        int nbins_all
+        bint typed = types is not None
         double dx,dy,dz,modr
-        np.ndarray[np.int_t, ndim=1] H = np.zeros(nbins, dtype=np.int)
+        np.ndarray[np.int_t, ndim=1] H
+
+    if not typed:
+        types = np.zeros(N, dtype=np.intc)
+        ntypes = 1
+    nbins_all = ntypes*ntypes*nbins
+    H = np.zeros(nbins_all, dtype=np.int)
 
     # Now, thread safe by separation of memory
     cdef:
         int num_threads = openmp.omp_get_max_threads()
         int tid
-        np.int_t[:,:] H_local = np.zeros((num_threads,nbins), dtype=np.int)
-
-
-    with nogil, parallel(num_threads=num_threads):
-        # Pair interaction loop
-        for i in prange(0,N-1, schedule="static", chunksize=50):
-            tid = openmp.omp_get_thread_num()
-            for j in range(i+1,N):
-                # Calc dr
-                dx = (r[i,0]-r[j,0])
-                dy = (r[i,1]-r[j,1])
-                dz = (r[i,2]-r[j,2])
-                # Periodic boundary conditions
-                dx=bc(dx,L)
-                dy=bc(dy,L)
-                dz=bc(dz,L)
-                modr = sqrt(dx*dx + dy*dy + dz*dz)
-                # Consider interaction only if r<r_{cutoff}
-                if modr<rc:
-                    bin = <int>(modr/dr)
-                    H_local[tid,bin] += 2
+        np.int_t[:,:] H_local = np.zeros((num_threads,nbins_all),
+                                         dtype=np.int)
+
+
+    if soa(r) and not typed:
+        with nogil, parallel(num_threads=num_threads):
+            for i in prange(N, schedule="static"):
+                tid = openmp.omp_get_thread_num()
+                hist_row_soa(&r[0,0], &r[0,1], &r[0,2], i, 0, i, L, rc, dr,
+                             1, &H_local[tid,0])
+                hist_row_soa(&r[0,0], &r[0,1], &r[0,2], i, i+1, N, L, rc,
+                             dr, 1, &H_local[tid,0])
+    else:
+        with nogil, parallel(num_threads=num_threads):
+            # Full rows, every pair is counted from both atoms: the work of
+            # each row is the same, so a static schedule is balanced
+            for i in prange(N, schedule="static"):
+                tid = openmp.omp_get_thread_num()
+                a = types[i]*ntypes
+                for j in range(N):
+                    if j==i:
+                        continue
+                    # Calc dr
+                    dx = (r[i,0]-r[j,0])
+                    dy = (r[i,1]-r[j,1])
+                    dz = (r[i,2]-r[j,2])
+                    # Periodic boundary conditions
+                    dx=bc(dx,L)
+                    dy=bc(dy,L)
+                    dz=bc(dz,L)
+                    modr = sqrt(dx*dx + dy*dy + dz*dz)
+                    # Consider interaction only if r<r_{cutoff}
+                    if modr<rc:
+                        bin = <int>(modr/dr)
+                        H_local[tid,(a + types[j])*nbins + bin] += 1
     # Sum thread values to get total histogram
     for tid in range(num_threads):
-        for i in range(0,nbins):
-            H[i] += H_local[i,tid]
+        for i in range(0,nbins_all):
+            H[i] += H_local[tid,i]
+    if typed:
+        return H.reshape(ntypes, ntypes, nbins)
     return H
\ No newline at end of file
@@ -0,0 +1,314 @@
+cimport cython
+from libc.math cimport fabs, floor
+from libc.stdint cimport uint64_t
+from libc.stdio cimport snprintf
+from libc.stdlib cimport strtod, strtol
+from libc.string cimport memcpy
+
+# Floating point type of positions and velocities
+ctypedef fused real:
+    float
+    double
+
+
+# Digits after the decimal point of the coordinates, as "%.8f"
+cdef enum:
+    DIGITS = 8
+    # Bytes of a formatted coordinate, at most
+    FIELD = 40
+
+cdef double SCALE = 1e8
+
+# Exact powers of ten, for the decimal fractions read without strtod
+cdef double POW10[23]
+for _k in range(23):
+    POW10[_k] = 10.0**_k
+
+# Largest coordinate formatted without snprintf, so that SCALE times it
+# is well within the integers exactly represented by a double
+cdef double FAST_MAX = 1e6
+
+
+cdef inline const char* skip_blanks(const char* p) nogil:
+    """
+    First character of p that isn't a space, a tab or a carriage return.
+    """
+    while p[0] == b' ' or p[0] == b'\t' or p[0] == b'\r':
+        p += 1
+    return p
+
+
+cdef inline bint negative(double x) nogil:
+    """
+    Sign bit of x, also of -0.0, read from its bits since fast math
+    doesn't keep the sign of zeros.
+    """
+    cdef uint64_t bits
+    memcpy(&bits, &x, sizeof(double))
+    return bits >> 63
+
+
+@cython.cdivision(True)
+cdef inline double parse_coord(const char* p, char** end) nogil:
+    """
+    Reads a number at p, after spaces and tabs, and sets end after it, or
+    to p if there is no number. Plain decimals, as written by
+    format_frame, with at most 15 digits, are read as an integer divided
+    by a power of ten, which is exactly rounded; the others by strtod.
+    """
+    cdef:
+        const char* q
+        uint64_t m = 0
+        int digits = 0, decimals = 0
+        bint minus = False
+        double x
+
+    p = skip_blanks(p)
+    q = p
+    if q[0] == b'-' or q[0] == b'+':
+        minus = q[0] == b'-'
+        q += 1
+    while b'0' <= q[0] <= b'9':
+        m = 10*m + <uint64_t>(q[0] - c'0')
+        digits += 1
+        q += 1
+    if q[0] == b'.':
+        q += 1
+        while b'0' <= q[0] <= b'9':
+            m = 10*m + <uint64_t>(q[0] - c'0')
+            digits += 1
+            decimals += 1
+            q += 1
+    if (digits == 0 or digits > 15 or q[0] == b'e' or q[0] == b'E'
+            or q[0] == b'n' or q[0] == b'i'):
+        return strtod(p, end)
+    x = <double>m / POW10[decimals]
+    end[0] = <char*>q
+    return -x if minus else x
+
+
+cdef inline const char* next_line(const char* p, const char* end) nogil:
+    """
+    First character after the end of the line of p, or end.
+    """
+    while p < end and p[0] != b'\n':
+        p += 1
+    return p + 1 if p < end else end
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def parse_frame(bytes data, Py_ssize_t offset, double[:,::1] r,
+                double[:,::1] v, unsigned char[:,::1] elems):
+    """
+    Parses a frame of an .xyz file in the pymd dialect: a line with N and
+    has_vel, a comment line and N lines with the element and 3 floats, or
+    6 with velocities. Coordinates are converted by strtod straight into
+    the given arrays, so they can be rows of a larger preallocated array.
+
+    Args:
+        data (bytes): text of one or more frames
+        offset (Py_ssize_t): byte offset of the frame in data
+        r (double[M,3]): array of positions, with M >= N
+        v (double[M,3]): array of velocities, with M >= N, untouched if
+            the frame has no velocities
+        elems (unsigned char[M,W]): element of every atom, as W bytes
+            padded with zeros; longer elements are cut
+
+    Raises:
+        ValueError: if the frame is malformed or truncated
+        ValueError: if the arrays are smaller than the frame
+
+    Returns:
+        tuple: N of atoms, has_vel and the byte offset of the next frame
+    """
+    cdef:
+        const char* start = data
+        const char* end = start + len(data)
+        const char* p = start + offset
+        char* q
+        long N, has_vel
+        Py_ssize_t i, k, c, ncol
+        Py_ssize_t width = elems.shape[1]
+        Py_ssize_t bad = -1
+        double x
+
+    if offset < 0 or offset > len(data):
+        raise ValueError("Offset out of the data")
+    N = strtol(p, &q, 10)
+    if q == p:
+        raise ValueError("Missing number of atoms in the .xyz header")
+    p = q
+    has_vel = strtol(p, &q, 10)
+    if q == p or N < 0:
+        raise ValueError("Malformed .xyz header")
+    if r.shape[0] < N or elems.shape[0] < N or has_vel and v.shape[0] < N:
+        raise ValueError(f"Arrays are too small for {N} atoms")
+    ncol = 6 if has_vel else 3
+    # Skip the rest of the header and the comment line
+    p = next_line(next_line(q, end), end)
+    with nogil:
+        for i in range(N):
+            p = skip_blanks(p)
+            k = 0
+            while (p < end and p[0] != b' ' and p[0] != b'\t'
+                   and p[0] != b'\n' and p[0] != b'\r'):
+                if k < width:
+                    elems[i,k] = p[0]
+                    k += 1
+                p += 1
+            if k == 0:
+                bad = i
+                break
+            while k < width:
+                elems[i,k] = 0
+                k += 1
+            for c in range(ncol):
+                x = parse_coord(p, &q)
+                if q == p:
+                    bad = i
+                    break
+                if c < 3:
+                    r[i,c] = x
+                else:
+                    v[i,c-3] = x
+                p = q
+            if bad >= 0:
+                break
+            p = next_line(p, end)
+    if bad >= 0:
+        raise ValueError(f"Malformed or missing line of atom {bad}")
+    return N, bool(has_vel), p - start
+
+
+cpdef Py_ssize_t frame_size(Py_ssize_t N, Py_ssize_t width, bint put_vel):
+    """
+    Bytes that a frame takes at most, see format_frame.
+
+    Args:
+        N (Py_ssize_t): number of atoms
+        width (Py_ssize_t): bytes of the elements
+        put_vel (bool): if velocities are formatted
+
+    Returns:
+        Py_ssize_t: size of the buffer for the frame
+    """
+    return 64 + N*(width + (6 if put_vel else 3)*FIELD + 1)
+
+
+@cython.cdivision(True)
+cdef inline Py_ssize_t format_coord(char* out, double x) nogil:
+    """
+    Writes x as "%.8f" at out and returns the bytes written, or -1 if it
+    takes more than FIELD bytes. Coordinates are rounded to integer units
+    of the last digit, unless they fall too close to the half unit for
+    the rounding error of the scaling, where snprintf decides, so the
+    text is always the same as printf.
+    """
+    cdef:
+        double s = fabs(x) * SCALE
+        double f
+        unsigned long long n, whole
+        Py_ssize_t k = 0, m
+        char digits[24]
+
+    if not fabs(x) < FAST_MAX:
+        m = snprintf(out, FIELD, "%.8f", x)
+        return m if 0 <= m < FIELD else -1
+    f = s - floor(s)
+    if fabs(f - 0.5) < s*1e-15 + 1e-9:
+        return snprintf(out, FIELD, "%.8f", x)
+    n = <unsigned long long>(s + 0.5)
+    if negative(x):
+        out[k] = b'-'
+        k += 1
+    whole = n // <unsigned long long>SCALE
+    n = n % <unsigned long long>SCALE
+    m = 0
+    while True:
+        digits[m] = <char>(c'0' + whole % 10)
+        whole = whole // 10
+        m += 1
+        if whole == 0:
+            break
+    while m > 0:
+        m -= 1
+        out[k] = digits[m]
+        k += 1
+    out[k] = b'.'
+    k += 1
+    for m in range(DIGITS - 1, -1, -1):
+        out[k+m] = <char>(c'0' + n % 10)
+        n = n // 10
+    return k + DIGITS
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def format_frame(real[:,::1] r, real[:,::1] v, unsigned char[:,::1] elems,
+                 unsigned char[::1] buf):
+    """
+    Formats a frame in the .xyz dialect of pymd.util.xyz_out into a
+    buffer, that can be reused for every frame: a line with N and has_vel,
+    an empty comment line and a line for atom with the element and the
+    coordinates, as "%.8f", of r and v.
+
+    Args:
+        r (real[N,3]): array of positions
+        v (real[N,3]): array of velocities, or an empty array to leave
+            them out
+        elems (unsigned char[M,W]): element of every atom, as W bytes
+            padded with zeros, or of all of them if M is 1
+        buf (unsigned char[B]): output buffer, see frame_size
+
+    Raises:
+        ValueError: if the arrays don't match or the buffer is too small
+        ValueError: if a coordinate takes more than FIELD bytes
+
+    Returns:
+        Py_ssize_t: bytes written to buf
+    """
+    cdef:
+        Py_ssize_t N = r.shape[0]
+        Py_ssize_t width = elems.shape[1]
+        Py_ssize_t size = buf.shape[0]
+        Py_ssize_t i, k, c, e, n
+        Py_ssize_t bad = -1
+        bint put_vel = v.shape[0] > 0
+        int ncol
+        char* out
+
+    if put_vel and v.shape[0] != N:
+        raise ValueError("Positions and velocities don't match")
+    if elems.shape[0] != N and elems.shape[0] != 1:
+        raise ValueError("Elements don't match the atoms")
+    if size < frame_size(N, width, put_vel):
+        raise ValueError("Buffer is too small for the frame")
+    ncol = 6 if put_vel else 3
+    out = <char*>&buf[0]
+    k = snprintf(out, size, "%zd %d\n\n", N, <int>put_vel)
+    with nogil:
+        for i in range(N):
+            e = i if elems.shape[0] == N else 0
+            for c in range(width):
+                if elems[e,c] == 0:
+                    break
+                out[k] = elems[e,c]
+                k += 1
+            for c in range(ncol):
+                out[k] = b' '
+                if c < 3:
+                    n = format_coord(out + k + 1, r[i,c])
+                else:
+                    n = format_coord(out + k + 1, v[i,c-3])
+                if n < 0:
+                    bad = i
+                    break
+                k += 1 + n
+            if bad >= 0:
+                break
+            out[k] = b'\n'
+            k += 1
+    if bad >= 0:
+        raise ValueError(f"Coordinates of atom {bad} are too large")
+    return k
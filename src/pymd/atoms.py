@@ -1,17 +1,22 @@
 from __future__ import annotations
 
 from copy import deepcopy
-from typing import Any, List
+from typing import Any, Dict, List, Tuple, Union
 
 import numpy as np
 from nptyping import NDArray
 
+from pymd.backend import Backend, get_backend
 from pymd.element import Element, gen_element
-from pymd.pair_corr import calc_hist
-from pymd.util import gen_cubic_grid, xyz_in, xyz_out
+from pymd.util import (
+    gen_cubic_grid,
+    space_filling_order,
+    trj_out,
+    xyz_in,
+    xyz_out,
+)
 
 
-# TODO Element to Array of Element, then pass parameters to forcepoly
 class Atoms:
     """
     Atoms object, contains informations about number of atoms, density,
@@ -20,42 +25,76 @@ class Atoms:
     Attributes:
         N (int): number of atoms
         rho (float): density of atoms
-        elem (Element): Element object of atoms
+        elem (Element): Element object of atoms, with a mixture the first
+            species, which defines the normal units
+        species (List[Element]): Element objects of the species
+        types (NDArray): species of every atom, as index in species
         L (float): box length
-        r (NDArray): positions array
+        r (NDArray): positions array, as (N,3) with any layout
+        layout (str): memory layout of positions, see set_layout
+        dtype (type): floating point type of positions and velocities,
+            see set_precision
         v (NDArray): velocities array
         i (NDArray): box crossing counter array
+        order (NDArray): original index of every atom, changed by sort
     """
 
+    # Floating point types of the precisions
+    PRECISIONS = {"double": np.float64, "single": np.float32}
+
     def __init__(
         self,
         N: int,
         rho: float,
-        elem: Element,
+        elem: Union[Element, List[Element]],
         r: NDArray = None,
         v: NDArray = None,
         removedrift: bool = True,
+        layout: str = "aos",
+        precision: str = "double",
+        types: NDArray = None,
     ):
         """
         Initialize Atoms object. If positions are not given, defaults to
         the smallest cubic grid; if velocities are not given, generates
         random velocities from a normalized exponential distribution;
         if removedrift is set to False, does not put the velocity of the
-        center of mass to zero.
+        center of mass to zero. A mixture is given as a list of elements
+        and the species of every atom; the species interact with their
+        own sigma and epsilon, but all move with the mass of the first.
 
         Args:
             N (int): number of atoms
             rho (float): density of atoms
-            elem (Element): Element object of atoms
+            elem (Union[Element, List[Element]]): Element object of atoms,
+                or list of the species of a mixture
             r (NDArray, optional): array of positions. Defaults to None.
             v (NDArray, optional): array of velocities. Defaults to None.
             removedrift (bool, optional): if True, puts to zero the velocity of
                 the center of mass. Defaults to True.
+            layout (str, optional): memory layout of positions, "aos" or
+                "soa", see set_layout. Defaults to "aos".
+            precision (str, optional): precision of positions and
+                velocities, "double" or "single", see set_precision.
+                Defaults to "double".
+            types (NDArray, optional): species of every atom, as index in
+                the list of elements. Defaults to None, all the first one.
+
+        Raises:
+            ValueError: if types are not valid indices of the species
         """
         self.N = N
         self.rho = rho
         self.L = np.cbrt(self.N / self.rho)
-        self.elem = elem
+        self.species = list(elem) if isinstance(elem, list) else [elem]
+        self.elem = self.species[0]
+        if types is None:
+            types = np.zeros(self.N)
+        self.types = np.array(types, dtype=np.intc)
+        if self.types.shape != (self.N,) or not np.all(
+            (self.types >= 0) & (self.types < len(self.species))
+        ):
+            raise ValueError("Types must be N indices of the species")
         if r is None:
             self.set_r_cubicgrid()
         else:
@@ -66,7 +105,10 @@ class Atoms:
             self.v = v
         if removedrift:
             self.remove_v_drift()
+        self.set_precision(precision)
+        self.set_layout(layout)
         self.i = np.zeros((self.N, 3), dtype=np.int16)
+        self.order = np.arange(self.N)
 
     def set_r_cubicgrid(self):
         """
@@ -83,12 +125,133 @@ class Atoms:
             np.random.exponential(size=(self.N, 3)), dtype=np.float64
         )
 
+    def set_layout(self, layout: str):
+        """
+        Set the memory layout of positions: "aos" stores them as an (N,3)
+        array, "soa" as a contiguous (3,N) array. r is an (N,3) view in
+        both cases; the kernels vectorize over atoms with "soa", and the
+        forces of a State take the same layout.
+
+        Args:
+            layout (str): "aos" or "soa"
+
+        Raises:
+            ValueError: if the layout is unknown
+        """
+        if layout == "aos":
+            self.r = np.ascontiguousarray(self.r, dtype=self.dtype)
+        elif layout == "soa":
+            self.r = np.array(self.r.T, dtype=self.dtype, order="C").T
+        else:
+            raise ValueError(f"Unknown layout {layout}")
+        self.layout = layout
+
+    def set_precision(self, precision: str):
+        """
+        Set the precision of positions and velocities: "double" stores
+        them as float64, "single" as float32, halving memory traffic. The
+        forces of a State take the same precision, while the kernels
+        accumulate energy, virial and kinetic energy in double precision.
+
+        Args:
+            precision (str): "double" or "single"
+
+        Raises:
+            ValueError: if the precision is unknown
+        """
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}")
+        self.dtype = self.PRECISIONS[precision]
+        self.r = self.r.astype(self.dtype, order="K", copy=False)
+        self.v = self.v.astype(self.dtype, copy=False)
+
+    @property
+    def ntypes(self) -> int:
+        """
+        Number of species.
+        """
+        return len(self.species)
+
+    @property
+    def fractions(self) -> NDArray:
+        """
+        Fraction of atoms of every species.
+        """
+        return np.bincount(self.types, minlength=self.ntypes) / self.N
+
+    @property
+    def names(self) -> NDArray:
+        """
+        Name of the species of every atom.
+        """
+        return np.array([elem.name for elem in self.species])[self.types]
+
+    @property
+    def precision(self) -> str:
+        """
+        Precision of positions and velocities, "double" or "single".
+        """
+        return "single" if self.dtype == np.float32 else "double"
+
     def remove_v_drift(self):
         """
         Take away any center-of-mass drift
         """
         self.v -= np.mean(self.v, axis=0)
 
+    def wrap(self):
+        """
+        Apply periodic boundary conditions, bringing the atoms back in the
+        box and updating the box crossing counters
+        """
+        out = self.r > self.L
+        self.r[out] -= self.L
+        self.i[out] += 1
+        out = self.r < 0
+        self.r[out] += self.L
+        self.i[out] -= 1
+
+    def sort(self, curve: str = "hilbert", bits: int = 10) -> NDArray:
+        """
+        Sort the atoms in place along a space filling curve, so that atoms
+        close in space are close in memory. Positions, velocities and box
+        crossings are permuted together, order keeps track of the
+        original index of every atom.
+
+        Args:
+            curve (str, optional): "hilbert" or "morton".
+                Defaults to "hilbert".
+            bits (int, optional): bits per coordinate of the curve.
+                Defaults to 10.
+
+        Returns:
+            NDArray: the permutation applied, to permute other per-atom
+                arrays as a[:] = a[perm]
+        """
+        perm = space_filling_order(self.r, self.L, curve, bits)
+        self.permute(perm)
+        return perm
+
+    def unsort(self):
+        """
+        Bring the atoms back in place to their original order.
+        """
+        self.permute(np.argsort(self.order))
+
+    def permute(self, perm: NDArray):
+        """
+        Permute the atoms in place, the atom at index k goes to the index
+        where perm is k.
+
+        Args:
+            perm (NDArray): permutation of the atoms
+        """
+        self.r[:] = self.r[perm]
+        self.v[:] = self.v[perm]
+        self.i[:] = self.i[perm]
+        self.types[:] = self.types[perm]
+        self.order[:] = self.order[perm]
+
     def write_xyz(
         self,
         filename: str,
@@ -97,7 +260,7 @@ class Atoms:
         unfold: bool = False,
     ):
         """
-        Saves atoms informations on a .xyz file.
+        Saves atoms informations on a .xyz file, in their original order.
 
         Args:
             filename (str): filename of the .xyz file
@@ -108,20 +271,109 @@ class Atoms:
             unfold (bool, optional): if True, unfolds the coordinates as r+i*L.
                 Defaults to False.
         """
+        # Original order of the atoms
+        idx = np.argsort(self.order)
         with open(filename, "a" if append else "w") as f:
             xyz_out(
                 f,
-                self.r,
-                self.v,
-                self.i,
+                self.r[idx],
+                self.v[idx],
+                self.i[idx],
                 self.L,
-                elem=self.elem.name,
+                elem=self.names[idx] if self.ntypes > 1 else self.elem.name,
                 put_vel=put_vel,
                 unfold=unfold,
             )
 
+    def write_trj(
+        self, filename: str, append: bool = False, put_vel: bool = True
+    ):
+        """
+        Saves atoms informations as a frame of a binary trajectory, in their
+        original order, see pymd.util.trj_out. Positions are stored folded
+        in the box with the box crossings, so the frame is lossless.
+
+        Args:
+            filename (str): filename of the .trj file
+            append (bool, optional): if True, appends to an existing file.
+                Defaults to False.
+            put_vel (bool, optional): if True, puts velocities into the file.
+                Defaults to True.
+        """
+        # Original order of the atoms
+        idx = np.argsort(self.order)
+        trj_out(
+            filename,
+            self.r[idx],
+            self.v[idx],
+            self.i[idx],
+            self.rho,
+            elem=[elem.name for elem in self.species],
+            types=self.types[idx] if self.ntypes > 1 else None,
+            put_vel=put_vel,
+            append=append,
+        )
+
     def copy(self) -> Atoms:
-        return deepcopy(self)
+        """
+        Copy of the atoms, in their original order.
+
+        Returns:
+            Atoms: Atoms object
+        """
+        atoms = deepcopy(self)
+        atoms.unsort()
+        return atoms
+
+
+def mixture(
+    N: int, rho: float, composition: Dict[str, float], **kwargs
+) -> Atoms:
+    """
+    Generates Atoms object of a mixture of elements defined in the
+    species JSON file, with the species randomly assigned to the atoms.
+    The first element defines the normal units.
+
+    Args:
+        N (int): number of atoms
+        rho (float): density of atoms
+        composition (Dict[str, float]): fraction, or number, of atoms of
+            every element, normalized to N
+        **kwargs: additional arguments of Atoms
+
+    Returns:
+        Atoms: Atoms object
+    """
+    x = np.array(list(composition.values()), dtype=np.float64)
+    x *= N / x.sum()
+    counts = np.floor(x).astype(int)
+    # Give the atoms left to the largest remainders
+    left = N - counts.sum()
+    counts[np.argsort(counts - x)[:left]] += 1
+    types = np.repeat(np.arange(len(counts)), counts)
+    np.random.shuffle(types)
+    species = [gen_element(name) for name in composition]
+    return Atoms(N, rho, species, types=types, **kwargs)
+
+
+def species_types(elems: NDArray) -> Tuple[List[Element], NDArray]:
+    """
+    Species and types of the atoms from their element names, the species
+    are in order of first appearance.
+
+    Args:
+        elems (NDArray): element name of every atom
+
+    Returns:
+        Tuple[List[Element], NDArray]: species and types of the atoms
+    """
+    names, first, types = np.unique(
+        elems, return_index=True, return_inverse=True
+    )
+    order = np.argsort(first)
+    rank = np.argsort(order)
+    species = [gen_element(names[k]) for k in order]
+    return species, rank[types]
 
 
 def fromfile(rho: float, init_cfg_file: str, **kwargs) -> Atoms:
@@ -137,8 +389,8 @@ def fromfile(rho: float, init_cfg_file: str, **kwargs) -> Atoms:
     """
     with open(init_cfg_file, "r") as f:
         N, elems, r, v = xyz_in(f)
-    elem = gen_element(elems[0])
-    return Atoms(N, rho, elem, r, v, **kwargs)
+    species, types = species_types(elems)
+    return Atoms(N, rho, species, r, v, types=types, **kwargs)
 
 
 def atomslist_fromfile(
@@ -154,48 +406,66 @@ def atomslist_fromfile(
     Returns:
         List[Atoms]: List of Atoms objects
     """
-    atomslist = []
-    with open(init_cfg_file, "r") as f:
-        N = int(next(f).split()[0])
-        lines = sum(1 for line in f) + 1
-    steps = lines // (N + 2)
-    with open(init_cfg_file, "r") as f:
-        for s in range(steps):
-            N, elems, r, v = xyz_in(f)
-            elem = gen_element(elems[0])
-            atomslist.append(Atoms(N, rho, elem, r, v, **kwargs))
-    return atomslist
+    # Imported here, as pymd.trajectory imports this module
+    from pymd.trajectory import XYZTrajectory
+
+    return XYZTrajectory(init_cfg_file, rho).atomslist(**kwargs)
 
 
 def pair_correlation(
-    atomslist: List[Atoms], rc: float, dr: float
-) -> NDArray[(2, Any), float]:
+    atomslist: List[Atoms],
+    rc: float,
+    dr: float,
+    backend: Union[str, Backend] = None,
+    partial: bool = False,
+) -> Union[NDArray[(2, Any), float], Tuple[NDArray, NDArray]]:
     """
     Calculate pair correlation function from a list of Atoms
-    objects.
+    objects. With partial, the partial pair correlation functions of a
+    mixture are computed in the same pass: g_ab(r) is the density of
+    atoms of species b at distance r from an atom of species a, over the
+    average density of species b.
 
     Args:
         atomslist (List[Atoms]): list of atoms objects to use as sample
         rc (float): cutoff radius for pair interaction
         dr (float): size of bin
+        backend (Union[str, Backend], optional): kernels backend.
+            Defaults to None, see get_backend.
+        partial (bool, optional): compute the partial pair correlation
+            functions. Defaults to False.
 
     Returns:
-        NDArray[(2, Any), float]: pair correlation function as (r, g(r)) array
+        Union[NDArray[(2, Any), float], Tuple[NDArray, NDArray]]: pair
+            correlation function as (r, g(r)) array, or with partial the
+            positions of bins and g_ab(r), as a (T,T,nbins) array
     """
     # Calc number of bins and create histogram
     nbins = int(rc / dr) + 1
-    hist = np.zeros(nbins, dtype=int)
+    ntypes = atomslist[0].ntypes if partial else 1
+    hist = np.zeros((ntypes, ntypes, nbins), dtype=int)
     # Update histogram using a cython method
+    calc_hist = get_backend(backend).calc_hist
     for atoms in atomslist:
-        hist += calc_hist(atoms.r, atoms.L, rc, dr)
+        if partial:
+            hist += calc_hist(atoms.r, atoms.L, rc, dr, atoms.types, ntypes)
+        else:
+            hist[0, 0] += calc_hist(atoms.r, atoms.L, rc, dr)
     # Normalize the histogram
     ngr = len(atomslist)
     N = atomslist[0].N
     rho = atomslist[0].rho
+    # Number of atoms of every species, 1 for all of them
+    x = atomslist[0].fractions if partial else np.ones(1)
     bins = np.arange(nbins)
     vb = ((bins + 1) ** 3 - bins ** 3) * (dr ** 3)
-    g = hist / ((4 / 3) * np.pi * vb * rho * N * ngr)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        g = hist / (
+            (4 / 3) * np.pi * vb * rho * N * ngr * np.outer(x, x)[..., None]
+        )
     # Calc positions of bins
     r = dr * (bins + 0.5)
+    if partial:
+        return r, g
     # Return array (r,g(r))
-    return np.array([r, g])
+    return np.array([r, g[0, 0]])
@@ -0,0 +1,138 @@
+import os
+import warnings
+from importlib import import_module
+from types import ModuleType
+from typing import Callable, Dict, List, Optional, Union
+
+# Environment variable used to choose the backend when none is given
+BACKEND_ENV = "PYMD_BACKEND"
+DEFAULT_BACKEND = "serial"
+# Backend used when the default one can't be imported
+FALLBACK_BACKEND = "numpy"
+
+# Registered backends, as lists of modules to look for the kernels in
+_registry: Dict[str, List[str]] = {
+    "serial": ["pymd.force_LJ", "pymd.pair_corr"],
+    "openmp": ["pymd.force_LJ_par", "pymd.pair_corr_par"],
+    "numpy": ["pymd.force_LJ_numpy", "pymd.pair_corr_numpy"],
+}
+_loaded: Dict[str, "Backend"] = {}
+
+
+class Backend:
+    """
+    Set of compiled kernels used by Atoms and State objects. Kernels
+    (force, force_cell, build_neighbors, force_neighbors, calc_hist, ...)
+    are accessed as attributes, and are searched in the modules of the
+    backend in order.
+
+    Attributes:
+        name (str): name of the backend
+        modules (List[ModuleType]): modules implementing the kernels
+    """
+
+    def __init__(self, name: str, modules: List[ModuleType]):
+        """
+        Initialize Backend object.
+
+        Args:
+            name (str): name of the backend
+            modules (List[ModuleType]): modules implementing the kernels
+        """
+        self.name = name
+        self.modules = modules
+
+    def __getattr__(self, kernel: str) -> Callable:
+        for module in self.__dict__.get("modules", []):
+            if hasattr(module, kernel):
+                return getattr(module, kernel)
+        raise AttributeError(
+            f"Kernel {kernel} not implemented by backend {self.name}"
+        )
+
+    def has(self, kernel: str) -> bool:
+        """
+        Check if the backend implements a kernel.
+
+        Args:
+            kernel (str): name of the kernel
+
+        Returns:
+            bool: True if the kernel is implemented
+        """
+        return any(hasattr(module, kernel) for module in self.modules)
+
+    def __str__(self):
+        return self.name
+
+
+def register_backend(name: str, modules: List[str]):
+    """
+    Register a new backend, or replace an existing one.
+
+    Args:
+        name (str): name of the backend
+        modules (List[str]): names of the modules implementing the kernels,
+            in lookup order
+    """
+    _registry[name] = list(modules)
+    _loaded.pop(name, None)
+
+
+def get_backend(name: Optional[Union[str, Backend]] = None) -> Backend:
+    """
+    Get a backend by name. If name is None, uses the PYMD_BACKEND
+    environment variable, defaulting to "serial"; if that backend can't
+    be imported, for example because the Cython extensions were not
+    built, warns and falls back to the pure NumPy backend. Backend
+    objects are returned as they are.
+
+    Args:
+        name (Union[str, Backend], optional): name of the backend.
+            Defaults to None.
+
+    Raises:
+        ValueError: if the backend is not registered
+        ImportError: if the modules of the backend can't be imported
+
+    Returns:
+        Backend: the backend object
+    """
+    if isinstance(name, Backend):
+        return name
+    if name is None:
+        name = os.environ.get(BACKEND_ENV, DEFAULT_BACKEND)
+        try:
+            return get_backend(name)
+        except ImportError as error:
+            warnings.warn(
+                f"Backend {name} can't be imported ({error}), using the "
+                f"slower {FALLBACK_BACKEND} backend",
+                RuntimeWarning,
+            )
+            return get_backend(FALLBACK_BACKEND)
+    if name not in _registry:
+        raise ValueError(
+            f"Unknown backend {name}, choose from {list(_registry)}"
+        )
+    if name not in _loaded:
+        modules = [import_module(module) for module in _registry[name]]
+        _loaded[name] = Backend(name, modules)
+    return _loaded[name]
+
+
+def available_backends() -> List[str]:
+    """
+    List of registered backends that can be imported.
+
+    Returns:
+        List[str]: list of names of the backends
+    """
+    available = []
+    for name in _registry:
+        try:
+            get_backend(name)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
@@ -0,0 +1,398 @@
+from typing import List, Union
+
+import numpy as np
+from nptyping import NDArray
+
+from pymd.atoms import Atoms
+from pymd.backend import Backend, get_backend
+from pymd.state import NVEState, andersen_collisions
+
+
+class BatchState:
+    """
+    Batch of B independent replicas of N atoms of a single species with
+    the Lennard-Jones potential, in normal units. Positions, velocities,
+    forces and box crossings of all the replicas are stored as (B,N,3)
+    arrays, and a step advances them all with a single call of the
+    compiled kernel of the backend, so the Python overhead of a step is
+    paid once for the batch. Every replica has its own box length, cutoff
+    radius and temperature; with a collision frequency nu, every replica
+    is coupled to an Andersen thermostat at its own bath temperature, see
+    NVTAndersenState, whose collisions are drawn in blocks of steps from
+    the random generator of the batch.
+
+    Attributes:
+        atoms (List[Atoms]): the replicas, whose positions, velocities and
+            box crossings are views of the arrays of the batch; they must
+            not be sorted or change layout
+        B (int): number of replicas
+        N (int): number of atoms of every replica
+        time (float): time of simulation
+        r (NDArray): positions, as (B,N,3)
+        v (NDArray): velocities, as (B,N,3)
+        f (NDArray): forces, as (B,N,3)
+        i (NDArray): box crossing counters, as (B,N,3)
+        rho (NDArray): density of every replica
+        L (NDArray): box length of every replica
+        rc (NDArray): cutoff radius of every replica
+        Tbath (NDArray): bath temperature of every replica
+        nu (float): collision frequency of the thermostat, 0 for none
+        seed (int): seed of the random generator
+        rng (np.random.Generator): random generator of the thermostat
+        block (int): steps of a block of collisions, see
+            pymd.state.andersen_collisions
+        collisions (Dict): collisions of all the atoms of the batch in the
+            current block, None before the first one
+        block_step (int): steps done of the current block
+        backend (Backend): compiled kernels used for the steps
+        buffers (Tuple[NDArray, NDArray, NDArray]): cell buffers of every
+            replica, as (head, nxt, cell)
+        corr (Dict[str,NDArray]): energy at cutoff, energy correction and
+            pressure correction of every replica
+        PE, KE, TE, TE0, drift, T, P (NDArray): state variables of every
+            replica, see NVEState
+    """
+
+    OUTDTYPE = NVEState.OUTDTYPE
+
+    def __init__(
+        self,
+        atoms: List[Atoms],
+        T0: Union[NDArray, float],
+        rc: Union[NDArray, float],
+        Tbath: Union[NDArray, float] = None,
+        nu: float = 0.0,
+        use_e_corr: bool = False,
+        backend: Union[str, Backend] = None,
+        seed: Union[int, np.random.SeedSequence] = None,
+        block: int = 1000,
+    ):
+        """
+        Initialize BatchState object from the replicas, which are brought
+        to their original order and stored in the arrays of the batch.
+
+        Args:
+            atoms (List[Atoms]): replicas, with the same number of atoms of
+                the same element and the same precision
+            T0 (Union[NDArray, float]): initial temperature, of all the
+                replicas or of every one
+            rc (Union[NDArray, float]): cutoff radius, of all the replicas
+                or of every one
+            Tbath (Union[NDArray, float], optional): bath temperature of
+                the thermostat. Defaults to None, T0.
+            nu (float, optional): collision frequency of the thermostat.
+                Defaults to 0.0, no thermostat.
+            use_e_corr (bool, optional): Use energy corrections.
+                Defaults to False.
+            backend (Union[str, Backend], optional): Kernels backend.
+                Defaults to None, see get_backend.
+            seed (Union[int, SeedSequence], optional): seed of the random
+                generator of the thermostat. Defaults to None, a fresh
+                seed from the OS.
+            block (int, optional): steps of a block of collisions drawn at
+                once. Defaults to 1000.
+
+        Raises:
+            ValueError: if the replicas have different sizes, elements or
+                precisions, or more than one species
+            ValueError: if a cutoff radius is greater than half box length
+        """
+        self.atoms = list(atoms)
+        first = self.atoms[0]
+        for replica in self.atoms:
+            if (
+                replica.N != first.N
+                or replica.ntypes > 1
+                or replica.elem.name != first.elem.name
+                or replica.dtype != first.dtype
+            ):
+                raise ValueError(
+                    "Replicas must have the same number of atoms of the "
+                    "same element, in the same precision"
+                )
+        self.B = len(self.atoms)
+        self.N = first.N
+        self.time = 0.0
+        self.backend = get_backend(backend)
+        for replica in self.atoms:
+            replica.unsort()
+        self.r = np.stack([replica.r for replica in self.atoms])
+        self.v = np.stack([replica.v for replica in self.atoms])
+        self.i = np.stack([replica.i for replica in self.atoms])
+        for b, replica in enumerate(self.atoms):
+            replica.r = self.r[b]
+            replica.v = self.v[b]
+            replica.i = self.i[b]
+            replica.layout = "aos"
+        self.rho = np.array([replica.rho for replica in self.atoms])
+        self.L = np.array([replica.L for replica in self.atoms])
+        self.rc = np.broadcast_to(np.asarray(rc, dtype=np.float64), self.B)
+        self.rc = self.rc.copy()
+        if np.any(self.rc > self.L / 2):
+            raise ValueError(
+                "Cutoff radius can't be greater than half box length"
+            )
+        T0 = np.broadcast_to(np.asarray(T0, dtype=np.float64), self.B)
+        if Tbath is None:
+            Tbath = T0
+        self.Tbath = np.broadcast_to(
+            np.asarray(Tbath, dtype=np.float64), self.B
+        ).copy()
+        self.nu = nu
+        self.block = block
+        self.reseed(seed)
+        self.buffers = self.allocate_buffers()
+        self.corr = self.corrections(use_e_corr)
+        self.f = np.empty_like(self.r)
+        self.PE = np.empty(self.B)
+        vir = np.empty(self.B)
+        for b in range(self.B):
+            self.f[b], self.PE[b], vir[b] = self.backend.force(
+                self.r[b],
+                self.L[b],
+                self.rc[b],
+                self.corr["ecorr"][b],
+                self.corr["ecut"][b],
+            )
+        KE = self.kinetic()
+        hot = T0 > 0
+        scale = np.sqrt(T0[hot] / (KE[hot] * 2 / 3.0 / self.N))
+        self.v[hot] *= scale[:, None, None].astype(self.v.dtype)
+        self.calc_vars(vir)
+
+    def reseed(self, seed: Union[int, np.random.SeedSequence] = None):
+        """
+        Restarts the thermostat with a new random generator, discarding
+        the collisions drawn.
+
+        Args:
+            seed (Union[int, SeedSequence], optional): seed of the random
+                generator. Defaults to None, a fresh seed from the OS.
+        """
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.collisions = None
+        self.block_step = 0
+
+    def allocate_buffers(self) -> tuple:
+        """
+        Allocates the cell buffers of every replica, as (head, nxt, cell);
+        replicas with less than 3 cells per side use the all-pairs loop.
+
+        Returns:
+            tuple: cell buffers of the compiled step
+        """
+        M = 0
+        if self.backend.has("cells_per_side"):
+            for L, rc in zip(self.L, self.rc):
+                cells = self.backend.cells_per_side(L, rc)
+                M = max(M, cells ** 3 if cells >= 3 else 0)
+        return (
+            np.empty((self.B, M), dtype=np.intc),
+            np.empty((self.B, self.N), dtype=np.intc),
+            np.empty((self.B, self.N, 3), dtype=np.intc),
+        )
+
+    def corrections(self, use_e_corr: bool) -> dict:
+        """
+        Computes the energy at cutoff and the tail corrections of the
+        Lennard-Jones potential of every replica, see
+        NVEState.corrections.
+
+        Args:
+            use_e_corr (bool): if True, computes energy and pressure
+                corrections.
+
+        Returns:
+            dict: energy at cutoff, energy correction and pressure
+                correction, as arrays of B
+        """
+        rr3 = self.rc ** -3.0
+        ecut = 4 * (rr3 ** 4 - rr3 ** 2)
+        ecorr = 8 * np.pi * self.rho * (rr3 ** 3 / 9 - rr3 / 3)
+        pcorr = 16 / 3 * np.pi * self.rho ** 2 * (2 / 3 * rr3 ** 3 - rr3)
+        if not use_e_corr:
+            ecorr = np.zeros(self.B)
+            pcorr = np.zeros(self.B)
+        return {"ecut": ecut, "ecorr": ecorr, "pcorr": pcorr}
+
+    def step(self, dt: float, out: NDArray = None):
+        """
+        Simulation step of all the replicas: velocity verlet step, in the
+        compiled kernel if the backend has one, and thermostat.
+
+        Args:
+            dt (float): timestep
+            out (NDArray, optional): output column, as output[:,i], where
+                the state variables of the replicas are written.
+                Defaults to None.
+        """
+        self.time += dt
+        if self.backend.has("vv_batch"):
+            thermo = np.empty((self.B, 3))
+            self.backend.vv_batch(
+                self.r,
+                self.v,
+                self.f,
+                self.i,
+                self.L,
+                dt,
+                self.rc,
+                self.corr["ecorr"],
+                self.corr["ecut"],
+                *self.buffers,
+                thermo,
+            )
+            self.PE, vir, KE = thermo.T
+        else:
+            self.PE, vir, KE = self.replica_steps(dt)
+        KE = KE + self.thermostat(dt)
+        self.calc_vars(vir, KE)
+        if out is not None:
+            self.vars_output(out)
+
+    def replica_steps(self, dt: float) -> tuple:
+        """
+        Velocity verlet step of the replicas one at a time, with the force
+        kernel of the backend, for backends without vv_batch.
+
+        Args:
+            dt (float): timestep
+
+        Returns:
+            tuple: potential energy, virial and kinetic energy of every
+                replica
+        """
+        PE = np.empty(self.B)
+        vir = np.empty(self.B)
+        self.v += 0.5 * dt * self.f
+        self.r += self.v * dt
+        for b, replica in enumerate(self.atoms):
+            replica.wrap()
+            self.f[b], PE[b], vir[b] = self.backend.force(
+                self.r[b],
+                self.L[b],
+                self.rc[b],
+                self.corr["ecorr"][b],
+                self.corr["ecut"][b],
+            )
+        self.v += 0.5 * dt * self.f
+        return PE, vir, self.kinetic()
+
+    def thermostat(self, dt: float) -> NDArray:
+        """
+        Andersen thermostat of every replica at its bath temperature, see
+        NVTAndersenState.thermostat. The collisions of all the atoms of
+        the batch are drawn at once for a block of steps, so the cost of
+        a step scales with its collisions; a new timestep or frequency
+        starts a new block.
+
+        Args:
+            dt (float): timestep
+
+        Returns:
+            NDArray: change of kinetic energy of every replica
+        """
+        if not self.nu:
+            return np.zeros(self.B)
+        if (
+            self.collisions is None
+            or self.collisions["dt"] != dt
+            or self.collisions["nu"] != self.nu
+            or self.block_step >= self.block
+        ):
+            self.collisions = andersen_collisions(
+                self.rng, self.B * self.N, self.nu, dt, self.block
+            )
+            self.block_step = 0
+        start, stop = self.collisions["bounds"][
+            self.block_step : self.block_step + 2
+        ]
+        self.block_step += 1
+        b, i = np.divmod(self.collisions["atoms"][start:stop], self.N)
+        vold = self.v[b, i]
+        scale = np.sqrt(self.Tbath[b])[:, None]
+        vnew = scale * self.collisions["v"][start:stop]
+        vnew += 0.5 * dt * self.f[b, i]
+        self.v[b, i] = vnew
+        return 0.5 * np.bincount(
+            b,
+            weights=np.sum(vnew * vnew, 1) - np.sum(vold * vold, 1),
+            minlength=self.B,
+        )
+
+    def run(
+        self, nsteps: int, dt: float, out: NDArray[OUTDTYPE] = None
+    ) -> NDArray[OUTDTYPE]:
+        """
+        Run all the replicas for a given number of timesteps.
+
+        Args:
+            nsteps (int): number of timesteps
+            dt (float): timestep
+            out (NDArray, optional): output array, as (B,nsteps), where the
+                state variables of every replica and step are written.
+                Defaults to None.
+
+        Returns:
+            NDArray: output array with the state variables of every
+                replica and step, as (B,nsteps) [time, KE, PE, TE, drift,
+                T, P]
+        """
+        if out is None:
+            out = np.empty((self.B, nsteps), dtype=self.OUTDTYPE)
+        for s in range(nsteps):
+            self.step(dt, out=out[:, s])
+        return out
+
+    def kinetic(self) -> NDArray:
+        """
+        Kinetic energy of every replica.
+
+        Returns:
+            NDArray: kinetic energies
+        """
+        return 0.5 * np.einsum("bij,bij->b", self.v, self.v, dtype=np.float64)
+
+    def vars_output(self, out: NDArray[OUTDTYPE] = None) -> NDArray[OUTDTYPE]:
+        """
+        Outputs the state variables of every replica.
+
+        Args:
+            out (NDArray, optional): output column, as output[:,i], where
+                the variables are written instead of a new array.
+                Defaults to None.
+
+        Returns:
+            NDArray: output array with the state variables, as (B)
+                [time, KE, PE, TE, drift, T, P]
+        """
+        if out is None:
+            out = np.empty(self.B, dtype=self.OUTDTYPE)
+        out["time"] = self.time
+        out["KE"] = self.KE
+        out["PE"] = self.PE
+        out["TE"] = self.TE
+        out["drift"] = self.drift
+        out["T"] = self.T
+        out["P"] = self.P
+        return out
+
+    def calc_vars(self, vir: NDArray, KE: NDArray = None):
+        """
+        Calculate the state variables of every replica.
+
+        Args:
+            vir (NDArray): virial term of every replica
+            KE (NDArray, optional): kinetic energy of every replica, if
+                already known. Defaults to None.
+        """
+        if KE is None:
+            KE = self.kinetic()
+        self.KE = KE
+        if self.time == 0:
+            self.TE0 = self.PE + self.KE
+        self.TE = self.PE + self.KE
+        self.drift = (self.TE - self.TE0) / self.TE0
+        self.T = self.KE * 2 / 3.0 / self.N
+        self.P = self.rho * self.T + vir / 3.0 / self.L ** 3
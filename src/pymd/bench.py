@@ -0,0 +1,474 @@
+import io
+import time
+from typing import Callable, Iterable, Union
+
+import numpy as np
+from nptyping import NDArray
+
+from pymd.atoms import Atoms
+from pymd.backend import Backend, available_backends, get_backend
+from pymd.element import gen_element
+from pymd.ewald import SPME, ewald_parameters, ewald_sum
+from pymd.potential import tabulate
+from pymd.state import NVEState, RESPAState
+from pymd.util import xyz_loadtxt, xyz_out, xyz_parse, xyz_savetxt
+
+# Kernel timed for each force method
+KERNELS = {"n2": "force", "cell": "force_cell"}
+
+
+def best_time(kernel, *args, repeat: int = 5) -> float:
+    """
+    Best wall time of a kernel over some calls.
+
+    Args:
+        kernel (Callable): function to time
+        *args: arguments of the kernel
+        repeat (int, optional): number of calls. Defaults to 5.
+
+    Returns:
+        float: best time, in seconds
+    """
+    best = np.inf
+    for _ in range(repeat):
+        t = time.perf_counter()
+        kernel(*args)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def thread_scaling(
+    N: int,
+    rho: float = 0.8,
+    rc: float = 2.5,
+    threads: Iterable[int] = (1, 2, 4, 8),
+    method: str = "cell",
+    backend: Union[str, Backend] = "openmp",
+    repeat: int = 5,
+) -> NDArray:
+    """
+    Strong scaling of a force kernel: time of a force evaluation on
+    the same random system with an increasing number of threads.
+
+    Args:
+        N (int): number of atoms
+        rho (float, optional): density. Defaults to 0.8.
+        rc (float, optional): cutoff radius. Defaults to 2.5.
+        threads (Iterable[int], optional): thread counts to use.
+            Defaults to (1, 2, 4, 8).
+        method (str, optional): force method, "n2" or "cell".
+            Defaults to "cell".
+        backend (Union[str, Backend], optional): backend to time, it must
+            implement set_num_threads. Defaults to "openmp".
+        repeat (int, optional): calls per thread count, the best one is
+            kept. Defaults to 5.
+
+    Raises:
+        ValueError: if the backend can't set the number of threads
+
+    Returns:
+        NDArray: structured array with fields threads, time, speedup and
+            efficiency, one row for thread count
+    """
+    backend = get_backend(backend)
+    if not backend.has("set_num_threads"):
+        raise ValueError(f"Backend {backend} can't set the number of threads")
+    kernel = getattr(backend, KERNELS[method])
+    atoms = Atoms(N, rho, gen_element("Ar"))
+    atoms.r += np.random.uniform(-0.1, 0.1, atoms.r.shape)
+    atoms.wrap()
+    threads = list(threads)
+    out = np.zeros(
+        len(threads),
+        dtype=[
+            ("threads", np.int64),
+            ("time", np.float64),
+            ("speedup", np.float64),
+            ("efficiency", np.float64),
+        ],
+    )
+    previous = backend.get_num_threads()
+    try:
+        for row, n in zip(out, threads):
+            backend.set_num_threads(n)
+            row["threads"] = n
+            row["time"] = best_time(
+                kernel, atoms.r, atoms.L, rc, 0.0, 0.0, repeat=repeat
+            )
+    finally:
+        backend.set_num_threads(previous)
+    out["speedup"] = out["time"][0] / out["time"]
+    out["efficiency"] = out["speedup"] * out["threads"][0] / out["threads"]
+    return out
+
+
+def precision_benchmark(
+    N: int,
+    steps: int = 1000,
+    dt: float = 0.005,
+    rho: float = 0.8,
+    T0: float = 1.0,
+    rc: float = 2.5,
+    method: str = "cell",
+    backend: Union[str, Backend] = None,
+    precisions: Iterable[str] = ("double", "single"),
+    layout: str = "aos",
+) -> NDArray:
+    """
+    Throughput and energy conservation of the same NVE run in double and
+    single precision, starting from the same random velocities.
+
+    Args:
+        N (int): number of atoms
+        steps (int, optional): number of timesteps. Defaults to 1000.
+        dt (float, optional): timestep. Defaults to 0.005.
+        rho (float, optional): density. Defaults to 0.8.
+        T0 (float, optional): initial temperature. Defaults to 1.0.
+        rc (float, optional): cutoff radius. Defaults to 2.5.
+        method (str, optional): force method. Defaults to "cell".
+        backend (Union[str, Backend], optional): kernels backend.
+            Defaults to None, see get_backend.
+        precisions (Iterable[str], optional): precisions to compare.
+            Defaults to ("double", "single").
+        layout (str, optional): layout of positions, single precision
+            pays off mostly with the vectorized "soa" kernels.
+            Defaults to "aos".
+
+    Returns:
+        NDArray: structured array with fields precision, time, steps_s
+            (steps per second), drift (final relative energy drift) and
+            max_drift (largest one during the run), one row for precision
+    """
+    precisions = list(precisions)
+    out = np.zeros(
+        len(precisions),
+        dtype=[
+            ("precision", "U6"),
+            ("time", np.float64),
+            ("steps_s", np.float64),
+            ("drift", np.float64),
+            ("max_drift", np.float64),
+        ],
+    )
+    v = np.random.exponential(size=(N, 3))
+    for row, precision in zip(out, precisions):
+        atoms = Atoms(
+            N,
+            rho,
+            gen_element("Ar"),
+            v=v.copy(),
+            layout=layout,
+            precision=precision,
+        )
+        state = NVEState(atoms, T0, rc, method=method, backend=backend)
+        t = time.perf_counter()
+        thermo = state.run(steps, dt, steps)
+        row["precision"] = precision
+        row["time"] = time.perf_counter() - t
+        row["steps_s"] = steps / row["time"]
+        row["drift"] = thermo["drift"][-1]
+        row["max_drift"] = np.abs(thermo["drift"]).max()
+    return out
+
+
+def backend_benchmark(
+    N: int,
+    rho: float = 0.8,
+    rc: float = 2.5,
+    dr: float = 0.02,
+    backends: Iterable[str] = None,
+    repeat: int = 3,
+) -> NDArray:
+    """
+    Time of the force and pair correlation kernels of every backend, on
+    the same random system.
+
+    Args:
+        N (int): number of atoms
+        rho (float, optional): density. Defaults to 0.8.
+        rc (float, optional): cutoff radius. Defaults to 2.5.
+        dr (float, optional): bin of the pair correlation histogram.
+            Defaults to 0.02.
+        backends (Iterable[str], optional): backends to time. Defaults
+            to None, all the available ones.
+        repeat (int, optional): calls per kernel, the best one is kept.
+            Defaults to 3.
+
+    Returns:
+        NDArray: structured array with fields backend and the best time
+            of force, force_cell and calc_hist, one row for backend
+    """
+    if backends is None:
+        backends = available_backends()
+    backends = list(backends)
+    out = np.zeros(
+        len(backends),
+        dtype=[
+            ("backend", "U12"),
+            ("force", np.float64),
+            ("force_cell", np.float64),
+            ("calc_hist", np.float64),
+        ],
+    )
+    atoms = Atoms(N, rho, gen_element("Ar"))
+    atoms.r += np.random.uniform(-0.1, 0.1, atoms.r.shape)
+    atoms.wrap()
+    for row, name in zip(out, backends):
+        backend = get_backend(name)
+        row["backend"] = name
+        for kernel in ("force", "force_cell"):
+            row[kernel] = best_time(
+                getattr(backend, kernel),
+                atoms.r,
+                atoms.L,
+                rc,
+                0.0,
+                0.0,
+                repeat=repeat,
+            )
+        row["calc_hist"] = best_time(
+            backend.calc_hist, atoms.r, atoms.L, rc, dr, repeat=repeat
+        )
+    return out
+
+
+def respa_benchmark(
+    N: int,
+    duration: float = 2.0,
+    dt: float = 0.02,
+    substeps: int = 4,
+    inner: float = 2.0,
+    switch: float = 0.5,
+    rho: float = 0.8,
+    T0: float = 1.0,
+    rc: float = 3.0,
+    method: str = "cell",
+    backend: Union[str, Backend] = None,
+    potential: Callable = None,
+) -> NDArray:
+    """
+    Throughput and energy conservation of RESPA with timestep dt against
+    velocity verlet with timesteps dt and dt/substeps, over the same
+    simulated time from the same equilibrated configuration.
+
+    Args:
+        N (int): number of atoms
+        duration (float, optional): simulated time. Defaults to 2.0.
+        dt (float, optional): outer timestep. Defaults to 0.02.
+        substeps (int, optional): inner substeps of RESPA. Defaults to 4.
+        inner (float, optional): cutoff radius of the inner part.
+            Defaults to 2.0.
+        switch (float, optional): width of the switch. Defaults to 0.5.
+        rho (float, optional): density. Defaults to 0.8.
+        T0 (float, optional): initial temperature. Defaults to 1.0.
+        rc (float, optional): cutoff radius. Defaults to 3.0.
+        method (str, optional): force method. Defaults to "cell".
+        backend (Union[str, Backend], optional): kernels backend.
+            Defaults to None, see get_backend.
+        potential (Callable, optional): pair potential, see NVEState.
+            Defaults to None, the Lennard-Jones potential.
+
+    Returns:
+        NDArray: structured array with fields integrator, dt, substeps,
+            time, tau_s (simulated time per second), evaluations (of the
+            full or outer forces), drift and max_drift, one row for run
+    """
+    atoms = Atoms(N, rho, gen_element("Ar"))
+    kwargs = dict(method=method, backend=backend, potential=potential)
+    state = NVEState(atoms, T0, rc, **kwargs)
+    # Equilibrate with the shortest timestep
+    steps = int(round(duration / dt))
+    state.run(steps, dt / substeps, steps)
+    runs = [("verlet", dt, 1), ("verlet", dt / substeps, 1)]
+    runs.append(("respa", dt, substeps))
+    out = np.zeros(
+        len(runs),
+        dtype=[
+            ("integrator", "U6"),
+            ("dt", np.float64),
+            ("substeps", np.int64),
+            ("time", np.float64),
+            ("tau_s", np.float64),
+            ("evaluations", np.int64),
+            ("drift", np.float64),
+            ("max_drift", np.float64),
+        ],
+    )
+    for row, (integrator, step, k) in zip(out, runs):
+        if integrator == "respa":
+            run = RESPAState(
+                state.atoms.copy(),
+                0,
+                rc,
+                inner=inner,
+                switch=switch,
+                substeps=k,
+                **kwargs,
+            )
+        else:
+            run = NVEState(state.atoms.copy(), 0, rc, **kwargs)
+        steps = int(round(duration / step))
+        t = time.perf_counter()
+        thermo = run.run(steps, step, steps)
+        row["integrator"] = integrator
+        row["dt"] = step
+        row["substeps"] = k
+        row["time"] = time.perf_counter() - t
+        row["tau_s"] = duration / row["time"]
+        row["evaluations"] = steps
+        row["drift"] = thermo["drift"][-1]
+        row["max_drift"] = np.abs(thermo["drift"]).max()
+    return out
+
+
+def ewald_benchmark(
+    sizes: Iterable[int] = (250, 500, 1000, 2000),
+    rho: float = 0.8,
+    rc: float = 3.0,
+    tol: float = 1e-5,
+    backend: Union[str, Backend] = None,
+    repeat: int = 3,
+) -> NDArray:
+    """
+    Time and accuracy of the smooth particle-mesh Ewald sum against the
+    direct Ewald sum at the same accuracy, on random neutral systems of
+    unit charges of increasing size. The real-space terms of SPME run in
+    the cell kernel of the backend with the spline tables, as in a state.
+
+    Args:
+        sizes (Iterable[int], optional): numbers of atoms. Defaults to
+            (250, 500, 1000, 2000).
+        rho (float, optional): density. Defaults to 0.8.
+        rc (float, optional): cutoff radius. Defaults to 3.0.
+        tol (float, optional): accuracy, see SPME.tuned. Defaults to 1e-5.
+        backend (Union[str, Backend], optional): kernels backend.
+            Defaults to None, see get_backend.
+        repeat (int, optional): calls of SPME, the best one is kept; the
+            direct sum is called once. Defaults to 3.
+
+    Returns:
+        NDArray: structured array with fields N, mesh, spme and ewald
+            (times), speedup, ferr (relative RMS error of the forces) and
+            eerr (relative error of the energy), one row for size
+    """
+    backend = get_backend(backend)
+    sizes = list(sizes)
+    out = np.zeros(
+        len(sizes),
+        dtype=[
+            ("N", np.int64),
+            ("mesh", np.int64),
+            ("spme", np.float64),
+            ("ewald", np.float64),
+            ("speedup", np.float64),
+            ("ferr", np.float64),
+            ("eerr", np.float64),
+        ],
+    )
+    charges = np.array([1.0, -1.0])
+    for row, N in zip(out, sizes):
+        atoms = Atoms(N, rho, gen_element("Ar"))
+        atoms.r += np.random.uniform(-0.1, 0.1, atoms.r.shape)
+        atoms.wrap()
+        types = np.random.permutation(np.arange(N) % 2).astype(np.intc)
+        q = charges[types]
+        spme = SPME.tuned(atoms.L, rc, tol, q=q)
+        table = tabulate(spme.real_space(charges), rc)
+
+        def spme_force():
+            f, e, vir = backend.force_cell(
+                atoms.r, atoms.L, rc, 0.0, 0.0, types=types, table=table
+            )
+            flong, elong, _ = spme.compute(atoms.r, q)
+            return f + flong, e + elong
+
+        _, mmax = ewald_parameters(rc, tol)
+        kmax = int(np.ceil(mmax * atoms.L))
+        row["N"] = N
+        row["mesh"] = spme.mesh
+        row["spme"] = best_time(spme_force, repeat=repeat)
+        t = time.perf_counter()
+        fref, eref, _ = ewald_sum(atoms.r, q, atoms.L, spme.alpha, rc, kmax)
+        row["ewald"] = time.perf_counter() - t
+        f, e = spme_force()
+        row["ferr"] = np.sqrt(np.sum((f - fref) ** 2) / np.sum(fref ** 2))
+        row["eerr"] = abs(e - eref) / abs(eref)
+    out["speedup"] = out["ewald"] / out["spme"]
+    return out
+
+
+def xyz_benchmark(
+    sizes: Iterable[int] = (1000, 8000, 32000),
+    rho: float = 0.8,
+    put_vel: bool = True,
+    repeat: int = 5,
+) -> NDArray:
+    """
+    Throughput of writing and reading a frame of an .xyz file in memory,
+    with the compiled formatter and parser of pymd.xyz_io, used by
+    xyz_out and xyz_parse, and with np.savetxt and np.loadtxt. Without
+    the compiled extension, xyz_out and xyz_parse fall back to NumPy.
+
+    Args:
+        sizes (Iterable[int], optional): numbers of atoms. Defaults to
+            (1000, 8000, 32000).
+        rho (float, optional): density. Defaults to 0.8.
+        put_vel (bool, optional): if True, frames have velocities.
+            Defaults to True.
+        repeat (int, optional): calls of every function, the best one is
+            kept. Defaults to 5.
+
+    Returns:
+        NDArray: structured array with fields N, MB (size of the frame)
+            and savetxt, xyz_out, loadtxt and xyz_parse (throughputs, in
+            MB/s), one row for size
+    """
+    sizes = list(sizes)
+    names = ["savetxt", "xyz_out", "loadtxt", "xyz_parse"]
+    out = np.zeros(
+        len(sizes),
+        dtype=[("N", np.int64), ("MB", np.float64)]
+        + [(name, np.float64) for name in names],
+    )
+    for row, N in zip(out, sizes):
+        atoms = Atoms(N, rho, gen_element("Ar"))
+        args = (atoms.r, atoms.v, atoms.i, atoms.L, "Ar", put_vel)
+        text = io.StringIO()
+        xyz_out(text, *args)
+        text = text.getvalue()
+        data = text.encode()
+        kernels = [
+            lambda: xyz_savetxt(io.StringIO(), *args),
+            lambda: xyz_out(io.StringIO(), *args),
+            lambda: xyz_loadtxt(io.StringIO(text)),
+            lambda: xyz_parse(data),
+        ]
+        row["N"] = N
+        row["MB"] = len(data) / 1e6
+        for name, kernel in zip(names, kernels):
+            row[name] = row["MB"] / best_time(kernel, repeat=repeat)
+    return out
+
+
+def report(table: NDArray) -> str:
+    """
+    Format the output of a benchmark as a text table.
+
+    Args:
+        table (NDArray): structured array returned by a benchmark
+
+    Returns:
+        str: the report
+    """
+    names = table.dtype.names
+    lines = [" ".join(f"{name:>12}" for name in names)]
+    for row in table:
+        cells = []
+        for name in names:
+            value = row[name]
+            if np.issubdtype(table.dtype[name], np.floating):
+                cells.append(f"{value:12.5g}")
+            else:
+                cells.append(f"{value:>12}")
+        lines.append(" ".join(cells))
+    return "\n".join(lines)
@@ -1,7 +1,10 @@
 import json
 import os
 from math import sqrt
-from typing import List
+from typing import List, Tuple
+
+import numpy as np
+from nptyping import NDArray
 
 
 class Element:
@@ -13,10 +16,18 @@ class Element:
         mass (float): mass of element
         sigma (float): sigma, in Lennard-Jones potential
         eps (float): epsilon, in Lennard-Jones potential
+        charge (float): charge of element
         units (Dict[str,float]): normal units for element
     """
 
-    def __init__(self, name: str, mass: float, sigma: float, eps: float):
+    def __init__(
+        self,
+        name: str,
+        mass: float,
+        sigma: float,
+        eps: float,
+        charge: float = 0.0,
+    ):
         """
         Initialize element.
 
@@ -25,13 +36,19 @@ class Element:
             mass (float): mass of element
             sigma (float): sigma, in Lennard-Jones potential
             eps (float): epsilon, in Lennard-Jones potential
+            charge (float, optional): charge of element, in elementary
+                charges. Defaults to 0.0.
         """
         # Boltzmann constant
         k = 1.380649e-23
+        # Elementary charge and vacuum permittivity
+        e = 1.602176634e-19
+        eps0 = 8.8541878128e-12
         self.name = name
         self.mass = mass * 1.661e-27
         self.sigma = sigma * 1e-9
         self.eps = eps * k
+        self.charge = charge * e
         self.units = {
             "length": self.sigma,
             "energy": self.eps,
@@ -42,6 +59,8 @@ class Element:
             "pressure": self.eps / (self.sigma ** 3),
             "velocity": sqrt(self.eps / self.mass),
             "force": self.eps / self.sigma,
+            # Charges q such that q^2/(4*pi*eps0*r) is in units of eps
+            "charge": sqrt(4 * np.pi * eps0 * self.sigma * self.eps),
         }
 
     def __str__(self):
@@ -69,7 +88,13 @@ def gen_element(name: str) -> Element:
     with open(filename, "r") as f:
         species = json.load(f)
         elem = [val for val in species if val["name"] == name][0]
-    elem = Element(name, elem["mass"], elem["sigma"], elem["eps"])
+    elem = Element(
+        name,
+        elem["mass"],
+        elem["sigma"],
+        elem["eps"],
+        elem.get("charge", 0.0),
+    )
     return elem
 
 
@@ -86,3 +111,46 @@ def available_elements() -> List[str]:
         species = json.load(f)
         elem_list = [specie["name"] for specie in species]
     return elem_list
+
+
+def lorentz_berthelot(
+    species: List[Element], ref: Element = None
+) -> Tuple[NDArray, NDArray]:
+    """
+    Lennard-Jones parameters of every pair of species, from the
+    Lorentz-Berthelot mixing rules: sigma_ab = (sigma_a+sigma_b)/2 and
+    epsilon_ab = sqrt(epsilon_a*epsilon_b). They are in the normal units of
+    the reference element.
+
+    Args:
+        species (List[Element]): elements of the mixture
+        ref (Element, optional): element defining the normal units.
+            Defaults to None, the first one of species.
+
+    Returns:
+        Tuple[NDArray, NDArray]: sigma and epsilon of the pairs, as
+            (T,T) arrays
+    """
+    if ref is None:
+        ref = species[0]
+    sigma = np.array([elem.sigma for elem in species]) / ref.sigma
+    eps = np.array([elem.eps for elem in species]) / ref.eps
+    return 0.5 * (sigma[:, None] + sigma[None, :]), np.sqrt(np.outer(eps, eps))
+
+
+def reduced_charges(species: List[Element], ref: Element = None) -> NDArray:
+    """
+    Charges of the species in the normal units of the reference element,
+    so that the Coulomb energy of a pair is q_a*q_b/r.
+
+    Args:
+        species (List[Element]): elements of the mixture
+        ref (Element, optional): element defining the normal units.
+            Defaults to None, the first one of species.
+
+    Returns:
+        NDArray: charge of every species
+    """
+    if ref is None:
+        ref = species[0]
+    return np.array([elem.charge for elem in species]) / ref.units["charge"]
@@ -0,0 +1,404 @@
+from math import log, pi, sqrt
+from typing import List, Tuple
+
+import numpy as np
+from nptyping import NDArray
+
+from pymd.force_LJ_numpy import blocks, separations
+from pymd.potential import ScreenedCoulomb, erfc
+
+# Largest number of atoms times wave vectors per block of the direct sum
+MAX_TERMS = 1 << 20
+
+# Unit charges in the sample of SPME.error, at least
+ERROR_SAMPLE = 64
+# Reciprocal terms left out by the reference sum of SPME.error
+ERROR_TRUNCATION = 1e-16
+
+
+def bspline_weights(w: NDArray, order: int) -> Tuple[NDArray, NDArray]:
+    """
+    Cardinal B-spline weights M_p(w+k), k = 0..p-1, of points at
+    fraction w of a mesh cell, and their derivatives, by the recursion
+    M_n(x) = (x*M_{n-1}(x) + (n-x)*M_{n-1}(x-1))/(n-1).
+
+    Args:
+        w (NDArray): fractional positions in the cell, from 0 to 1
+        order (int): order p of the B-splines, at least 3
+
+    Returns:
+        Tuple[NDArray, NDArray]: weights and derivatives, as (...,p)
+    """
+    k = np.arange(order)
+    x = w[..., None] + k
+    M = np.zeros(x.shape)
+    M[..., 0] = w
+    M[..., 1] = 1 - w
+    for n in range(3, order + 1):
+        if n == order:
+            dM = M - np.roll(M, 1, axis=-1)
+            dM[..., 0] = M[..., 0]
+        prev = np.roll(M, 1, axis=-1)
+        prev[..., 0] = 0
+        M = (x * M + (n - x) * prev) / (n - 1)
+    return M, dM
+
+
+def fft_size(n: int) -> int:
+    """
+    Smallest even number not less than n with no prime factors other
+    than 2, 3 and 5, for which the FFTs are fast.
+
+    Args:
+        n (int): lower bound
+
+    Returns:
+        int: mesh size
+    """
+    n = max(int(n), 2)
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1 and n % 2 == 0:
+            return n
+        n += 1
+
+
+def ewald_parameters(rc: float, tol: float) -> Tuple[float, float]:
+    """
+    Splitting parameter of the Ewald sum and largest wave number needed,
+    so that both the real-space terms at the cutoff and the reciprocal
+    terms beyond it are smaller than tol: erfc(alpha*rc) = tol and
+    exp(-(pi*m/alpha)^2) = tol.
+
+    Args:
+        rc (float): cutoff radius of the real-space sum
+        tol (float): relative accuracy
+
+    Returns:
+        Tuple[float, float]: alpha and largest wave number m, in inverse
+            lengths
+    """
+    lo, hi = 0.0, 10.0 / rc
+    for _ in range(60):
+        alpha = 0.5 * (lo + hi)
+        if erfc(alpha * rc) > tol:
+            lo = alpha
+        else:
+            hi = alpha
+    return alpha, alpha * sqrt(-log(tol)) / pi
+
+
+class SPME:
+    """
+    Smooth particle-mesh Ewald sum of the Coulomb energy of charges in a
+    periodic cubic box, in normal units (Essmann et al., J. Chem. Phys.
+    103, 8577, 1995). The Coulomb potential is split in a short-range
+    part, qq*erfc(alpha*r)/r, summed over the pairs within the cutoff by
+    the force kernels, see real_space, and a smooth long-range part summed
+    in reciprocal space: the charges are spread on a mesh with cardinal
+    B-splines, and the sum over the wave vectors is a convolution done
+    with FFTs, in O(N log N).
+
+    Attributes:
+        L (float): box length
+        alpha (float): splitting parameter
+        mesh (int): mesh points per side
+        order (int): order of the B-splines
+        G (NDArray): influence function B(m)*C(m) on the half mesh of
+            the real FFT, zero at m = 0
+        fold (NDArray): multiplicity of the points of the half mesh
+        m (NDArray): wave vectors of the half mesh, as (3,K,K,K//2+1)
+    """
+
+    def __init__(self, L: float, alpha: float, mesh: int, order: int = 6):
+        """
+        Initialize SPME object, computing the influence function.
+
+        Args:
+            L (float): box length
+            alpha (float): splitting parameter
+            mesh (int): mesh points per side
+            order (int, optional): order of the B-splines, at least 3.
+                Defaults to 6.
+
+        Raises:
+            ValueError: if the order is less than 3 or not less than mesh
+        """
+        if not 3 <= order < mesh:
+            raise ValueError("B-spline order must be from 3 to mesh-1")
+        self.L = L
+        self.alpha = alpha
+        self.mesh = mesh
+        self.order = order
+        K = mesh
+        k = np.fft.fftfreq(K, 1 / K)
+        kz = np.arange(K // 2 + 1)
+        # |b(m)|^2 of the B-spline interpolation, for every side
+        M, _ = bspline_weights(np.zeros(1), order)
+        phase = np.exp(2j * np.pi * np.outer(np.arange(K), k[: order - 1]) / K)
+        den = np.abs(phase @ M[0, 1:]) ** 2
+        b2 = np.where(den > 1e-10, 1 / np.maximum(den, 1e-10), 0.0)
+        self.m = np.stack(np.meshgrid(k, k, kz, indexing="ij")) / L
+        m2 = np.einsum("a...,a...->...", self.m, self.m)
+        m2[0, 0, 0] = 1
+        C = np.exp(-((pi / alpha) ** 2) * m2) / (pi * L ** 3 * m2)
+        C[0, 0, 0] = 0
+        self.G = C * b2[:, None, None] * b2[None, :, None] * b2[kz][None, None]
+        self.fold = np.where((kz == 0) | (2 * kz == K), 1.0, 2.0)
+
+    @classmethod
+    def tuned(
+        cls,
+        L: float,
+        rc: float,
+        tol: float = 1e-5,
+        order: int = 6,
+        q: NDArray = None,
+    ) -> "SPME":
+        """
+        SPME with the splitting parameter of the cutoff for tol, see
+        ewald_parameters, and the smallest mesh, starting from the one
+        resolving the largest wave number, whose estimated error is
+        within tol, see error. Accuracies are in units of the interaction
+        of two unit charges at unit distance: tol bounds the RMS error of
+        the forces and the error of the energy per atom.
+
+        Args:
+            L (float): box length
+            rc (float): cutoff radius of the real-space sum
+            tol (float, optional): accuracy. Defaults to 1e-5.
+            order (int, optional): order of the B-splines. Defaults to 6.
+            q (NDArray, optional): charge of every atom. Defaults to
+                None, unit charges at unit density.
+
+        Returns:
+            SPME: SPME object
+        """
+        alpha, mmax = ewald_parameters(rc, tol)
+        if q is None:
+            q = np.ones(max(int(round(L ** 3)), 1))
+        mesh = fft_size(max(2 * mmax * L, order + 1))
+        while True:
+            spme = cls(L, alpha, mesh, order)
+            if max(spme.error(q)) <= tol:
+                return spme
+            mesh = fft_size(mesh + 1)
+
+    def error(self, q: NDArray, seed: int = 0) -> Tuple[float, float]:
+        """
+        Estimated error of the reciprocal-space sum with charges q. The
+        error depends on the mesh spacing, the splitting parameter, the
+        order and the density of the charges, so it is measured on a
+        smaller box with the same mesh spacing and the same density of
+        squared charges, holding at least ERROR_SAMPLE random unit charges
+        at random positions, against the direct reciprocal sum, see
+        ewald_sum, and scaled by the charges.
+
+        Args:
+            q (NDArray): charge of every atom
+            seed (int, optional): seed of the sample. Defaults to 0.
+
+        Returns:
+            Tuple[float, float]: RMS error of the forces and error of the
+                energy per atom
+        """
+        q2 = np.asarray(q, dtype=np.float64) ** 2
+        density = q2.sum() / self.L ** 3
+        if density == 0:
+            return 0.0, 0.0
+        h = self.L / self.mesh
+        mesh = self.mesh
+        side = np.cbrt(ERROR_SAMPLE / density)
+        for size in range(self.order + 1, self.mesh):
+            if size == fft_size(size) and size * h >= side:
+                mesh = size
+                break
+        L = mesh * h
+        N = max(int(round(density * L ** 3)), 2)
+        rng = np.random.default_rng(seed)
+        r = rng.uniform(0, L, size=(N, 3))
+        charges = np.where(np.arange(N) % 2 == 0, 1.0, -1.0)
+        kmax = int(np.ceil(self.alpha * sqrt(-log(ERROR_TRUNCATION)) / pi * L))
+        fref, eref, _ = ewald_sum(r, charges, L, self.alpha, 0.0, kmax)
+        f, e, _ = SPME(L, self.alpha, mesh, self.order).compute(r, charges)
+        # Scaled by the unit charges of the sample to the charges q
+        ferr = np.sqrt(np.mean(np.sum((f - fref) ** 2, 1)) * q2.mean())
+        eerr = abs(e - eref) / N * q2.mean()
+        return float(ferr), float(eerr)
+
+    def real_space(self, charges: NDArray) -> List[List[ScreenedCoulomb]]:
+        """
+        Real-space pair potentials of the species, to be added to the
+        short-range ones and tabulated, see pymd.potential.tabulate.
+
+        Args:
+            charges (NDArray): charge of every species
+
+        Returns:
+            List[List[ScreenedCoulomb]]: potentials, indexed by the types
+        """
+        return [
+            [ScreenedCoulomb(a * b, self.alpha) for b in charges]
+            for a in charges
+        ]
+
+    def compute(
+        self,
+        r: NDArray,
+        q: NDArray,
+        forces: bool = True,
+        eatom: NDArray = None,
+        W: NDArray = None,
+    ) -> Tuple[NDArray, float, float]:
+        """
+        Reciprocal-space part of the Ewald sum, with the self energy of
+        the charges and the energy of a uniform background neutralizing
+        the net charge.
+
+        Args:
+            r (NDArray): array of positions, inside the box
+            q (NDArray): charge of every atom
+            forces (bool, optional): if False, only energy and virial
+                are computed. Defaults to True.
+            eatom (NDArray, optional): per-atom energies, where the
+                energy of every atom is added. Defaults to None.
+            W (NDArray, optional): virial tensor, as (3,3), where the
+                reciprocal-space virial is added. Defaults to None.
+
+        Returns:
+            Tuple[NDArray, float, float]: array of forces, None without
+                forces, energy, virial term
+        """
+        K = self.mesh
+        r = np.asarray(r, dtype=np.float64)
+        q = np.asarray(q, dtype=np.float64)
+        u = r * (K / self.L)
+        base = np.floor(u)
+        theta, dtheta = bspline_weights(u - base, self.order)
+        # Mesh points of every atom, (base - k) mod K
+        g = (base.astype(np.int64)[..., None] - np.arange(self.order)) % K
+        index = (g[:, 0, :, None, None] * K + g[:, 1, None, :, None]) * K + g[
+            :, 2, None, None, :
+        ]
+        w = (
+            theta[:, 0, :, None, None]
+            * theta[:, 1, None, :, None]
+            * theta[:, 2, None, None, :]
+        )
+        Q = np.bincount(
+            index.ravel(),
+            (q[:, None, None, None] * w).ravel(),
+            minlength=K ** 3,
+        )
+        FQ = np.fft.rfftn(Q.reshape(K, K, K))
+        EQ = 0.5 * self.fold * self.G * (FQ.real ** 2 + FQ.imag ** 2)
+        erec = float(EQ.sum())
+        m2 = np.einsum("a...,a...->...", self.m, self.m)
+        mfac = 2 * (1 + (pi / self.alpha) ** 2 * m2)
+        m2[0, 0, 0] = 1
+        vir = 3 * erec - float(np.sum(EQ * mfac))
+        Q0 = q.sum()
+        V = self.L ** 3
+        eself = -self.alpha / sqrt(pi) * q * q
+        ebg = -pi * Q0 / (2 * V * self.alpha ** 2) * q
+        e = erec + float(eself.sum() + ebg.sum())
+        vir += 3 * float(ebg.sum())
+        if W is not None:
+            W += erec * np.eye(3) - np.einsum(
+                "axyz,bxyz,xyz->ab", self.m, self.m, EQ * mfac / m2
+            )
+            W += float(ebg.sum()) * np.eye(3)
+        f = None
+        if forces or eatom is not None:
+            # Potential on the mesh, interpolated at the atoms
+            phi = np.fft.irfftn(FQ * self.G, s=(K, K, K)).ravel() * K ** 3
+            phi = phi[index]
+        if eatom is not None:
+            eatom += 0.5 * q * np.einsum("ixyz,ixyz->i", w, phi)
+            eatom += eself + ebg
+        if forces:
+            f = np.empty(r.shape)
+            f[:, 0] = np.einsum(
+                "ix,iy,iz,ixyz->i", dtheta[:, 0], theta[:, 1], theta[:, 2], phi
+            )
+            f[:, 1] = np.einsum(
+                "ix,iy,iz,ixyz->i", theta[:, 0], dtheta[:, 1], theta[:, 2], phi
+            )
+            f[:, 2] = np.einsum(
+                "ix,iy,iz,ixyz->i", theta[:, 0], theta[:, 1], dtheta[:, 2], phi
+            )
+            f *= -(K / self.L) * q[:, None]
+        return f, e, vir
+
+
+def ewald_sum(
+    r: NDArray,
+    q: NDArray,
+    L: float,
+    alpha: float,
+    rc: float,
+    kmax: int,
+) -> Tuple[NDArray, float, float]:
+    """
+    Direct Ewald sum of the Coulomb interaction, as a reference for SPME:
+    the real-space terms of all the pairs within rc, and the reciprocal
+    terms of all the wave vectors 2*pi*n/L with |n| <= kmax, with the
+    structure factors summed over the atoms, O(N^2) at fixed accuracy.
+    The net charge is neutralized by a uniform background.
+
+    Args:
+        r (NDArray): array of positions
+        q (NDArray): charge of every atom
+        L (float): box length
+        alpha (float): splitting parameter
+        rc (float): cutoff radius of the real-space sum
+        kmax (int): largest wave vector, in units of 2*pi/L
+
+    Returns:
+        Tuple[NDArray, float, float]: array of forces, energy, virial term
+    """
+    r = np.asarray(r, dtype=np.float64)
+    q = np.asarray(q, dtype=np.float64)
+    N = r.shape[0]
+    V = L ** 3
+    f = np.zeros((N, 3))
+    e = 0.0
+    vir = 0.0
+    for start, stop in blocks(N):
+        d, r2 = separations(r, L, start, stop)
+        i, j = np.nonzero(r2 < rc * rc)
+        rij = np.sqrt(r2[i, j])
+        qq = q[i + start] * q[j]
+        ep = qq * erfc(alpha * rij) / rij
+        # -r*dU/dr
+        modf = ep + qq * 2 * alpha / sqrt(pi) * np.exp(-((alpha * rij) ** 2))
+        np.add.at(f, i + start, (modf / (rij * rij))[:, None] * d[i, j])
+        e += 0.5 * ep.sum()
+        vir += 0.5 * modf.sum()
+    n = np.arange(-kmax, kmax + 1)
+    n = np.stack(np.meshgrid(n, n, n, indexing="ij"), -1).reshape(-1, 3)
+    n2 = np.einsum("ka,ka->k", n, n)
+    n = n[(n2 > 0) & (n2 <= kmax * kmax)]
+    k = 2 * pi / L * n
+    k2 = np.einsum("ka,ka->k", k, k)
+    A = 4 * pi / V * np.exp(-k2 / (4 * alpha * alpha)) / k2
+    step = max(1, MAX_TERMS // max(N, 1))
+    for start in range(0, len(k), step):
+        kb = k[start : start + step]
+        Ab = A[start : start + step]
+        k2b = k2[start : start + step]
+        eikr = np.exp(1j * r @ kb.T)
+        S = q @ eikr
+        S2 = S.real ** 2 + S.imag ** 2
+        e += 0.5 * float(Ab @ S2)
+        vir += 0.5 * float(Ab @ (S2 * (1 - k2b / (2 * alpha * alpha))))
+        f += q[:, None] * ((eikr * S.conj()).imag * Ab) @ kb
+    Q0 = q.sum()
+    e -= alpha / sqrt(pi) * float(q @ q) + pi * Q0 * Q0 / (
+        2 * V * alpha * alpha
+    )
+    vir -= 3 * pi * Q0 * Q0 / (2 * V * alpha * alpha)
+    return f, e, vir
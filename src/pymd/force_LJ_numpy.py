@@ -0,0 +1,620 @@
+from typing import Iterator, Tuple, Union
+
+import numpy as np
+from nptyping import NDArray
+
+# Force algorithms understood by the State objects
+METHODS = {"n2": 0, "cell": 1, "verlet": 2}
+# Neighbor lists store every pair twice, once for every atom
+FULL_LIST = True
+# Largest number of pair separations held in memory at once
+MAX_PAIRS = 2 ** 20
+
+
+def cells_per_side(L: float, rl: float) -> int:
+    """
+    Number of cells per side, of side at least rl. If less than 3 cells
+    fit in the box, a single cell is used. Only used to size buffers, the
+    kernels of this module don't use cells.
+
+    Args:
+        L (float): dimension of box
+        rl (float): minimum side of a cell
+
+    Returns:
+        int: number of cells per side
+    """
+    M = int(L / rl)
+    return M if M >= 3 else 1
+
+
+def blocks(N: int) -> Iterator[Tuple[int, int]]:
+    """
+    Blocks of rows of the pair matrix, with at most MAX_PAIRS pairs each.
+
+    Args:
+        N (int): number of atoms
+
+    Yields:
+        Tuple[int, int]: first and last+1 atom of the block
+    """
+    rows = max(1, MAX_PAIRS // max(N, 1))
+    for start in range(0, N, rows):
+        yield start, min(start + rows, N)
+
+
+def separations(
+    r: NDArray, L: float, start: int, stop: int
+) -> Tuple[NDArray, NDArray]:
+    """
+    Minimum image separations of the atoms start<=i<stop from all the
+    atoms. The separation of an atom from itself is set to infinity.
+
+    Args:
+        r (NDArray): array of positions
+        L (float): dimension of box
+        start (int): first atom of the block
+        stop (int): last+1 atom of the block
+
+    Returns:
+        Tuple[NDArray, NDArray]: separation vectors, as (stop-start,N,3),
+            and their squared length, as (stop-start,N)
+    """
+    d = r[start:stop, None, :] - r[None, :, :]
+    d -= L * np.rint(d / L)
+    r2 = np.einsum("ijk,ijk->ij", d, d)
+    rows = np.arange(stop - start)
+    r2[rows, rows + start] = np.inf
+    return d, r2
+
+
+def pair_table(
+    types: NDArray, mix: NDArray, i: NDArray, j: NDArray, ecut: float
+) -> Tuple[Union[NDArray, float], ...]:
+    """
+    Lennard-Jones parameters of a set of pairs, looked up by the types of
+    their atoms in the mixing table. Without types, all the pairs have
+    sigma and epsilon equal to 1.
+
+    Args:
+        types (NDArray): type of every atom, or None
+        mix (NDArray): mixing table, as mix[a,b] = (sigma_ab^2,
+            epsilon_ab, ecut_ab)
+        i (NDArray): first atom of every pair
+        j (NDArray): second atom of every pair
+        ecut (float): energy after cutoff of a single species
+
+    Returns:
+        Tuple[Union[NDArray, float], ...]: squared sigma, epsilon and
+            energy after cutoff of the pairs
+    """
+    if types is None:
+        return 1.0, 1.0, ecut
+    table = mix[types[i], types[j]]
+    return table[:, 0], table[:, 1], table[:, 2]
+
+
+def lj_pairs(
+    r2: NDArray,
+    ecut: Union[NDArray, float],
+    s2: Union[NDArray, float] = 1.0,
+    eps: Union[NDArray, float] = 1.0,
+) -> Tuple[NDArray, NDArray]:
+    """
+    Lennard-Jones interaction of a set of pairs.
+
+    Args:
+        r2 (NDArray): squared separations of the pairs
+        ecut (Union[NDArray, float]): energy after cutoff
+        s2 (Union[NDArray, float], optional): squared sigma of the pairs.
+            Defaults to 1.0.
+        eps (Union[NDArray, float], optional): epsilon of the pairs.
+            Defaults to 1.0.
+
+    Returns:
+        Tuple[NDArray, NDArray]: energy and virial of every pair
+    """
+    x = s2 / r2
+    x = x * x * x
+    return 4 * eps * (x * x - x) - ecut, 48 * eps * (x * x - 0.5 * x)
+
+
+def spline_pairs(
+    r2: NDArray,
+    rc: float,
+    table: NDArray,
+    a: Union[NDArray, int] = 0,
+    b: Union[NDArray, int] = 0,
+) -> Tuple[NDArray, NDArray]:
+    """
+    Interaction of a set of pairs from the spline tables of their types,
+    see pymd.potential.tabulate.
+
+    Args:
+        r2 (NDArray): squared separations of the pairs
+        rc (float): cutoff distance
+        table (NDArray): spline tables of the types, as (T,T,n,4)
+        a (Union[NDArray, int], optional): type of the first atom of
+            every pair. Defaults to 0.
+        b (Union[NDArray, int], optional): type of the second atom of
+            every pair. Defaults to 0.
+
+    Returns:
+        Tuple[NDArray, NDArray]: energy and virial of every pair
+    """
+    n = table.shape[-2]
+    ids = n / (rc * rc)
+    x = r2 * ids
+    k = np.minimum(x.astype(np.intp), n - 1)
+    x = x - k
+    c = table[a, b, k].T
+    e = c[0] + x * (c[1] + x * (c[2] + x * c[3]))
+    return e, -2 * r2 * ids * (c[1] + x * (2 * c[2] + 3 * x * c[3]))
+
+
+def pair_terms(
+    r2: NDArray,
+    i: NDArray,
+    j: NDArray,
+    rc: float,
+    ecut: float,
+    types: NDArray,
+    mix: NDArray,
+    table: NDArray,
+) -> Tuple[NDArray, NDArray]:
+    """
+    Energy and virial of a set of pairs, from the Lennard-Jones potential
+    or from the spline tables, see force. The force on the first atom of
+    a pair with separation d is virial*d/r2.
+
+    Args:
+        r2 (NDArray): squared separations of the pairs
+        i (NDArray): first atom of every pair
+        j (NDArray): second atom of every pair
+        rc (float): cutoff distance
+        ecut (float): energy after cutoff
+        types (NDArray): type of every atom, or None
+        mix (NDArray): mixing table, or None
+        table (NDArray): spline tables, or None
+
+    Returns:
+        Tuple[NDArray, NDArray]: energy and virial of every pair
+    """
+    if table is None:
+        s2, eps, ec = pair_table(types, mix, i, j, ecut)
+        return lj_pairs(r2, ec, s2, eps)
+    if types is None:
+        return spline_pairs(r2, rc, table)
+    return spline_pairs(r2, rc, table, types[i], types[j])
+
+
+def tally(
+    i: NDArray,
+    d: NDArray,
+    r2: NDArray,
+    ep: NDArray,
+    modf: NDArray,
+    eatom: NDArray,
+    vatom: NDArray,
+    W: NDArray,
+):
+    """
+    Adds half of the energy and virial of every pair to its first atom,
+    and its virial tensor to W, for the optional outputs of force. Every
+    pair is expected twice, once for every atom.
+
+    Args:
+        i (NDArray): first atom of every pair, relative to the rows
+        d (NDArray): separation vectors of the pairs, as (P,3)
+        r2 (NDArray): squared separations of the pairs
+        ep (NDArray): energy of every pair
+        modf (NDArray): virial of every pair
+        eatom (NDArray): per-atom energy of the rows, or None
+        vatom (NDArray): per-atom virial of the rows, or None
+        W (NDArray): virial tensor, or None
+    """
+    if eatom is not None:
+        eatom += 0.5 * np.bincount(i, weights=ep, minlength=len(eatom))
+    if vatom is not None:
+        vatom += 0.5 * np.bincount(i, weights=modf, minlength=len(vatom))
+    if W is not None:
+        W += 0.5 * np.einsum("p,pa,pb->ab", modf / r2, d, d, dtype=np.float64)
+
+
+def force(
+    r: NDArray,
+    L: float,
+    rc: float,
+    ecor: float,
+    ecut: float,
+    types: NDArray = None,
+    mix: NDArray = None,
+    table: NDArray = None,
+    eatom: NDArray = None,
+    vatom: NDArray = None,
+    W: NDArray = None,
+) -> Tuple[NDArray, float, float]:
+    """
+    N^2 algorithm for computing forces, potential energy and virial,
+    vectorized with NumPy. Pairs are computed in blocks of rows, so that
+    memory stays bounded; every row holds all the pairs of an atom, so
+    each pair is computed twice and energy and virial are halved. With a
+    mixture, the parameters of the pairs are looked up in the mixing
+    table, see pair_table. With spline tables, the Lennard-Jones
+    potential is replaced by the tabulated one, see spline_pairs.
+    Per-atom energy and virial and the virial tensor are optional outputs
+    of the same pass, filled only if their arrays are given.
+
+    Args:
+        r (NDArray): array of vector positions
+        L (float): dimension of box
+        rc (float): cutoff distance
+        ecor (float): energy correction
+        ecut (float): energy after cutoff
+        types (NDArray, optional): type of every atom. Defaults to None,
+            a single species.
+        mix (NDArray, optional): mixing table of the types, as (T,T,3).
+            Defaults to None.
+        table (NDArray, optional): spline tables of the types, as
+            (T,T,n,4). Defaults to None, the Lennard-Jones potential.
+        eatom (NDArray, optional): output energy of every atom, half the
+            energy of each of its pairs, without the correction.
+            Defaults to None.
+        vatom (NDArray, optional): output virial of every atom, half the
+            virial of each of its pairs. Defaults to None.
+        W (NDArray, optional): output virial tensor, sum over the pairs
+            of f_a*r_b, as (3,3). Defaults to None.
+
+    Returns:
+        Tuple[NDArray, float, float]: forces, potential energy, virial
+    """
+    r = np.asarray(r)
+    N = r.shape[0]
+    f = np.zeros_like(r)
+    e = vir = 0.0
+    for out in (eatom, vatom, W):
+        if out is not None:
+            out[...] = 0
+    for start, stop in blocks(N):
+        d, r2 = separations(r, L, start, stop)
+        i, j = np.nonzero(r2 < rc * rc)
+        d, r2 = d[i, j], r2[i, j]
+        ep, modf = pair_terms(r2, i + start, j, rc, ecut, types, mix, table)
+        fij = (modf / r2)[:, None] * d
+        for k in range(3):
+            f[start:stop, k] = np.bincount(
+                i, weights=fij[:, k], minlength=stop - start
+            )
+        e += 0.5 * np.sum(ep, dtype=np.float64)
+        vir += 0.5 * np.sum(modf, dtype=np.float64)
+        tally(
+            i,
+            d,
+            r2,
+            ep,
+            modf,
+            None if eatom is None else eatom[start:stop],
+            None if vatom is None else vatom[start:stop],
+            W,
+        )
+    return f, e + N * ecor, vir
+
+
+def force_cell(
+    r: NDArray,
+    L: float,
+    rc: float,
+    ecor: float,
+    ecut: float,
+    types: NDArray = None,
+    mix: NDArray = None,
+    table: NDArray = None,
+    eatom: NDArray = None,
+    vatom: NDArray = None,
+    W: NDArray = None,
+) -> Tuple[NDArray, float, float]:
+    """
+    Same as force: cell lists don't vectorize with NumPy, the blocked
+    N^2 loop is used instead.
+
+    Args:
+        r (NDArray): array of vector positions
+        L (float): dimension of box
+        rc (float): cutoff distance
+        ecor (float): energy correction
+        ecut (float): energy after cutoff
+        types (NDArray, optional): type of every atom. Defaults to None.
+        mix (NDArray, optional): mixing table of the types.
+            Defaults to None.
+        table (NDArray, optional): spline tables of the types.
+            Defaults to None.
+        eatom (NDArray, optional): output energy of every atom, see
+            force. Defaults to None.
+        vatom (NDArray, optional): output virial of every atom.
+            Defaults to None.
+        W (NDArray, optional): output virial tensor. Defaults to None.
+
+    Returns:
+        Tuple[NDArray, float, float]: forces, potential energy, virial
+    """
+    return force(r, L, rc, ecor, ecut, types, mix, table, eatom, vatom, W)
+
+
+def energy(
+    r: NDArray,
+    L: float,
+    rc: float,
+    ecor: float,
+    ecut: float,
+    types: NDArray = None,
+    mix: NDArray = None,
+    table: NDArray = None,
+) -> Tuple[float, float]:
+    """
+    Potential energy and virial only, as force without computing the
+    forces. Every pair is taken once, from its first atom.
+
+    Args:
+        r (NDArray): array of vector positions
+        L (float): dimension of box
+        rc (float): cutoff distance
+        ecor (float): energy correction
+        ecut (float): energy after cutoff
+        types (NDArray, optional): type of every atom. Defaults to None.
+        mix (NDArray, optional): mixing table of the types.
+            Defaults to None.
+        table (NDArray, optional): spline tables of the types.
+            Defaults to None.
+
+    Returns:
+        Tuple[float, float]: potential energy, virial
+    """
+    r = np.asarray(r)
+    N = r.shape[0]
+    e = vir = 0.0
+    for start, stop in blocks(N):
+        d, r2 = separations(r, L, start, stop)
+        i, j = np.nonzero(r2 < rc * rc)
+        once = j > i + start
+        i, j = i[once], j[once]
+        ep, modf = pair_terms(
+            r2[i, j], i + start, j, rc, ecut, types, mix, table
+        )
+        e += np.sum(ep, dtype=np.float64)
+        vir += np.sum(modf, dtype=np.float64)
+    return e + N * ecor, vir
+
+
+def energy_cell(
+    r: NDArray,
+    L: float,
+    rc: float,
+    ecor: float,
+    ecut: float,
+    types: NDArray = None,
+    mix: NDArray = None,
+    table: NDArray = None,
+) -> Tuple[float, float]:
+    """
+    Same as energy, see force_cell.
+
+    Args:
+        r (NDArray): array of vector positions
+        L (float): dimension of box
+        rc (float): cutoff distance
+        ecor (float): energy correction
+        ecut (float): energy after cutoff
+        types (NDArray, optional): type of every atom. Defaults to None.
+        mix (NDArray, optional): mixing table of the types.
+            Defaults to None.
+        table (NDArray, optional): spline tables of the types.
+            Defaults to None.
+
+    Returns:
+        Tuple[float, float]: potential energy, virial
+    """
+    return energy(r, L, rc, ecor, ecut, types, mix, table)
+
+
+def build_neighbors_into(
+    r: NDArray,
+    L: float,
+    rl: float,
+    head: NDArray,
+    nxt: NDArray,
+    cell: NDArray,
+    start: NDArray,
+    nbr: NDArray,
+) -> int:
+    """
+    Builds in place a full Verlet neighbor list of radius rl, searching
+    the pairs in blocks of rows. Each pair is stored twice, once for
+    every atom. The neighbors of atom i are nbr[start[i]:start[i+1]]. If
+    the returned number of entries is greater than the size of nbr, the
+    list is not filled, only start is. head, nxt and cell are not used.
+
+    Args:
+        r (NDArray): array of vector positions
+        L (float): dimension of box
+        rl (float): neighbor list radius (cutoff plus skin)
+        head (NDArray): unused cell buffer
+        nxt (NDArray): unused cell buffer
+        cell (NDArray): unused cell buffer
+        start (NDArray): output start indices, of size N+1
+        nbr (NDArray): output neighbors
+
+    Returns:
+        int: number of entries of the list
+    """
+    r = np.asarray(r)
+    N = r.shape[0]
+    neighbors = []
+    start[0] = 0
+    for first, stop in blocks(N):
+        _, r2 = separations(r, L, first, stop)
+        i, j = np.nonzero(r2 < rl * rl)
+        counts = np.bincount(i, minlength=stop - first)
+        start[first + 1 : stop + 1] = start[first] + np.cumsum(counts)
+        neighbors.append(j)
+    size = int(start[N])
+    if size <= len(nbr):
+        nbr[:size] = np.concatenate(neighbors) if neighbors else []
+    return size
+
+
+def build_neighbors(
+    r: NDArray, L: float, rl: float
+) -> Tuple[NDArray, NDArray, int]:
+    """
+    Builds a full Verlet neighbor list of radius rl.
+
+    Args:
+        r (NDArray): array of vector positions
+        L (float): dimension of box
+        rl (float): neighbor list radius (cutoff plus skin)
+
+    Returns:
+        Tuple[NDArray, NDArray, int]: start indices, neighbors,
+            number of pairs
+    """
+    N = np.asarray(r).shape[0]
+    start = np.empty(N + 1, dtype=np.intc)
+    nbr = np.empty(0, dtype=np.intc)
+    size = build_neighbors_into(r, L, rl, None, None, None, start, nbr)
+    nbr = np.empty(max(size, 1), dtype=np.intc)
+    build_neighbors_into(r, L, rl, None, None, None, start, nbr)
+    return start, nbr, size // 2
+
+
+def force_neighbors(
+    r: NDArray,
+    L: float,
+    rc: float,
+    ecor: float,
+    ecut: float,
+    start: NDArray,
+    nbr: NDArray,
+    types: NDArray = None,
+    mix: NDArray = None,
+    table: NDArray = None,
+    eatom: NDArray = None,
+    vatom: NDArray = None,
+    W: NDArray = None,
+) -> Tuple[NDArray, float, float]:
+    """
+    Forces, potential energy and virial from a full Verlet neighbor
+    list, as built by build_neighbors_into. Pairs beyond rc are ignored.
+
+    Args:
+        r (NDArray): array of vector positions
+        L (float): dimension of box
+        rc (float): cutoff distance
+        ecor (float): energy correction
+        ecut (float): energy after cutoff
+        start (NDArray): start indices, of size N+1
+        nbr (NDArray): neighbors
+        types (NDArray, optional): type of every atom. Defaults to None.
+        mix (NDArray, optional): mixing table of the types.
+            Defaults to None.
+        table (NDArray, optional): spline tables of the types.
+            Defaults to None.
+        eatom (NDArray, optional): output energy of every atom, see
+            force. Defaults to None.
+        vatom (NDArray, optional): output virial of every atom.
+            Defaults to None.
+        W (NDArray, optional): output virial tensor. Defaults to None.
+
+    Returns:
+        Tuple[NDArray, float, float]: forces, potential energy, virial
+    """
+    r = np.asarray(r)
+    N = r.shape[0]
+    i = np.repeat(np.arange(N), np.diff(start))
+    j = nbr[: start[N]]
+    d = r[i] - r[j]
+    d -= L * np.rint(d / L)
+    r2 = np.einsum("ij,ij->i", d, d)
+    inside = r2 < rc * rc
+    i, d, r2 = i[inside], d[inside], r2[inside]
+    ep, modf = pair_terms(r2, i, j[inside], rc, ecut, types, mix, table)
+    fij = (modf / r2)[:, None] * d
+    f = np.zeros_like(r)
+    for k in range(3):
+        f[:, k] = np.bincount(i, weights=fij[:, k], minlength=N)
+    for out in (eatom, vatom, W):
+        if out is not None:
+            out[...] = 0
+    tally(i, d, r2, ep, modf, eatom, vatom, W)
+    e = np.sum(ep, dtype=np.float64)
+    vir = np.sum(modf, dtype=np.float64)
+    return f, 0.5 * e + N * ecor, 0.5 * vir
+
+
+def energy_neighbors(
+    r: NDArray,
+    L: float,
+    rc: float,
+    ecor: float,
+    ecut: float,
+    start: NDArray,
+    nbr: NDArray,
+    types: NDArray = None,
+    mix: NDArray = None,
+    table: NDArray = None,
+) -> Tuple[float, float]:
+    """
+    Potential energy and virial only from a full Verlet neighbor list, as
+    force_neighbors without computing the forces. Every pair of the list
+    is taken once, from its first atom.
+
+    Args:
+        r (NDArray): array of vector positions
+        L (float): dimension of box
+        rc (float): cutoff distance
+        ecor (float): energy correction
+        ecut (float): energy after cutoff
+        start (NDArray): start indices, of size N+1
+        nbr (NDArray): neighbors
+        types (NDArray, optional): type of every atom. Defaults to None.
+        mix (NDArray, optional): mixing table of the types.
+            Defaults to None.
+        table (NDArray, optional): spline tables of the types.
+            Defaults to None.
+
+    Returns:
+        Tuple[float, float]: potential energy, virial
+    """
+    r = np.asarray(r)
+    N = r.shape[0]
+    i = np.repeat(np.arange(N), np.diff(start))
+    j = nbr[: start[N]]
+    once = j > i
+    i, j = i[once], j[once]
+    d = r[i] - r[j]
+    d -= L * np.rint(d / L)
+    r2 = np.einsum("ij,ij->i", d, d)
+    inside = r2 < rc * rc
+    ep, modf = pair_terms(
+        r2[inside], i[inside], j[inside], rc, ecut, types, mix, table
+    )
+    e = np.sum(ep, dtype=np.float64)
+    vir = np.sum(modf, dtype=np.float64)
+    return e + N * ecor, vir
+
+
+def max_displacement(r: NDArray, img: NDArray, L: float, r0: NDArray) -> float:
+    """
+    Largest displacement of an atom from the unfolded reference
+    positions r0, using the box crossing counters.
+
+    Args:
+        r (NDArray): array of vector positions
+        img (NDArray): box crossing counters
+        L (float): dimension of box
+        r0 (NDArray): unfolded reference positions
+
+    Returns:
+        float: largest displacement
+    """
+    d = r + img * L - r0
+    return float(np.sqrt(np.einsum("ij,ij->i", d, d).max(initial=0.0)))
@@ -76,6 +76,7 @@ class Model(object):
         self.output = time.strftime("%Y%m%d-%H%M%S", time.localtime())
         self.fSamp = 1000
         self.unfold = False
+        self.format = "xyz"
         self.singleFile = True
         self.start = False
 
@@ -115,6 +116,7 @@ class Model(object):
             "fSamp": self.fSamp,
             "append": self.singleFile,
             "unfold": self.unfold,
+            "format": self.format,
             "outputfile": self.output,
         }
         self.worker = SimulatorWorker(self.state, values)
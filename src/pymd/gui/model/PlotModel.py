@@ -1,5 +1,6 @@
 import json
-from typing import Callable, List
+import os
+from typing import Callable, List, Union
 
 import numpy as np
 from nptyping import NDArray
@@ -7,13 +8,14 @@ from nptyping import NDArray
 import pymd.atoms as mdatoms
 from pymd.atoms import Atoms
 from pymd.state import NVEState
+from pymd.trajectory import ChunkedTrajectory, Trajectory, XYZTrajectory
 
 
 class PlotModel(object):
     def __init__(
         self,
         output: NDArray[NVEState.OUTDTYPE],
-        atomsOutput: List[Atoms],
+        atomsOutput: Union[List[Atoms], Trajectory],
         rc: float,
     ):
         self._update_funcs: List[Callable] = []
@@ -106,8 +108,12 @@ def getValues(filename: str):
     with open(filename + ".json") as f:
         values = json.load(f)
     output = np.loadtxt(filename + ".txt", dtype=NVEState.OUTDTYPE, skiprows=1)
-    atomsOutput = mdatoms.atomslist_fromfile(
-        values["rho"], filename + "_0.xyz"
-    )
+    # Frames are read lazily, when sliced as frames[start:stop:step]
+    if os.path.exists(filename + "_0.trj"):
+        atomsOutput = Trajectory(filename + "_0.trj")
+    elif os.path.exists(filename + "_0.ctrj"):
+        atomsOutput = ChunkedTrajectory(filename + "_0.ctrj")
+    else:
+        atomsOutput = XYZTrajectory(filename + "_0.xyz", values["rho"])
     rc = values["rc"]
     return (output, atomsOutput, rc)
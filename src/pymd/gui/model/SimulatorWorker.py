@@ -5,6 +5,7 @@ import numpy as np
 from PyQt5.QtCore import QObject, pyqtSignal
 
 from pymd.state import NVEState, NVTAndersenState
+from pymd.trajectory import AsyncSnapshotWriter
 
 
 class SimulatorWorker(QObject):
@@ -29,45 +30,57 @@ class SimulatorWorker(QObject):
         append = self.values["append"]
         unfold = self.values["unfold"]
         filename = self.values["outputfile"]
+        fmt = self.values.get("format", "xyz")
         # JSON output
         with open(filename + ".json", "w") as f:
             f.write(self.state.to_JSON())
-        # Positions, velocities output
-        atomsOutput = [self.state.atoms.copy()]
-        self.state.atoms.write_xyz(filename + "_0.xyz", unfold=unfold)
         # State variables output
         output = np.empty(steps, dtype=self.state.OUTDTYPE)
-        self.currentoutput.emit("Time\tKE\tPE\tTE\tdrift\tT\tP")
+        header = "Time\tKE\tPE\tTE\tdrift\tT\tP"
+        self.currentoutput.emit(header)
         output[0] = self.state.vars_output()
         self.currentoutput.emit(self.tostring(output[0]))
-        # Simulation loop
-        for i in range(1, steps):
-            # Break condition if window is closed
-            if self.flag:
-                break
-            # Time step
-            self.state.step(dt)
-            # Save output
-            output[i] = self.state.vars_output()
-            if i % fSamp == 0:
-                self.currentoutput.emit(self.tostring(output[i]))
-                atomsOutput += [self.state.atoms.copy()]
-                if append:
-                    self.state.atoms.write_xyz(
-                        filename + "_0.xyz", append=True
-                    )
-                else:
-                    self.state.atoms.write_xyz(filename + f"_{i}.xyz")
+
+        def save_rows(rows: np.ndarray, mode: str = "a"):
+            with open(filename + ".txt", mode) as f:
+                np.savetxt(
+                    f, rows, header=header if mode == "w" else "", comments=""
+                )
+
+        # Positions, velocities and state variables are written by a
+        # background thread, see AsyncSnapshotWriter
+        write = AsyncSnapshotWriter(self.state.atoms, fmt, unfold)
+        atomsOutput = [self.state.atoms.copy()]
+        write(f"{filename}_0.{fmt}", atoms=atomsOutput[0])
+        write.submit(save_rows, output[:1], "w")
+        saved = 1
+
+        # Output at sampling points
+        def sample(i: int, out: np.ndarray) -> bool:
+            nonlocal saved
+            self.currentoutput.emit(self.tostring(out[i - 1]))
+            atomsOutput.append(self.state.atoms.copy())
+            if append:
+                write(f"{filename}_0.{fmt}", True, atomsOutput[-1])
+            else:
+                write(f"{filename}_{i}.{fmt}", atoms=atomsOutput[-1])
+            write.submit(save_rows, output[saved : i + 1])
+            saved = i + 1
             # Show progress in bar
             self.progress.emit(i / steps)
-        # Emit signals and save output
+            # Break condition if window is closed
+            return self.flag
+
+        # Simulation loop, back to python only to sample. Leaving the
+        # with block, also on cancel or errors, writes all the output
+        with write:
+            done = self.state.run(
+                steps - 1, dt, fSamp, on_sample=sample, out=output[1:]
+            )
+            output = output[: len(done) + 1]
+            write.submit(save_rows, output[saved:])
+        # Emit signals
         self.timeElapsed.emit(time.time() - a)
-        np.savetxt(
-            filename + ".txt",
-            output,
-            header="Time\tKE\tPE\tTE\tdrift\tT\tP",
-            comments="",
-        )
         self.output = output
         self.atomsOutput = atomsOutput
         self.finished.emit()
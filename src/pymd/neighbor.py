@@ -0,0 +1,209 @@
+from typing import Tuple, Union
+
+import numpy as np
+from nptyping import NDArray
+
+from pymd.atoms import Atoms
+from pymd.backend import Backend, get_backend
+
+
+class NeighborList:
+    """
+    Verlet neighbor list, with a skin around the cutoff radius. The list
+    is rebuilt only when an atom moved more than half the skin since the
+    last build. All the buffers are allocated at the first build and
+    reused, the list grows only if it gets full.
+
+    Attributes:
+        rc (float): cutoff radius
+        skin (float): skin thickness, the list radius is rc+skin
+        backend (Backend): backend building the list, its force kernel
+            must be used with the list
+        head (NDArray): first atom of every cell
+        nxt (NDArray): linked lists of the atoms in the cells
+        cell (NDArray): cell of every atom
+        start (NDArray): start of the neighbors of each atom in nbr
+        nbr (NDArray): neighbors of all the atoms
+        size (int): number of entries in nbr
+        pairs (int): number of pairs in the list
+        r0 (NDArray): unfolded positions at the last build
+        builds (int): number of builds of the list
+        updates (int): number of updates (calls to update or record)
+    """
+
+    # Extra room given to the list when it grows
+    GROWTH = 1.2
+
+    def __init__(
+        self, rc: float, skin: float, backend: Union[str, Backend] = None
+    ):
+        """
+        Initialize NeighborList object. The list is built at the first
+        update.
+
+        Args:
+            rc (float): cutoff radius
+            skin (float): skin thickness
+            backend (Union[str, Backend], optional): backend used to build
+                the list. Defaults to None, see get_backend.
+
+        Raises:
+            ValueError: if skin is negative
+        """
+        if skin < 0:
+            raise ValueError("Skin can't be negative")
+        self.rc = rc
+        self.skin = skin
+        self.backend = get_backend(backend)
+        self.head: NDArray = None
+        self.nxt: NDArray = None
+        self.cell: NDArray = None
+        self.start: NDArray = None
+        self.nbr: NDArray = None
+        self.size = 0
+        self.pairs = 0
+        self.r0: NDArray = None
+        self.builds = 0
+        self.updates = 0
+
+    def allocate(self, atoms: Atoms):
+        """
+        Allocate the buffers of the list for the given atoms.
+
+        Args:
+            atoms (Atoms): Atoms object
+        """
+        M = self.backend.cells_per_side(atoms.L, self.rc + self.skin)
+        self.head = np.empty(M ** 3, dtype=np.intc)
+        self.nxt = np.empty(atoms.N, dtype=np.intc)
+        self.cell = np.empty((atoms.N, 3), dtype=np.intc)
+        self.start = np.empty(atoms.N + 1, dtype=np.intc)
+        self.nbr = np.empty(0, dtype=np.intc)
+        self.r0 = np.empty((atoms.N, 3), dtype=atoms.r.dtype)
+
+    def build(self, atoms: Atoms):
+        """
+        Build the list from the current positions.
+
+        Args:
+            atoms (Atoms): Atoms object
+        """
+        if (
+            self.r0 is None
+            or self.r0.shape != atoms.r.shape
+            or self.r0.dtype != atoms.r.dtype
+        ):
+            self.allocate(atoms)
+        self.fill(atoms)
+        self.builds += 1
+
+    def fill(self, atoms: Atoms):
+        """
+        Fill the list in place, growing it until all the pairs fit.
+
+        Args:
+            atoms (Atoms): Atoms object
+        """
+        while True:
+            size = self.backend.build_neighbors_into(
+                atoms.r,
+                atoms.L,
+                self.rc + self.skin,
+                self.head,
+                self.nxt,
+                self.cell,
+                self.start,
+                self.nbr,
+            )
+            if size <= len(self.nbr):
+                break
+            self.nbr = np.empty(int(size * self.GROWTH) + 1, dtype=np.intc)
+        self.set_size(size)
+        np.multiply(atoms.i, atoms.L, out=self.r0)
+        self.r0 += atoms.r
+
+    def set_size(self, size: int):
+        """
+        Set the number of entries and of pairs of the list.
+
+        Args:
+            size (int): number of entries in nbr
+        """
+        self.size = size
+        self.pairs = size // 2 if self.backend.FULL_LIST else size
+
+    def update(self, atoms: Atoms) -> bool:
+        """
+        Rebuild the list if the largest displacement since the last
+        build is over half the skin.
+
+        Args:
+            atoms (Atoms): Atoms object
+
+        Returns:
+            bool: True if the list was rebuilt
+        """
+        self.updates += 1
+        if (
+            self.r0 is None
+            or self.r0.shape != atoms.r.shape
+            or self.backend.max_displacement(
+                atoms.r, atoms.i, atoms.L, self.r0
+            )
+            > 0.5 * self.skin
+        ):
+            self.build(atoms)
+            return True
+        return False
+
+    def record(self, steps: int, builds: int, size: int, atoms: Atoms):
+        """
+        Account for updates done by compiled steps, which return the
+        number of builds and the number of entries of the list at the
+        last build (-1 if none). If the list was too small, it is grown
+        and filled again.
+
+        Args:
+            steps (int): number of steps, each updating the list
+            builds (int): number of builds of the list
+            size (int): number of entries at the last build, or -1
+            atoms (Atoms): Atoms object
+        """
+        self.updates += steps
+        self.builds += builds
+        if size < 0:
+            return
+        if size > len(self.nbr):
+            self.fill(atoms)
+        else:
+            self.set_size(size)
+
+    @property
+    def buffers(self) -> Tuple[NDArray, ...]:
+        """
+        Buffers of the list, as (head, nxt, cell, start, nbr, r0).
+        """
+        return self.head, self.nxt, self.cell, self.start, self.nbr, self.r0
+
+    @property
+    def neighbors(self) -> float:
+        """
+        Average number of neighbors per atom, within rc+skin.
+        """
+        if self.start is None:
+            return 0.0
+        return 2 * self.pairs / (len(self.start) - 1)
+
+    @property
+    def rebuild_rate(self) -> float:
+        """
+        Fraction of updates that rebuilt the list.
+        """
+        return self.builds / max(self.updates, 1)
+
+    def __str__(self):
+        return (
+            f"NeighborList rc={self.rc}, skin={self.skin}: "
+            f"{self.builds} builds in {self.updates} updates, "
+            f"{self.neighbors:.1f} neighbors per atom"
+        )
@@ -0,0 +1,50 @@
+import numpy as np
+from nptyping import NDArray
+
+from pymd.force_LJ_numpy import blocks, separations
+
+
+def calc_hist(
+    r: NDArray,
+    L: float,
+    rc: float,
+    dr: float,
+    types: NDArray = None,
+    ntypes: int = 1,
+) -> NDArray:
+    """
+    N^2 algorithm for computing interparticle separations and updating
+    the radial distribution function histogram, vectorized with NumPy.
+    Separations are computed in blocks of rows, so that memory stays
+    bounded; every pair is found from both atoms, so it counts twice.
+    With the types of the atoms, the partial histograms of every pair of
+    types are filled in the same pass: the separations of atoms of type
+    a from atoms of type b are counted in H[a,b].
+
+    Args:
+        r (NDArray): array of vector positions
+        L (float): dimension of box
+        rc (float): cutoff distance
+        dr (float): length of bin
+        types (NDArray, optional): type of every atom. Defaults to None.
+        ntypes (int, optional): number of types. Defaults to 1.
+
+    Returns:
+        NDArray: histogram, as (nbins), or partial histograms, as
+            (ntypes,ntypes,nbins), if types are given
+    """
+    r = np.asarray(r)
+    nbins = int(rc / dr) + 1
+    if types is None:
+        ntypes = 1
+    H = np.zeros(ntypes * ntypes * nbins, dtype=int)
+    for start, stop in blocks(r.shape[0]):
+        _, r2 = separations(r, L, start, stop)
+        i, j = np.nonzero(r2 < rc * rc)
+        bins = (np.sqrt(r2[i, j]) / dr).astype(int)
+        if types is not None:
+            bins += (types[i + start] * ntypes + types[j]) * nbins
+        H += np.bincount(bins, minlength=H.size)
+    if types is not None:
+        return H.reshape(ntypes, ntypes, nbins)
+    return H
@@ -0,0 +1,411 @@
+import math
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+from nptyping import NDArray
+
+# Complementary error function, vectorized
+erfc = np.vectorize(math.erfc, otypes=[np.float64])
+
+
+class PairPotential:
+    """
+    Pair potential U(r), in normal units. Subclasses define energy, and
+    possibly derivative, vectorized over arrays of distances. The force
+    kernels don't call it: it is tabulated once by tabulate.
+
+    Attributes:
+        rmin (float): smallest distance tabulated exactly, below it the
+            table continues linearly in r^2
+    """
+
+    rmin = 0.5
+
+    def energy(self, r: NDArray) -> NDArray:
+        """
+        Energy of a pair at distance r.
+
+        Args:
+            r (NDArray): distances
+
+        Returns:
+            NDArray: energies
+        """
+        raise NotImplementedError
+
+    def derivative(self, r: NDArray) -> NDArray:
+        """
+        Derivative dU/dr, by central differences if not overridden.
+
+        Args:
+            r (NDArray): distances
+
+        Returns:
+            NDArray: derivatives
+        """
+        h = 1e-5 * r
+        return (self.energy(r + h) - self.energy(r - h)) / (2 * h)
+
+    def __call__(self, r: NDArray) -> NDArray:
+        return self.energy(r)
+
+    def __add__(self, other: "PairPotential") -> "PairPotential":
+        return PotentialSum(self, other)
+
+
+class PotentialSum(PairPotential):
+    """
+    Sum of pair potentials, tabulated exactly down to the largest of
+    their rmin.
+
+    Attributes:
+        terms (Tuple[PairPotential, ...]): the potentials
+    """
+
+    def __init__(self, *terms: PairPotential):
+        self.terms = terms
+        self.rmin = max(pot.rmin for pot in terms)
+
+    def energy(self, r: NDArray) -> NDArray:
+        return sum(pot.energy(r) for pot in self.terms)
+
+    def derivative(self, r: NDArray) -> NDArray:
+        return sum(pot.derivative(r) for pot in self.terms)
+
+
+class LennardJones(PairPotential):
+    """
+    Lennard-Jones potential, 4*eps*((sigma/r)^12 - (sigma/r)^6).
+
+    Attributes:
+        sigma (float): size
+        eps (float): well depth
+    """
+
+    def __init__(self, sigma: float = 1.0, eps: float = 1.0):
+        self.sigma = sigma
+        self.eps = eps
+
+    def energy(self, r: NDArray) -> NDArray:
+        sr6 = (self.sigma / r) ** 6
+        return 4 * self.eps * (sr6 * sr6 - sr6)
+
+    def derivative(self, r: NDArray) -> NDArray:
+        sr6 = (self.sigma / r) ** 6
+        return -24 * self.eps * (2 * sr6 * sr6 - sr6) / r
+
+
+class WCA(LennardJones):
+    """
+    Weeks-Chandler-Andersen potential: the Lennard-Jones potential cut at
+    its minimum, 2^(1/6)*sigma, and shifted up by eps, purely repulsive.
+    """
+
+    def energy(self, r: NDArray) -> NDArray:
+        r = np.asarray(r, dtype=np.float64)
+        inside = r < 2 ** (1 / 6) * self.sigma
+        return np.where(inside, super().energy(r) + self.eps, 0.0)
+
+    def derivative(self, r: NDArray) -> NDArray:
+        r = np.asarray(r, dtype=np.float64)
+        inside = r < 2 ** (1 / 6) * self.sigma
+        return np.where(inside, super().derivative(r), 0.0)
+
+
+class Morse(PairPotential):
+    """
+    Morse potential, D*(1 - exp(-a*(r-r0)))^2 - D, zero at infinity.
+
+    Attributes:
+        D (float): well depth
+        a (float): inverse width of the well
+        r0 (float): position of the minimum
+    """
+
+    def __init__(
+        self, D: float = 1.0, a: float = 6.0, r0: float = 2 ** (1 / 6)
+    ):
+        self.D = D
+        self.a = a
+        self.r0 = r0
+
+    def energy(self, r: NDArray) -> NDArray:
+        x = np.exp(-self.a * (r - self.r0))
+        return self.D * ((1 - x) ** 2 - 1)
+
+    def derivative(self, r: NDArray) -> NDArray:
+        x = np.exp(-self.a * (r - self.r0))
+        return 2 * self.D * self.a * x * (1 - x)
+
+
+class Buckingham(PairPotential):
+    """
+    Buckingham potential, A*exp(-B*r) - C/r^6. It has a maximum and goes
+    to minus infinity at short distance, set rmin beyond the maximum.
+
+    Attributes:
+        A (float): repulsion strength
+        B (float): inverse range of the repulsion
+        C (float): dispersion strength
+    """
+
+    def __init__(self, A: float, B: float, C: float, rmin: float = 0.5):
+        self.A = A
+        self.B = B
+        self.C = C
+        self.rmin = rmin
+
+    def energy(self, r: NDArray) -> NDArray:
+        return self.A * np.exp(-self.B * r) - self.C / r ** 6
+
+    def derivative(self, r: NDArray) -> NDArray:
+        return -self.A * self.B * np.exp(-self.B * r) + 6 * self.C / r ** 7
+
+
+class Switched(PairPotential):
+    """
+    Inner or outer part of a pair potential, split by a smooth switch
+    S(r), 1 below r1 and 0 beyond r2, with S = 1 + x^2*(2x - 3) and
+    x = (r - r1)/(r2 - r1) in between: the inner part is U*S, the outer
+    part U*(1 - S), their sum is U.
+
+    Attributes:
+        pot (PairPotential): the potential
+        r1 (float): start of the switch
+        r2 (float): end of the switch
+        outer (bool): if True, the outer part
+    """
+
+    def __init__(
+        self, pot: PairPotential, r1: float, r2: float, outer: bool = False
+    ):
+        self.pot = pot
+        self.r1 = r1
+        self.r2 = r2
+        self.outer = outer
+        self.rmin = pot.rmin
+
+    def switch(self, r: NDArray) -> Tuple[NDArray, NDArray]:
+        """
+        Switch of the part and its derivative.
+
+        Args:
+            r (NDArray): distances
+
+        Returns:
+            Tuple[NDArray, NDArray]: switch and derivative
+        """
+        x = np.clip((np.asarray(r) - self.r1) / (self.r2 - self.r1), 0, 1)
+        S = 1 + x * x * (2 * x - 3)
+        dS = 6 * x * (x - 1) / (self.r2 - self.r1)
+        if self.outer:
+            return 1 - S, -dS
+        return S, dS
+
+    def energy(self, r: NDArray) -> NDArray:
+        return self.pot.energy(r) * self.switch(r)[0]
+
+    def derivative(self, r: NDArray) -> NDArray:
+        S, dS = self.switch(r)
+        return self.pot.derivative(r) * S + self.pot.energy(r) * dS
+
+
+class ScreenedCoulomb(PairPotential):
+    """
+    Real-space part of the Ewald sum of two charges, qq*erfc(alpha*r)/r,
+    the rest is summed in reciprocal space, see pymd.ewald.SPME.
+
+    Attributes:
+        qq (float): product of the charges
+        alpha (float): splitting parameter of the Ewald sum
+    """
+
+    def __init__(self, qq: float, alpha: float):
+        self.qq = qq
+        self.alpha = alpha
+
+    def energy(self, r: NDArray) -> NDArray:
+        return self.qq * erfc(self.alpha * r) / r
+
+    def derivative(self, r: NDArray) -> NDArray:
+        ar = self.alpha * r
+        return (
+            -self.qq
+            * (
+                erfc(ar) / r
+                + 2 / math.sqrt(math.pi) * self.alpha * np.exp(-ar * ar)
+            )
+            / r
+        )
+
+
+class UserPotential(PairPotential):
+    """
+    Pair potential from a user function, vectorized over distances. The
+    derivative is computed by central differences if not given.
+
+    Attributes:
+        func (Callable): energy U(r)
+        dfunc (Callable): derivative dU/dr, or None
+    """
+
+    def __init__(
+        self, func: Callable, dfunc: Callable = None, rmin: float = 0.5
+    ):
+        self.func = func
+        self.dfunc = dfunc
+        self.rmin = rmin
+
+    def energy(self, r: NDArray) -> NDArray:
+        return self.func(r)
+
+    def derivative(self, r: NDArray) -> NDArray:
+        if self.dfunc is None:
+            return super().derivative(r)
+        return self.dfunc(r)
+
+
+# Pair potentials by name
+POTENTIALS = {
+    "lj": LennardJones,
+    "wca": WCA,
+    "morse": Morse,
+    "buckingham": Buckingham,
+}
+
+
+def as_potential(potential: Union[PairPotential, Callable]) -> PairPotential:
+    """
+    Pair potential from a PairPotential or a user function of r.
+
+    Args:
+        potential (Union[PairPotential, Callable]): the potential
+
+    Returns:
+        PairPotential: PairPotential object
+    """
+    if isinstance(potential, PairPotential):
+        return potential
+    return UserPotential(potential)
+
+
+def pair_potentials(
+    potential: Union[
+        PairPotential, Callable, Dict[Tuple[str, str], PairPotential]
+    ],
+    names: List[str],
+) -> List[List[PairPotential]]:
+    """
+    Pair potential of every pair of species: the same one for all of
+    them, or from a dictionary keyed by the pairs of names, either order.
+
+    Args:
+        potential (Union[PairPotential, Callable, Dict]): potential of all
+            the pairs, or dictionary of the potentials of the pairs
+        names (List[str]): names of the species
+
+    Raises:
+        ValueError: if a pair of species has no potential
+
+    Returns:
+        List[List[PairPotential]]: potentials, indexed by the types
+    """
+    if not isinstance(potential, dict):
+        potential = as_potential(potential)
+        return [[potential for b in names] for a in names]
+    table = []
+    for a in names:
+        row = []
+        for b in names:
+            pot = potential.get((a, b), potential.get((b, a)))
+            if pot is None:
+                raise ValueError(f"No pair potential for {a}-{b}")
+            row.append(as_potential(pot))
+        table.append(row)
+    return table
+
+
+def hermite_table(pot: PairPotential, rc: float, n: int) -> NDArray:
+    """
+    Cubic Hermite spline of a pair potential in s = r^2, on n bins of
+    the same width from 0 to rc^2, shifted to zero at rc. In bin k,
+    U(s) = c0 + t*(c1 + t*(c2 + t*c3)) with t the position in the bin,
+    from 0 to 1; the spline has the exact value and slope at the nodes,
+    and the forces are its derivative, so energy is conserved. Below
+    pot.rmin it continues linearly, as a steep finite wall.
+
+    Args:
+        pot (PairPotential): the potential
+        rc (float): cutoff radius
+        n (int): number of bins
+
+    Returns:
+        NDArray: coefficients of the bins, as (n,4)
+    """
+    h = rc * rc / n
+    s = h * np.arange(n + 1)
+    smin = min(pot.rmin ** 2, s[-1])
+    r = np.sqrt(np.maximum(s, smin))
+    U = pot.energy(r) - pot.energy(rc)
+    # dU/ds = U'(r)/(2r), per bin width
+    m = pot.derivative(r) / (2 * r) * h
+    wall = s < smin
+    U[wall] += (s[wall] - smin) / h * m[wall]
+    coef = np.empty((n, 4))
+    coef[:, 0] = U[:-1]
+    coef[:, 1] = m[:-1]
+    coef[:, 2] = 3 * (U[1:] - U[:-1]) - 2 * m[:-1] - m[1:]
+    coef[:, 3] = 2 * (U[:-1] - U[1:]) + m[:-1] + m[1:]
+    return coef
+
+
+def tabulate(
+    potentials: List[List[PairPotential]], rc: float, n: int = 4096
+) -> NDArray:
+    """
+    Tables of the pair potentials of every pair of types, for the force
+    kernels, see hermite_table. The bin of a pair at squared distance r2
+    is int(r2*n/rc^2).
+
+    Args:
+        potentials (List[List[PairPotential]]): potentials of the pairs
+            of types, see pair_potentials
+        rc (float): cutoff radius
+        n (int, optional): number of bins. Defaults to 4096.
+
+    Returns:
+        NDArray: tables, as a (T,T,n,4) C-contiguous array
+    """
+    T = len(potentials)
+    table = np.empty((T, T, n, 4))
+    for a in range(T):
+        for b in range(T):
+            table[a, b] = hermite_table(potentials[a][b], rc, n)
+    return table
+
+
+def tail_integrals(
+    pot: PairPotential, rc: float, points: int = 64
+) -> Tuple[float, float]:
+    """
+    Integrals of r^2*U(r) and r^3*dU/dr from rc to infinity, by
+    Gauss-Legendre quadrature in u = rc/r.
+
+    Args:
+        pot (PairPotential): the potential
+        rc (float): cutoff radius
+        points (int, optional): quadrature points. Defaults to 64.
+
+    Returns:
+        Tuple[float, float]: the two integrals
+    """
+    u, w = np.polynomial.legendre.leggauss(points)
+    u = 0.5 * (u + 1)
+    w = 0.5 * w
+    r = rc / u
+    # dr = rc/u^2 du
+    jac = w * rc / (u * u)
+    return (
+        float(np.sum(jac * r * r * pot.energy(r))),
+        float(np.sum(jac * r ** 3 * pot.derivative(r))),
+    )
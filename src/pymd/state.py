@@ -1,12 +1,34 @@
 import json
-from typing import List, Tuple, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 from nptyping import NDArray
 
 from pymd.atoms import Atoms
-from pymd.element import gen_element
-from pymd.force_LJ import force
+from pymd.backend import Backend, get_backend
+from pymd.element import (
+    Element,
+    gen_element,
+    lorentz_berthelot,
+    reduced_charges,
+)
+from pymd.ewald import SPME
+from pymd.neighbor import NeighborList
+from pymd.potential import (
+    LennardJones,
+    PairPotential,
+    Switched,
+    pair_potentials,
+    tabulate,
+    tail_integrals,
+)
+from pymd.trajectory import AsyncSnapshotWriter, SnapshotWriter
+
+# Types, mixing table and spline tables of a single Lennard-Jones
+# species, for the compiled steps
+NO_TYPES = np.empty(0, dtype=np.intc)
+NO_MIX = np.empty((0, 0, 3))
+NO_TABLE = np.empty((0, 0, 0, 4))
 
 
 # TODO: correct simulate for optional s
@@ -21,8 +43,31 @@ class NVEState:
         atoms (Atoms): Atoms object, with information about element, positions,
             velocities, box length, box crossing
         rc (float): Cutoff radius
+        method (str): force algorithm, "n2" for the all-pairs loop,
+            "cell" for the linked-cell list or "verlet" for the Verlet
+            neighbor list
+        nlist (NeighborList): neighbor list, None if method isn't "verlet"
+        buffers (Tuple[NDArray, ...]): cell and neighbor list buffers of
+            the compiled step, see allocate_buffers
+        backend (Backend): compiled kernels used for the forces
+        sort_every (int): steps between two sorts of the atoms along a
+            space filling curve, 0 to never sort
+        curve (str): space filling curve used to sort the atoms
+        unsorted_steps (int): steps done since the last sort
         corr (Dict[str,float]): dictionary with energy at cutoff,
             energy correction, pressure correction
+        mix (NDArray): mixing table of a mixture, as mix[a,b] =
+            (sigma_ab^2, epsilon_ab, ecut_ab) in normal units of the first
+            species, None for a single species or a tabulated potential
+        potentials (List[List[PairPotential]]): short-range pair
+            potential of every pair of types, None for the Lennard-Jones
+            potential without charges
+        table (NDArray): spline tables of the potentials, with the
+            real-space Ewald terms of charged species, see
+            pymd.potential.tabulate, None for the Lennard-Jones potential
+            without charges
+        charges (NDArray): charge of every species, in normal units
+        spme (SPME): reciprocal-space Ewald sum, None without charges
         f (NDArray): array of forces on particles
         T (float): temperature
         PE (float): potential energy
@@ -31,6 +76,12 @@ class NVEState:
         TEO (float): total energy at time=0
         drift (float): energy drift from the start ((TE-TE0)/TE0)
         P (float): pressure
+        stress (bool): if True, per-atom energy and virial and the
+            pressure tensor are computed with the forces
+        eatom (NDArray): energy of every atom, with stress
+        vatom (NDArray): virial of every atom, with stress
+        W (NDArray): virial tensor, as (3,3), with stress
+        Ptensor (NDArray): pressure tensor, as (3,3), with stress
     """
 
     OUTDTYPE = np.dtype(
@@ -44,6 +95,20 @@ class NVEState:
             ("P", np.float64),
         ]
     )
+    # Output of a state with stress, with the pressure tensor
+    STRESSDTYPE = np.dtype(
+        OUTDTYPE.descr
+        + [
+            ("Pxx", np.float64),
+            ("Pyy", np.float64),
+            ("Pzz", np.float64),
+            ("Pxy", np.float64),
+            ("Pxz", np.float64),
+            ("Pyz", np.float64),
+        ]
+    )
+    # Per-atom output of a state with stress
+    ATOMDTYPE = np.dtype([("PE", np.float64), ("vir", np.float64)])
 
     def __init__(
         self,
@@ -51,6 +116,17 @@ class NVEState:
         T0: float,
         rc: float,
         use_e_corr: bool = False,
+        method: str = "cell",
+        skin: float = 0.3,
+        backend: Union[str, Backend] = None,
+        sort_every: int = 0,
+        curve: str = "hilbert",
+        potential: Union[
+            PairPotential, Callable, Dict[Tuple[str, str], PairPotential]
+        ] = None,
+        table_size: int = 4096,
+        stress: bool = False,
+        ewald_tol: float = 1e-5,
     ):
         """
         Initialize NVEState object.
@@ -61,9 +137,40 @@ class NVEState:
             rc (float): Cutoff radius for force calculation
             use_e_corr (bool, optional): Use energy corrections.
                 Defaults to False.
+            method (str, optional): Force algorithm, "n2", "cell" or
+                "verlet". Defaults to "cell".
+            skin (float, optional): Skin of the Verlet neighbor list.
+                Defaults to 0.3.
+            backend (Union[str, Backend], optional): Kernels backend, as
+                "serial" or "openmp". Defaults to None, using the
+                PYMD_BACKEND environment variable or "serial".
+            sort_every (int, optional): Sort the atoms along a space
+                filling curve every sort_every steps, to keep atoms close
+                in space close in memory. Defaults to 0, never sort.
+            curve (str, optional): Space filling curve, "hilbert" or
+                "morton". Defaults to "hilbert".
+            potential (Union[PairPotential, Callable, Dict], optional):
+                Pair potential in normal units, as a PairPotential, a
+                function of r, or a dictionary of them keyed by pairs of
+                species names. It is tabulated once and used by the same
+                kernels. Defaults to None, the Lennard-Jones potential.
+            table_size (int, optional): Bins of the spline tables of the
+                potential. Defaults to 4096.
+            stress (bool, optional): Compute per-atom energy and virial
+                and the pressure tensor in the same pass as the forces,
+                and output the pressure tensor. Steps don't run in the
+                compiled kernels. Defaults to False.
+            ewald_tol (float, optional): Accuracy of the Ewald sum of
+                the Coulomb interaction of charged species, in units of
+                the interaction of two unit charges at unit distance, see
+                pymd.ewald.SPME.tuned. Defaults to 1e-5.
 
         Raises:
             ValueError: If cutoff radius is greater than half box length
+            ValueError: If method is not a known force algorithm
+            ValueError: If curve is not a known space filling curve
+            ValueError: If cutoff radius plus skin is greater than half box
+                length, using the Verlet neighbor list
         """
         self.time = 0.0
         self.atoms = atoms
@@ -72,8 +179,55 @@ class NVEState:
             raise ValueError(
                 "Cutoff radius can't be greater than half box length"
             )
+        if method not in ("n2", "cell", "verlet"):
+            raise ValueError(f"Unknown force method {method}")
+        self.method = method
+        if curve not in ("hilbert", "morton"):
+            raise ValueError(f"Unknown space filling curve {curve}")
+        self.sort_every = sort_every
+        self.curve = curve
+        self.unsorted_steps = 0
+        if self.sort_every:
+            self.atoms.sort(self.curve)
+        self.backend = get_backend(backend)
+        self.nlist = None
+        if self.method == "verlet":
+            if self.rc + skin > self.atoms.L / 2:
+                raise ValueError(
+                    "Cutoff radius plus skin can't be greater than half "
+                    "box length"
+                )
+            self.nlist = NeighborList(self.rc, skin, self.backend)
+        self.buffers = self.allocate_buffers()
         # Calc forces, potential energy, virial term
         # using the chosen potential
+        self.potentials = None
+        self.table = None
+        self.mix = None
+        self.charges = reduced_charges(self.atoms.species)
+        self.spme = None
+        if np.any(self.charges):
+            self.spme = SPME.tuned(
+                self.atoms.L,
+                self.rc,
+                ewald_tol,
+                q=self.charges[self.atoms.types],
+            )
+            if potential is None:
+                potential = lennard_jones(self.atoms.species)
+        if potential is not None:
+            self.potentials = pair_potentials(
+                potential, [elem.name for elem in self.atoms.species]
+            )
+            self.table = tabulate(self.table_potentials(), self.rc, table_size)
+        elif self.atoms.ntypes > 1:
+            self.mix = self.mixing_table(self.rc)
+        self.stress = stress
+        if self.stress:
+            self.OUTDTYPE = self.STRESSDTYPE
+            self.eatom = np.zeros(self.atoms.N)
+            self.vatom = np.zeros(self.atoms.N)
+            self.W = np.zeros((3, 3))
         self.corr = {"ecut": 0.0, "ecorr": 0.0, "pcorr": 0.0}
         corr = self.corrections(self.rc, self.atoms.rho, use_e_corr)
         self.corr["ecut"] = corr[0]
@@ -81,35 +235,268 @@ class NVEState:
         self.corr["pcorr"] = corr[2]
         self.f, self.PE, vir = self.calc_force_PE()
         if T0 > 0:
-            self.KE = 0.5 * np.sum(self.atoms.v * self.atoms.v)
+            self.KE = 0.5 * np.sum(
+                self.atoms.v * self.atoms.v, dtype=np.float64
+            )
             self.T = self.KE * 2 / 3.0 / self.atoms.N
             self.atoms.v *= np.sqrt(T0 / self.T)
         self.calc_vars(vir)
 
-    def step(self, dt: float):
+    def step(self, dt: float, out: NDArray = None):
         """
         Simulation step. Brings state to time+dt using a
-        velocity verlet integration algorithm.
+        velocity verlet integration algorithm. If the backend has a
+        compiled step, the whole step runs in place on preallocated
+        buffers.
 
         Args:
             dt (float): timestep
+            out (NDArray, optional): output row, as output[i:i+1], where
+                the state variables are written. Defaults to None.
         """
         self.time += dt
-        # First integration half-step
-        self.atoms.v += 0.5 * dt * self.f
-        self.atoms.r += self.atoms.v * dt
-        # Apply periodic boundary conditions
-        self.atoms.r[self.atoms.r > self.atoms.L] -= self.atoms.L
-        self.atoms.i[self.atoms.r > self.atoms.L] += 1
-        self.atoms.r[self.atoms.r < 0] += self.atoms.L
-        self.atoms.i[self.atoms.r < 0] -= 1
-
-        # Calculate forces
-        self.f, self.PE, vir = self.calc_force_PE()
+        if self.fused:
+            self.PE, vir, KE = self.fused_step(dt)
+            KE += self.thermostat(dt)
+        else:
+            # First integration half-step
+            self.atoms.v += 0.5 * dt * self.f
+            self.atoms.r += self.atoms.v * dt
+            # Apply periodic boundary conditions
+            self.atoms.wrap()
 
-        # Second integration half-step
-        self.atoms.v += 0.5 * dt * self.f
-        self.calc_vars(vir)
+            # Calculate forces
+            self.f, self.PE, vir = self.calc_force_PE()
+
+            # Second integration half-step
+            self.atoms.v += 0.5 * dt * self.f
+            self.thermostat(dt)
+            KE = None
+        self.calc_vars(vir, KE)
+        if out is not None:
+            self.vars_output(out)
+        self.resort(1)
+
+    def fused_step(self, dt: float) -> Tuple[float, float, float]:
+        """
+        Velocity verlet step using the compiled kernel of the backend,
+        updating positions, velocities, box crossings and forces in place.
+
+        Args:
+            dt (float): timestep
+
+        Returns:
+            Tuple[float, float, float]: potential energy, virial term,
+                kinetic energy
+        """
+        PE, vir, KE, size = self.backend.vv_step(*self.kernel_args(dt))
+        if self.nlist is not None:
+            self.nlist.record(1, int(size >= 0), size, self.atoms)
+        return PE, vir, KE
+
+    @property
+    def fused(self) -> bool:
+        """
+        True if steps can run in the compiled kernel of the backend, which
+        computes neither the stress nor the reciprocal-space Ewald sum.
+        """
+        return (
+            self.backend.has("vv_step")
+            and not self.stress
+            and self.spme is None
+        )
+
+    @property
+    def compiled(self) -> bool:
+        """
+        True if blocks of steps can run in the compiled kernel of the
+        backend, see fused.
+        """
+        return self.fused and self.backend.has("vv_run")
+
+    def run(
+        self,
+        nsteps: int,
+        dt: float,
+        sample_every: int,
+        on_sample: Callable[[int, NDArray], Optional[bool]] = None,
+        out: NDArray[OUTDTYPE] = None,
+    ) -> NDArray[OUTDTYPE]:
+        """
+        Run for a given number of timesteps. If the state is compiled, the
+        steps between two samples run in the compiled kernel without the
+        GIL, and the state variables are filled only at sampling points.
+
+        Args:
+            nsteps (int): number of timesteps
+            dt (float): timestep
+            sample_every (int): sampling frequency, in steps
+            on_sample (Callable[[int, NDArray], Optional[bool]], optional):
+                called every sample_every steps with the number of steps
+                done and the output array, filled up to that step. The
+                atoms are at that step, so it can save snapshots. If it
+                returns True, the run stops. Defaults to None.
+            out (NDArray, optional): output array of nsteps rows, where the
+                state variables of every step are written. Defaults to
+                None.
+
+        Returns:
+            NDArray: output array with the state variables of the steps
+                done, as [time, KE, PE, TE, drift, T, P]
+        """
+        if out is None:
+            out = np.empty(nsteps, dtype=self.OUTDTYPE)
+        if self.compiled:
+            thermo = np.empty((max(min(sample_every, nsteps), 1), 3))
+        i = 0
+        while i < nsteps:
+            if self.compiled:
+                block = min(sample_every - i % sample_every, nsteps - i)
+                if self.sort_every:
+                    block = min(block, self.sort_every - self.unsorted_steps)
+                i += self.run_block(dt, thermo[:block], out[i : i + block])
+            else:
+                self.step(dt, out=out[i : i + 1])
+                i += 1
+            if i % sample_every == 0 and on_sample is not None:
+                if on_sample(i, out):
+                    return out[:i]
+        return out
+
+    def run_block(self, dt: float, thermo: NDArray, out: NDArray) -> int:
+        """
+        Run a block of steps in the compiled kernel of the backend. It may
+        stop early, if the neighbor list must grow.
+
+        Args:
+            dt (float): timestep
+            thermo (NDArray): buffer for potential energy, virial and
+                kinetic energy of the steps, as a (steps,3) array
+            out (NDArray): output rows for the steps
+
+        Returns:
+            int: number of steps done
+        """
+        steps, builds, size = self.backend.vv_run(
+            *self.kernel_args(dt), thermo
+        )
+        if self.nlist is not None:
+            self.nlist.record(steps, builds, size, self.atoms)
+        PE, vir, KE = thermo[:steps].T
+        out = out[:steps]
+        out["time"] = self.time + dt * np.arange(1, steps + 1)
+        out["KE"] = KE
+        out["PE"] = PE
+        out["TE"], out["drift"], out["T"], out["P"] = self.state_vars(
+            PE, KE, vir
+        )
+        self.time, self.KE, self.PE, self.TE, self.drift, self.T, self.P = out[
+            -1
+        ].item()
+        self.resort(steps)
+        return steps
+
+    def resort(self, steps: int):
+        """
+        Count the steps done since the last sort of the atoms, and sort
+        them again if they are sort_every.
+
+        Args:
+            steps (int): number of steps done
+        """
+        self.unsorted_steps += steps
+        if self.sort_every and self.unsorted_steps >= self.sort_every:
+            self.sort_atoms()
+
+    def sort_atoms(self) -> NDArray:
+        """
+        Sort the atoms along the space filling curve, permuting the forces
+        with them and rebuilding the neighbor list.
+
+        Returns:
+            NDArray: permutation applied to the atoms
+        """
+        perm = self.atoms.sort(self.curve)
+        self.f[:] = self.f[perm]
+        if self.stress:
+            self.eatom[:] = self.eatom[perm]
+            self.vatom[:] = self.vatom[perm]
+        if self.nlist is not None:
+            self.nlist.build(self.atoms)
+        self.unsorted_steps = 0
+        return perm
+
+    def kernel_args(self, dt: float) -> tuple:
+        """
+        Arguments of the compiled steps of the backend, vv_step and
+        vv_run.
+
+        Args:
+            dt (float): timestep
+
+        Returns:
+            tuple: positions, velocities, forces, box crossings, box
+                length, timestep, cutoff, corrections, types, mixing
+                table and spline tables, method, buffers and skin
+        """
+        if self.nlist is not None:
+            buffers = self.nlist.buffers
+            skin = self.nlist.skin
+        else:
+            buffers = self.buffers
+            skin = 0.0
+        pair = self.pair_args
+        return (
+            self.atoms.r,
+            self.atoms.v,
+            self.f,
+            self.atoms.i,
+            self.atoms.L,
+            dt,
+            self.rc,
+            self.corr["ecorr"],
+            self.corr["ecut"],
+            pair.get("types", NO_TYPES),
+            pair.get("mix", NO_MIX),
+            pair.get("table", NO_TABLE),
+            self.backend.METHODS[self.method],
+            *buffers,
+            skin,
+        )
+
+    def allocate_buffers(self) -> Tuple[NDArray, ...]:
+        """
+        Allocates the buffers used by the compiled step, as (head, nxt,
+        cell, start, nbr, r0). Only the cell buffers are used with the
+        "cell" method, none with "n2"; the Verlet neighbor list has its
+        own.
+
+        Returns:
+            Tuple[NDArray, ...]: buffers of the compiled step
+        """
+        N = self.atoms.N if self.method == "cell" else 0
+        M = self.backend.cells_per_side(self.atoms.L, self.rc) if N else 0
+        return (
+            np.empty(M ** 3, dtype=np.intc),
+            np.empty(N, dtype=np.intc),
+            np.empty((N, 3), dtype=np.intc),
+            np.empty(0, dtype=np.intc),
+            np.empty(0, dtype=np.intc),
+            np.empty((0, 3), dtype=self.atoms.r.dtype),
+        )
+
+    def thermostat(self, dt: float) -> float:
+        """
+        Thermostat, applied at the end of the step. The microcanonical
+        ensemble has none.
+
+        Args:
+            dt (float): timestep
+
+        Returns:
+            float: change of kinetic energy
+        """
+        return 0.0
 
     def simulate(
         self,
@@ -119,6 +506,7 @@ class NVEState:
         unfold: bool = False,
         append: bool = True,
         filename: str = None,
+        fmt: str = "xyz",
     ) -> Tuple[NDArray, List[Atoms]]:
         """
         Simulate for a given number of timesteps, saving the position
@@ -139,6 +527,13 @@ class NVEState:
                 Defaults to True.
             filename (str, optional): filename of .xyz file, without the
                 extension.
+            fmt (str, optional): format of the snapshots, "xyz" text,
+                "trj" binary or "ctrj" chunked, compressed trajectory, see
+                SnapshotWriter; binary files store the box crossings, so
+                unfold doesn't apply. Defaults to "xyz".
+
+        Raises:
+            ValueError: if fmt is not a known format
 
         Returns:
             NDArray: output array with all the state variables, as
@@ -147,28 +542,39 @@ class NVEState:
         """
         # Creates array of timesteps
         dt = np.array(dt)
-        if dt.shape != s:
+        if dt.shape != (s,):
             dt = np.ones(s) * dt.item(0)
         # Creates output array and output list
         output = np.empty(s, dtype=self.OUTDTYPE)
         output[0] = self.vars_output()
         atomsOutput = [self.atoms.copy()]
-        # If a filename is given, writes .xyz output
+        # If a filename is given, writes the snapshots in the format, in
+        # a background thread, see AsyncSnapshotWriter
         if filename is not None:
-            self.atoms.write_xyz(filename + "_0.xyz")
-        # Simulation loop
-        for i in range(1, s):
-            # Step
-            self.step(dt[i])
-            # Save all variables
-            output[i] = self.vars_output()
-            if i % fSamp == 0:
-                atomsOutput += [self.atoms.copy()]
-                if filename is not None:
-                    if append:
-                        self.atoms.write_xyz(filename + "_0.xyz", append=True)
-                    else:
-                        self.atoms.write_xyz(filename + f"_{i}.xyz")
+            write = AsyncSnapshotWriter(self.atoms, fmt, unfold)
+            write(f"{filename}_0.{fmt}", atoms=atomsOutput[0])
+        else:
+            write = SnapshotWriter(self.atoms, fmt, unfold)
+
+        def sample(i: int, out: NDArray):
+            atomsOutput.append(self.atoms.copy())
+            if filename is not None:
+                if append:
+                    write(f"{filename}_0.{fmt}", True, atomsOutput[-1])
+                else:
+                    write(f"{filename}_{i}.{fmt}", atoms=atomsOutput[-1])
+
+        # Leaving the with block, also on errors, writes all the snapshots
+        with write:
+            # Simulation loop, in blocks if the timestep is constant
+            if np.all(dt[1:] == dt[0]):
+                self.run(s - 1, dt[0], fSamp, on_sample=sample, out=output[1:])
+                return output, atomsOutput
+            for i in range(1, s):
+                # Step, saving all variables
+                self.step(dt[i], out=output[i : i + 1])
+                if i % fSamp == 0:
+                    sample(i, output)
         return output, atomsOutput
 
     def corrections(
@@ -176,7 +582,12 @@ class NVEState:
     ) -> Tuple[float, float, float]:
         """
         Computes the tail-corrections of a Lennard Jones potential, in
-        normal units.
+        normal units. For a mixture, the corrections of every pair of
+        species are weighted by their fractions, and the energy at cutoff
+        is the one of the first species, the others are in the mixing
+        table. A tabulated potential is already shifted to zero at the
+        cutoff, and its corrections are integrated numerically, see
+        pymd.potential.tail_integrals.
 
         Args:
             rc (float): Cutoff radius
@@ -188,75 +599,373 @@ class NVEState:
             Tuple[float, float, float]: energy at cutoff, energy correction,
                 potential correction
         """
-        rr3 = 1 / rc ** 3
+        x = np.outer(self.atoms.fractions, self.atoms.fractions)
+        if self.potentials is not None:
+            if not use_e_corr:
+                return 0.0, 0, 0
+            tails = np.array(
+                [
+                    [tail_integrals(pot, rc) for pot in row]
+                    for row in self.potentials
+                ]
+            )
+            ecor = 2 * np.pi * rho * np.sum(x * tails[..., 0])
+            pcor = -2 / 3 * np.pi * rho ** 2 * np.sum(x * tails[..., 1])
+            return 0.0, ecor, pcor
+        sigma, eps = lorentz_berthelot(self.atoms.species)
+        # sigma^3 * (sigma/rc)^3 of every pair
+        s3 = sigma ** 3
+        rr3 = (sigma / rc) ** 3
         ecor = (
-            8 * np.pi * rho * ((rr3 ** 3) / 9 - rr3 / 3) if use_e_corr else 0
+            8 * np.pi * rho * np.sum(x * eps * s3 * ((rr3 ** 3) / 9 - rr3 / 3))
+            if use_e_corr
+            else 0
         )
         pcor = (
-            16 / 3 * np.pi * (rho ** 2) * (2 / 3 * (rr3 ** 3) - rr3)
+            16
+            / 3
+            * np.pi
+            * (rho ** 2)
+            * np.sum(x * eps * s3 * (2 / 3 * (rr3 ** 3) - rr3))
             if use_e_corr
             else 0
         )
-        ecut = 4 * (rr3 ** 4 - rr3 ** 2)
+        ecut = 4 * (rr3[0, 0] ** 4 - rr3[0, 0] ** 2)
         return ecut, ecor, pcor
 
+    def mixing_table(self, rc: float) -> NDArray:
+        """
+        Mixing table of the species, from the Lorentz-Berthelot rules. It
+        is computed once, so that the kernels only look up the parameters
+        of every pair.
+
+        Args:
+            rc (float): Cutoff radius
+
+        Returns:
+            NDArray: mix[a,b] = (sigma_ab^2, epsilon_ab, ecut_ab), as a
+                (T,T,3) array
+        """
+        sigma, eps = lorentz_berthelot(self.atoms.species)
+        sr6 = (sigma / rc) ** 6
+        ecut = 4 * eps * (sr6 * sr6 - sr6)
+        return np.ascontiguousarray(np.stack([sigma ** 2, eps, ecut], -1))
+
     def calc_force_PE(self) -> Tuple[NDArray, float, float]:
         """
         Computes force, potential energy and virial term using the
-        imported extension.
+        imported extension, adding the reciprocal-space Ewald sum of
+        charged species.
 
         Returns:
             Tuple[NDArray, float, float]: array of forces, potential
                 energy, virial term
         """
-        return force(
+        return self.long_range_force(*self.short_range_force())
+
+    def short_range_force(
+        self,
+        rc: float = None,
+        table: NDArray = None,
+        corrections: bool = True,
+        tally: Dict[str, NDArray] = None,
+    ) -> Tuple[NDArray, float, float]:
+        """
+        Computes force, potential energy and virial term of the pairs
+        within the cutoff, with the force kernels of the backend.
+
+        Args:
+            rc (float, optional): cutoff radius. Defaults to None, the one
+                of the state.
+            table (NDArray, optional): spline tables used instead of the
+                ones of the state, tabulated up to rc. Defaults to None.
+            corrections (bool, optional): if True, add the energy
+                correction and use the energy at cutoff. Defaults to True.
+            tally (Dict[str, NDArray], optional): per-atom energy and
+                virial and virial tensor to fill, see stress_args.
+                Defaults to None, the ones of the state.
+
+        Returns:
+            Tuple[NDArray, float, float]: array of forces, potential
+                energy, virial term
+        """
+        if rc is None:
+            rc = self.rc
+        pair = self.pair_args
+        if table is not None:
+            pair["table"] = table
+        if tally is None:
+            tally = self.stress_args
+        corr = (
+            (self.corr["ecorr"], self.corr["ecut"]) if corrections else (0, 0)
+        )
+        if self.method == "verlet":
+            self.nlist.update(self.atoms)
+            return self.backend.force_neighbors(
+                self.atoms.r,
+                self.atoms.L,
+                rc,
+                *corr,
+                self.nlist.start,
+                self.nlist.nbr,
+                **pair,
+                **tally,
+            )
+        if self.method == "cell":
+            kernel = self.backend.force_cell
+        else:
+            kernel = self.backend.force
+        return kernel(self.atoms.r, self.atoms.L, rc, *corr, **pair, **tally)
+
+    def long_range_force(
+        self, f: NDArray, PE: float, vir: float
+    ) -> Tuple[NDArray, float, float]:
+        """
+        Adds the reciprocal-space Ewald sum of charged species to force,
+        potential energy and virial term, if the state has charges.
+
+        Args:
+            f (NDArray): array of forces, updated in place
+            PE (float): potential energy
+            vir (float): virial term
+
+        Returns:
+            Tuple[NDArray, float, float]: array of forces, potential
+                energy, virial term
+        """
+        if self.spme is None:
+            return f, PE, vir
+        stress = self.stress_args
+        flong, e, v = self.spme.compute(
             self.atoms.r,
-            self.atoms.L,
-            self.rc,
-            self.corr["ecorr"],
-            self.corr["ecut"],
+            self.charges[self.atoms.types],
+            eatom=stress.get("eatom"),
+            W=stress.get("W"),
+        )
+        f += flong
+        return f, PE + e, vir + v
+
+    def table_potentials(self) -> List[List[PairPotential]]:
+        """
+        Pair potentials tabulated for the force kernels: the short-range
+        ones, plus the real-space Ewald terms of charged species.
+
+        Returns:
+            List[List[PairPotential]]: potentials, indexed by the types
+        """
+        if self.spme is None:
+            return self.potentials
+        return [
+            [pot + coul for pot, coul in zip(*rows)]
+            for rows in zip(
+                self.potentials, self.spme.real_space(self.charges)
+            )
+        ]
+
+    def calc_PE(self, atoms: Atoms = None) -> Tuple[float, float]:
+        """
+        Computes potential energy and virial term only, without
+        allocating and computing the forces, of the state or of another
+        configuration of the same species in the same box, like a frame
+        of a trajectory.
+
+        Args:
+            atoms (Atoms, optional): configuration to score. Defaults to
+                None, the atoms of the state.
+
+        Returns:
+            Tuple[float, float]: potential energy, virial term
+        """
+        pair = self.pair_args
+        types = pair.get("types", np.zeros(0, dtype=np.intc))
+        if atoms is None or atoms is self.atoms:
+            atoms = self.atoms
+        elif "types" in pair:
+            index = {elem.name: t for t, elem in enumerate(self.atoms.species)}
+            types = pair["types"] = np.array(
+                [index[name] for name in atoms.names], dtype=np.intc
+            )
+        if atoms is self.atoms and self.method == "verlet":
+            self.nlist.update(atoms)
+            PE, vir = self.backend.energy_neighbors(
+                atoms.r,
+                atoms.L,
+                self.rc,
+                self.corr["ecorr"],
+                self.corr["ecut"],
+                self.nlist.start,
+                self.nlist.nbr,
+                **pair,
+            )
+        else:
+            if self.method == "n2":
+                kernel = self.backend.energy
+            else:
+                kernel = self.backend.energy_cell
+            PE, vir = kernel(
+                atoms.r,
+                atoms.L,
+                self.rc,
+                self.corr["ecorr"],
+                self.corr["ecut"],
+                **pair,
+            )
+        if self.spme is not None:
+            q = self.charges[types] if len(types) else self.charges[0]
+            _, e, v = self.spme.compute(
+                atoms.r, np.broadcast_to(q, atoms.N), forces=False
+            )
+            PE += e
+            vir += v
+        return PE, vir
+
+    def rescore(
+        self, atomslist: List[Atoms], times: NDArray = None
+    ) -> NDArray[OUTDTYPE]:
+        """
+        Recomputes the state variables of stored frames with the
+        potential of the state, from energy and virial only, see calc_PE.
+        The drift is relative to the initial energy of the state.
+
+        Args:
+            atomslist (List[Atoms]): frames, as from atomslist_fromfile
+            times (NDArray, optional): time of every frame. Defaults to
+                None, the index of the frame.
+
+        Returns:
+            NDArray: output array with the state variables of the frames,
+                as a structured array [time, KE, PE, TE, drift, T, P]
+        """
+        out = np.zeros(len(atomslist), dtype=NVEState.OUTDTYPE)
+        out["time"] = np.arange(len(atomslist)) if times is None else times
+        vir = np.zeros(len(atomslist))
+        for k, atoms in enumerate(atomslist):
+            out["PE"][k], vir[k] = self.calc_PE(atoms)
+            out["KE"][k] = 0.5 * np.sum(atoms.v * atoms.v, dtype=np.float64)
+        out["TE"], out["drift"], out["T"], out["P"] = self.state_vars(
+            out["PE"], out["KE"], vir
         )
+        return out
+
+    @property
+    def pair_args(self) -> Dict[str, NDArray]:
+        """
+        Types, mixing table and spline tables passed to the force kernels,
+        only the ones in use: empty for a single Lennard-Jones species.
+        """
+        args = {}
+        if self.atoms.ntypes > 1:
+            args["types"] = self.atoms.types
+        if self.mix is not None:
+            args["mix"] = self.mix
+        if self.table is not None:
+            args["table"] = self.table
+        return args
 
-    def vars_output(self) -> NDArray[OUTDTYPE]:
+    @property
+    def stress_args(self) -> Dict[str, NDArray]:
+        """
+        Per-atom energy and virial and virial tensor filled by the force
+        kernels, empty without stress.
+        """
+        if not self.stress:
+            return {}
+        return {"eatom": self.eatom, "vatom": self.vatom, "W": self.W}
+
+    def atom_vars(self) -> NDArray[ATOMDTYPE]:
+        """
+        Outputs the per-atom energy and virial of the last force
+        evaluation, in the original order of the atoms.
+
+        Returns:
+            NDArray: structured array [PE, vir], one row for atom
+        """
+        idx = np.argsort(self.atoms.order)
+        out = np.empty(self.atoms.N, dtype=self.ATOMDTYPE)
+        out["PE"] = self.eatom[idx]
+        out["vir"] = self.vatom[idx]
+        return out
+
+    def vars_output(self, out: NDArray[OUTDTYPE] = None) -> NDArray[OUTDTYPE]:
         """
         Outputs all the state variables.
 
+        Args:
+            out (NDArray, optional): output row, as output[i:i+1], where
+                the variables are written instead of a new array.
+                Defaults to None.
+
         Returns:
             NDArray: output array with all the state variables, as a
-                structured array [time, KE, PE, TE, drift, T, P]
+                structured array [time, KE, PE, TE, drift, T, P], with
+                stress followed by [Pxx, Pyy, Pzz, Pxy, Pxz, Pyz]
         """
-        return np.array(
-            [
-                (
-                    self.time,
-                    self.KE,
-                    self.PE,
-                    self.TE,
-                    self.drift,
-                    self.T,
-                    self.P,
-                )
-            ],
-            dtype=self.OUTDTYPE,
+        row = (
+            self.time,
+            self.KE,
+            self.PE,
+            self.TE,
+            self.drift,
+            self.T,
+            self.P,
         )
+        if self.stress:
+            P = self.Ptensor
+            row += (P[0, 0], P[1, 1], P[2, 2], P[0, 1], P[0, 2], P[1, 2])
+        if out is None:
+            return np.array([row], dtype=self.OUTDTYPE)
+        out[...] = row
+        return out
 
-    def calc_vars(self, vir: float):
+    def calc_vars(self, vir: float, KE: float = None):
         """
         Calculate the state variables.
 
         Args:
             vir (float): virial term, used to calculate pressure
+            KE (float, optional): kinetic energy, if already known.
+                Defaults to None.
         """
-        self.KE = 0.5 * np.sum(self.atoms.v * self.atoms.v)
-        self.T = self.KE * 2 / 3.0 / self.atoms.N
-        self.TE = self.PE + self.KE
+        if KE is None:
+            KE = 0.5 * np.einsum(
+                "ij,ij->", self.atoms.v, self.atoms.v, dtype=np.float64
+            )
+        self.KE = KE
         if self.time == 0:
-            self.TE0 = self.TE
-        self.drift = (self.TE - self.TE0) / self.TE0
-        self.P = (
-            self.atoms.rho * self.KE * 2.0 / 3.0 / self.atoms.N
-            + vir / 3.0 / (self.atoms.N / self.atoms.rho)
+            self.TE0 = self.PE + self.KE
+        self.TE, self.drift, self.T, self.P = self.state_vars(
+            self.PE, self.KE, vir
         )
+        if self.stress:
+            v = self.atoms.v
+            self.Ptensor = (
+                np.einsum("ia,ib->ab", v, v, dtype=np.float64) + self.W
+            ) * (self.atoms.rho / self.atoms.N)
+
+    def state_vars(
+        self, PE: NDArray, KE: NDArray, vir: NDArray
+    ) -> Tuple[NDArray, NDArray, NDArray, NDArray]:
+        """
+        Calculate total energy, drift, temperature and pressure from
+        potential and kinetic energy and virial term. Works both with
+        single values and arrays of steps.
+
+        Args:
+            PE (NDArray): potential energy
+            KE (NDArray): kinetic energy
+            vir (NDArray): virial term
+
+        Returns:
+            Tuple[NDArray, NDArray, NDArray, NDArray]: total energy,
+                drift, temperature, pressure
+        """
+        TE = PE + KE
+        drift = (TE - self.TE0) / self.TE0
+        T = KE * 2 / 3.0 / self.atoms.N
+        P = self.atoms.rho * KE * 2.0 / 3.0 / self.atoms.N + vir / 3.0 / (
+            self.atoms.N / self.atoms.rho
+        )
+        return TE, drift, T, P
 
     def to_JSON(self):
         statedict = {
@@ -279,6 +988,14 @@ class NVTAndersenState(NVEState):
     Attributes:
         Tbath (float): thermostat temperature
         nu (float): thermostat frequency
+        seed (int): seed of the random generator
+        rng (np.random.Generator): random generator of the thermostat
+        block (int): steps of a block of collisions, see draw_collisions
+        collisions (Dict): collisions of the current block, None before
+            the first one
+        block_state (Dict): state of the random generator before the
+            current block was drawn
+        block_step (int): steps done of the current block
     """
 
     def __init__(
@@ -289,49 +1006,125 @@ class NVTAndersenState(NVEState):
         nu: float,
         rc: float,
         use_e_corr: bool = False,
+        seed: Union[int, np.random.SeedSequence] = None,
+        block: int = 1000,
+        **kwargs,
     ):
         """
         Initialize NVTAndersenState object.
 
         Args:
-            Tbath (float): [description]
-            nu (float): [description]
+            Tbath (float): temperature of the bath
+            nu (float): collision frequency of the thermostat
+            seed (Union[int, SeedSequence], optional): seed of the random
+                generator of the thermostat. Defaults to None, a fresh
+                seed from the OS.
+            block (int, optional): steps of a block of collisions drawn at
+                once. Defaults to 1000.
+            **kwargs: additional arguments of NVEState
         """
-        super().__init__(atoms, T0, rc, use_e_corr)
+        super().__init__(atoms, T0, rc, use_e_corr, **kwargs)
         self.Tbath = Tbath
         self.nu = nu
+        self.block = block
+        self.reseed(seed)
 
-    def step(self, dt: float):
+    @property
+    def compiled(self) -> bool:
         """
-        Simulation step. Brings state to time+dt using a
-        velocity verlet integration algorithm and uses an
-        Andersen thermostat.
+        The thermostat changes velocities between steps, so steps don't
+        run in blocks.
+        """
+        return False
+
+    def reseed(self, seed: Union[int, np.random.SeedSequence] = None):
+        """
+        Restarts the thermostat with a new random generator, discarding
+        the collisions drawn.
+
+        Args:
+            seed (Union[int, SeedSequence], optional): seed of the random
+                generator. Defaults to None, a fresh seed from the OS.
+        """
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.collisions = None
+        self.block_state = None
+        self.block_step = 0
+
+    def draw_collisions(self, dt: float, skip: int = 0):
+        """
+        Draws the collisions of the next block of steps, see
+        andersen_collisions. The state of the generator before the block
+        is kept, to draw it again after a restart.
 
         Args:
             dt (float): timestep
+            skip (int, optional): steps of the block already done.
+                Defaults to 0.
         """
-        self.time += dt
-        # First integration half-step
-        self.atoms.v += 0.5 * dt * self.f
-        self.atoms.r += self.atoms.v * dt
-        # Apply periodic boundary conditions
-        self.atoms.r[self.atoms.r > self.atoms.L] -= self.atoms.L
-        self.atoms.i[self.atoms.r > self.atoms.L] += 1
-        self.atoms.r[self.atoms.r < 0] += self.atoms.L
-        self.atoms.i[self.atoms.r < 0] -= 1
-
-        # Calculate forces
-        self.f, self.PE, vir = self.calc_force_PE()
+        self.block_state = self.rng.bit_generator.state
+        self.collisions = andersen_collisions(
+            self.rng, self.atoms.N, self.nu, dt, self.block
+        )
+        self.block_step = skip
 
-        # Andersen Thermostat
-        chance = np.random.uniform(size=self.atoms.N) < self.nu * dt
-        self.atoms.v[chance] = np.random.normal(
-            scale=np.sqrt(self.Tbath), size=(np.count_nonzero(chance), 3)
+    def thermostat(self, dt: float) -> float:
+        """
+        Andersen Thermostat: every atom collides with the bath with
+        frequency nu, getting a velocity from the Maxwell-Boltzmann
+        distribution at Tbath. As it is applied after the second
+        integration half-step, the new velocities get its kick. The
+        collisions are drawn in blocks, see draw_collisions, so the cost
+        of a step scales with its collisions; a new timestep or
+        frequency starts a new block.
+
+        Args:
+            dt (float): timestep
+
+        Returns:
+            float: change of kinetic energy
+        """
+        if self.collisions is None:
+            # Restarted: draw the current block again, to consume its
+            # random numbers, and go on from its steps done
+            self.draw_collisions(dt, self.block_step)
+        elif self.collisions["dt"] != dt or self.collisions["nu"] != self.nu:
+            self.draw_collisions(dt)
+        if self.block_step >= self.block:
+            self.draw_collisions(dt)
+        start, stop = self.collisions["bounds"][
+            self.block_step : self.block_step + 2
+        ]
+        self.block_step += 1
+        hit = self.collisions["atoms"][start:stop]
+        vold = self.atoms.v[hit]
+        vnew = np.sqrt(self.Tbath) * self.collisions["v"][start:stop]
+        vnew += 0.5 * dt * self.f[hit]
+        self.atoms.v[hit] = vnew
+        return 0.5 * (
+            np.sum(vnew * vnew) - np.sum(vold * vold, dtype=np.float64)
         )
 
-        # Second integration half-step
-        self.atoms.v += 0.5 * dt * self.f
-        self.calc_vars(vir)
+    @property
+    def rng_state(self) -> Dict:
+        """
+        State of the thermostat for a restart: the state of the random
+        generator before the current block and the steps done of it.
+        Setting it restores the thermostat, so that the restarted run
+        draws the same collisions as the uninterrupted one.
+        """
+        if self.collisions is None:
+            state = self.rng.bit_generator.state
+        else:
+            state = self.block_state
+        return {"bit_generator": state, "step": self.block_step}
+
+    @rng_state.setter
+    def rng_state(self, state: Dict):
+        self.rng.bit_generator.state = state["bit_generator"]
+        self.collisions = None
+        self.block_step = state["step"]
 
     def to_JSON(self):
         statedict = {
@@ -344,10 +1137,256 @@ class NVTAndersenState(NVEState):
             "rc": self.rc,
             "Tbath": self.Tbath,
             "nu": self.nu,
+            "block": self.block,
+            "rng": self.rng_state,
         }
         return json.dumps(statedict)
 
 
+class RESPAState(NVEState):
+    """
+    Defines a microcanonical ensemble of atoms, in normal units,
+    integrated with the reversible multiple time step algorithm r-RESPA
+    (Tuckerman, Berne and Martyna, J. Chem. Phys. 97, 1990, 1992). The
+    pair potential is split by a smooth switch, see
+    pymd.potential.Switched: the inner part, cheap as it only reaches
+    the inner radius, is integrated with substeps of dt/substeps, the
+    outer shell up to the cutoff, with the reciprocal-space Ewald sum of
+    charged species, with steps of dt.
+
+    Attributes:
+        inner (float): cutoff radius of the inner part
+        switch (float): width of the switch, ending at inner
+        substeps (int): inner substeps per step
+        inner_table (NDArray): spline tables of the inner part, up to inner
+        outer_table (NDArray): spline tables of the outer part, up to rc
+        f_inner (NDArray): forces of the inner part
+        f_outer (NDArray): forces of the outer part
+        inner_stress (Dict[str, NDArray]): per-atom energy and virial and
+            virial tensor of the inner part, with stress
+        evaluations (Dict[str, int]): number of inner and outer force
+            evaluations
+    """
+
+    def __init__(
+        self,
+        atoms: Atoms,
+        T0: float,
+        rc: float,
+        inner: float = 2.0,
+        switch: float = 0.5,
+        substeps: int = 4,
+        use_e_corr: bool = False,
+        potential: Union[
+            PairPotential, Callable, Dict[Tuple[str, str], PairPotential]
+        ] = None,
+        table_size: int = 4096,
+        **kwargs,
+    ):
+        """
+        Initialize RESPAState object. The potential is always tabulated,
+        with the Lennard-Jones potential by default.
+
+        Args:
+            inner (float, optional): cutoff radius of the inner part.
+                Defaults to 2.0.
+            switch (float, optional): width of the switch from the inner
+                to the outer part. Defaults to 0.5.
+            substeps (int, optional): inner substeps per step. Defaults
+                to 4.
+            **kwargs: additional arguments of NVEState
+
+        Raises:
+            ValueError: if the switch doesn't lie between 0 and the cutoff
+                radius, or substeps is less than 1
+        """
+        if not 0 < inner - switch < inner <= rc:
+            raise ValueError(
+                "The switch must lie between 0 and the cutoff radius"
+            )
+        if substeps < 1:
+            raise ValueError("There must be at least one substep")
+        if potential is None:
+            potential = lennard_jones(atoms.species)
+        super().__init__(
+            atoms,
+            T0,
+            rc,
+            use_e_corr,
+            potential=potential,
+            table_size=table_size,
+            **kwargs,
+        )
+        self.inner = inner
+        self.switch = switch
+        self.substeps = substeps
+        pots = self.table_potentials()
+        r1 = inner - switch
+        self.inner_table = tabulate(
+            [[Switched(pot, r1, inner) for pot in row] for row in pots],
+            inner,
+            table_size,
+        )
+        self.outer_table = tabulate(
+            [
+                [Switched(pot, r1, inner, outer=True) for pot in row]
+                for row in pots
+            ],
+            rc,
+            table_size,
+        )
+        self.inner_stress = {
+            name: np.zeros_like(value)
+            for name, value in self.stress_args.items()
+        }
+        self.evaluations = {"inner": 0, "outer": 0}
+        self.f_inner, _, _ = self.inner_force(self.inner_stress)
+        self.f_outer, _, _ = self.outer_force()
+
+    @property
+    def fused(self) -> bool:
+        """
+        The compiled kernels of the backend have a single timestep.
+        """
+        return False
+
+    def step(self, dt: float, out: NDArray = None):
+        """
+        Simulation step. Brings state to time+dt with a half kick of the
+        outer forces, substeps velocity verlet steps of dt/substeps with
+        the inner forces, and another half kick of the outer forces.
+
+        Args:
+            dt (float): timestep
+            out (NDArray, optional): output row, as output[i:i+1], where
+                the state variables are written. Defaults to None.
+        """
+        self.time += dt
+        h = dt / self.substeps
+        self.atoms.v += 0.5 * dt * self.f_outer
+        for k in range(self.substeps):
+            self.atoms.v += 0.5 * h * self.f_inner
+            self.atoms.r += self.atoms.v * h
+            self.atoms.wrap()
+            # The inner stress is only needed at the end of the step
+            tally = self.inner_stress if k == self.substeps - 1 else {}
+            self.f_inner, PE, vir = self.inner_force(tally)
+            self.atoms.v += 0.5 * h * self.f_inner
+        self.f_outer, PE_outer, vir_outer = self.outer_force()
+        self.atoms.v += 0.5 * dt * self.f_outer
+        self.f = self.f_inner + self.f_outer
+        self.PE = PE + PE_outer
+        self.thermostat(dt)
+        self.calc_vars(vir + vir_outer)
+        if out is not None:
+            self.vars_output(out)
+        self.resort(1)
+
+    def inner_force(
+        self, tally: Dict[str, NDArray] = None
+    ) -> Tuple[NDArray, float, float]:
+        """
+        Computes force, potential energy and virial term of the inner
+        part of the potential.
+
+        Args:
+            tally (Dict[str, NDArray], optional): per-atom energy and
+                virial and virial tensor to fill. Defaults to None.
+
+        Returns:
+            Tuple[NDArray, float, float]: array of forces, potential
+                energy, virial term
+        """
+        self.evaluations["inner"] += 1
+        return self.short_range_force(
+            self.inner, self.inner_table, False, {} if tally is None else tally
+        )
+
+    def outer_force(self) -> Tuple[NDArray, float, float]:
+        """
+        Computes force, potential energy and virial term of the outer
+        part of the potential, with the energy correction and the
+        reciprocal-space Ewald sum. With stress, the last inner stress is
+        added to the outer one.
+
+        Returns:
+            Tuple[NDArray, float, float]: array of forces, potential
+                energy, virial term
+        """
+        self.evaluations["outer"] += 1
+        f, PE, vir = self.long_range_force(
+            *self.short_range_force(table=self.outer_table)
+        )
+        for name, value in self.inner_stress.items():
+            getattr(self, name)[...] += value
+        return f, PE, vir
+
+    def sort_atoms(self) -> NDArray:
+        perm = super().sort_atoms()
+        self.f_inner[:] = self.f_inner[perm]
+        self.f_outer[:] = self.f_outer[perm]
+        return perm
+
+
+def andersen_collisions(
+    rng: np.random.Generator, N: int, nu: float, dt: float, block: int
+) -> Dict:
+    """
+    Collisions of N atoms with an Andersen thermostat over a block of
+    steps. The collisions of every atom are a Poisson process of rate nu,
+    so the collisions of all the atoms in a block are drawn at once:
+    their number from a Poisson distribution of mean N*nu*dt*block, then
+    a random atom, step and unit normal velocity for each one. Collisions
+    of an atom in the same step count once.
+
+    Args:
+        rng (np.random.Generator): random generator
+        N (int): number of atoms
+        nu (float): collision frequency
+        dt (float): timestep
+        block (int): steps of the block
+
+    Returns:
+        Dict: timestep and frequency of the block, atom and unit normal
+            velocity of every collision, sorted by step, and bounds of the
+            collisions of every step, as "dt", "nu", "atoms", "v" and
+            "bounds"
+    """
+    n = rng.poisson(N * nu * dt * block)
+    steps = rng.integers(block, size=n)
+    atoms = rng.integers(N, size=n)
+    steps, atoms = np.divmod(np.unique(steps * N + atoms), N)
+    return {
+        "dt": dt,
+        "nu": nu,
+        "atoms": atoms,
+        "v": rng.standard_normal((len(atoms), 3)),
+        "bounds": np.searchsorted(steps, np.arange(block + 1)),
+    }
+
+
+def lennard_jones(
+    species: List[Element],
+) -> Dict[Tuple[str, str], LennardJones]:
+    """
+    Lennard-Jones potentials of every pair of species, from the
+    Lorentz-Berthelot mixing rules, to tabulate them, see pair_potentials.
+
+    Args:
+        species (List[Element]): elements of the mixture
+
+    Returns:
+        Dict[Tuple[str, str], LennardJones]: potentials, keyed by the
+            pairs of names
+    """
+    sigma, eps = lorentz_berthelot(species)
+    return {
+        (a.name, b.name): LennardJones(sigma[i, j], eps[i, j])
+        for i, a in enumerate(species)
+        for j, b in enumerate(species)
+    }
+
+
 # TODO: TEST input json to get a State object.
 def state_from_JSON(file):
     statedict = json.load(file)
@@ -360,9 +1399,12 @@ def state_from_JSON(file):
             atoms=atoms,
             T0=statedict["T"],
             rc=statedict["rc"],
-            Tbath=statedict["TBath"],
+            Tbath=statedict["Tbath"],
             nu=statedict["nu"],
+            block=statedict.get("block", 1000),
         )
+        if "rng" in statedict:
+            state.rng_state = statedict["rng"]
     return state
 
 
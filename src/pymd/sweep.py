@@ -0,0 +1,329 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+from nptyping import NDArray
+
+from pymd.atoms import Atoms
+from pymd.backend import get_backend
+from pymd.element import gen_element
+from pymd.state import NVTAndersenState
+
+# Row of the results file: the state point, by index in the grid, and
+# the averages and standard deviations over the production steps
+RESULTDTYPE = np.dtype(
+    [
+        ("index", np.int64),
+        ("rho", np.float64),
+        ("Tbath", np.float64),
+        ("rc", np.float64),
+        ("T", np.float64),
+        ("T_std", np.float64),
+        ("PE", np.float64),
+        ("PE_std", np.float64),
+        ("P", np.float64),
+        ("P_std", np.float64),
+        ("wall", np.float64),
+    ]
+)
+# Format of the columns of a result row, integers and exact floats
+RESULTFMT = ["%d"] + ["%.17g"] * (len(RESULTDTYPE.names) - 1)
+
+
+def state_points(
+    rho: Iterable[float], T: Iterable[float], rc: Iterable[float]
+) -> List[Tuple[float, float, float]]:
+    """
+    Grid of state points, every combination of density, temperature and
+    cutoff radius. The index of a point in the list identifies it in the
+    results file, so the grid must be the same to restart a sweep.
+
+    Args:
+        rho (Iterable[float]): densities
+        T (Iterable[float]): bath temperatures
+        rc (Iterable[float]): cutoff radii
+
+    Returns:
+        List[Tuple[float, float, float]]: (rho, T, rc) of every point
+    """
+    return list(itertools.product(rho, T, rc))
+
+
+def init_worker(threads: int, backend: str):
+    """
+    Initializer of the worker processes: sets the OpenMP threads of every
+    worker, so that the workers share the cores.
+
+    Args:
+        threads (int): OpenMP threads per worker
+        backend (str): kernels backend
+    """
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    backend = get_backend(backend)
+    if backend.has("set_num_threads"):
+        backend.set_num_threads(threads)
+
+
+def run_point(
+    index: int,
+    point: Tuple[float, float, float],
+    config: Dict,
+) -> NDArray[RESULTDTYPE]:
+    """
+    Simulates a state point with an Andersen thermostat, from a cubic
+    grid, and averages the state variables over the production steps.
+    The initial velocities and the thermostat are seeded with independent
+    streams of the seed of the sweep, spawned by the index of the point,
+    so the result doesn't depend on the worker running it.
+
+    Args:
+        index (int): index of the point in the grid
+        point (Tuple[float, float, float]): density, bath temperature and
+            cutoff radius
+        config (Dict): the other arguments of sweep: N, elem, steps, dt,
+            equilibration, nu, method, backend and seed
+
+    Returns:
+        NDArray: result row
+    """
+    start = time.perf_counter()
+    rho, T, rc = point
+    seq = np.random.SeedSequence(config["seed"], spawn_key=(index,))
+    velocities, thermostat = seq.spawn(2)
+    np.random.seed(velocities.generate_state(4))
+    atoms = Atoms(config["N"], rho, gen_element(config["elem"]))
+    state = NVTAndersenState(
+        atoms,
+        T,
+        T,
+        config["nu"],
+        rc,
+        seed=thermostat,
+        method=config["method"],
+        backend=config["backend"],
+    )
+    nsteps = config["equilibration"] + config["steps"]
+    out = state.run(nsteps, config["dt"], nsteps)[config["equilibration"] :]
+    row = np.zeros(1, dtype=RESULTDTYPE)
+    row["index"] = index
+    row["rho"], row["Tbath"], row["rc"] = point
+    for name in ("T", "PE", "P"):
+        row[name] = out[name].mean()
+        row[name + "_std"] = out[name].std()
+    row["wall"] = time.perf_counter() - start
+    return row
+
+
+def results_header(
+    points: List[Tuple[float, float, float]], config: Dict
+) -> str:
+    """
+    First line of a results file: the grid of state points and the
+    settings of the sweep that change the results, as JSON, so that a
+    sweep only restarts from the results of the same sweep.
+
+    Args:
+        points (List[Tuple[float, float, float]]): grid of state points
+        config (Dict): the other arguments of sweep, see run_point
+
+    Returns:
+        str: the header line, as a comment
+    """
+    settings = dict(config)
+    settings.pop("backend", None)
+    return "# " + json.dumps({"points": points, "config": settings})
+
+
+def load_results(filename: str) -> NDArray[RESULTDTYPE]:
+    """
+    Reads a results file, sorted by index of the points. The values are
+    read as floats, so also indices written as floats are read.
+
+    Args:
+        filename (str): results file
+
+    Returns:
+        NDArray: result rows, empty if the file doesn't exist
+    """
+    rows = np.zeros(0, dtype=RESULTDTYPE)
+    if not os.path.exists(filename):
+        return rows
+    with open(filename) as f:
+        lines = f.readlines()[2:]
+    if lines:
+        data = np.loadtxt(lines, ndmin=2)
+        rows = np.zeros(len(data), dtype=RESULTDTYPE)
+        for k, name in enumerate(RESULTDTYPE.names):
+            rows[name] = data[:, k]
+    return np.sort(rows, order="index")
+
+
+def sweep(
+    filename: str,
+    rho: Iterable[float],
+    T: Iterable[float],
+    rc: Iterable[float],
+    N: int = 256,
+    elem: str = "Ar",
+    steps: int = 10000,
+    dt: float = 0.005,
+    equilibration: int = 2000,
+    nu: float = 5.0,
+    method: str = "cell",
+    backend: str = None,
+    workers: int = None,
+    threads: int = 1,
+    seed: int = 0,
+    on_result: Callable[[NDArray], None] = None,
+) -> NDArray[RESULTDTYPE]:
+    """
+    Runs a grid of state points over a pool of worker processes, see
+    run_point, streaming every result to the results file as soon as it
+    is done. Points already in the file are skipped, so an interrupted
+    sweep restarts where it stopped.
+
+    Args:
+        filename (str): results file, a text file with the grid and the
+            settings of the sweep, see results_header, the names of the
+            columns and a row of RESULTDTYPE for point
+        rho (Iterable[float]): densities
+        T (Iterable[float]): bath temperatures
+        rc (Iterable[float]): cutoff radii
+        N (int, optional): number of atoms. Defaults to 256.
+        elem (str, optional): element. Defaults to "Ar".
+        steps (int, optional): production steps. Defaults to 10000.
+        dt (float, optional): timestep. Defaults to 0.005.
+        equilibration (int, optional): steps before the averages.
+            Defaults to 2000.
+        nu (float, optional): thermostat frequency. Defaults to 5.0.
+        method (str, optional): force algorithm. Defaults to "cell".
+        backend (str, optional): kernels backend. Defaults to None, see
+            get_backend.
+        workers (int, optional): worker processes. Defaults to None, the
+            cores divided by threads.
+        threads (int, optional): OpenMP threads per worker. Defaults to 1.
+        seed (int, optional): seed of the sweep. Defaults to 0.
+        on_result (Callable[[NDArray], None], optional): called with
+            every new result row. Defaults to None.
+
+    Raises:
+        ValueError: if a cutoff radius is greater than half box length
+        ValueError: if the results file is of a sweep with another grid
+            or other settings
+
+    Returns:
+        NDArray: results of all the points of the grid done so far
+    """
+    points = state_points(rho, T, rc)
+    for rho_, _, rc_ in points:
+        if rc_ > np.cbrt(N / rho_) / 2:
+            raise ValueError(
+                f"Cutoff radius {rc_} is greater than half box length at "
+                f"density {rho_}"
+            )
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // threads)
+    config = {
+        "N": N,
+        "elem": elem,
+        "steps": steps,
+        "dt": dt,
+        "equilibration": equilibration,
+        "nu": nu,
+        "method": method,
+        "backend": backend,
+        "seed": seed,
+    }
+    header = results_header(points, config)
+    if os.path.exists(filename):
+        with open(filename) as f:
+            first = f.readline()
+        same = first.startswith("# ") and (
+            json.loads(first[2:]) == json.loads(header[2:])
+        )
+        if not same:
+            raise ValueError(
+                f"{filename} holds the results of a sweep with another "
+                "grid or other settings"
+            )
+    else:
+        with open(filename, "w") as f:
+            f.write(header + "\n" + "\t".join(RESULTDTYPE.names) + "\n")
+    done = set(load_results(filename)["index"].tolist())
+    pending = [k for k in range(len(points)) if k not in done]
+    with ProcessPoolExecutor(
+        workers, initializer=init_worker, initargs=(threads, backend)
+    ) as pool:
+        futures = [
+            pool.submit(run_point, k, points[k], config) for k in pending
+        ]
+        for future in as_completed(futures):
+            row = future.result()
+            with open(filename, "a") as f:
+                np.savetxt(f, row, fmt=RESULTFMT, delimiter="\t")
+            if on_result is not None:
+                on_result(row)
+    return load_results(filename)
+
+
+def parse_values(text: str) -> List[float]:
+    """
+    Values of a command line option, as a comma separated list or as
+    start:stop:num, num values evenly spaced from start to stop.
+
+    Args:
+        text (str): option value
+
+    Returns:
+        List[float]: the values
+    """
+    if ":" in text:
+        start, stop, num = text.split(":")
+        return list(np.linspace(float(start), float(stop), int(num)))
+    return [float(value) for value in text.split(",")]
+
+
+def main(argv: List[str] = None):
+    """
+    Command line interface of sweep, as
+    pymd-sweep results.txt --rho 0.6:0.9:4 --T 0.8,1.2 --rc 2.5
+    """
+    parser = argparse.ArgumentParser(
+        description="Run a grid of NVT state points over a process pool"
+    )
+    parser.add_argument("filename", help="results file, resumed if present")
+    parser.add_argument("--rho", type=parse_values, required=True)
+    parser.add_argument("--T", type=parse_values, required=True)
+    parser.add_argument("--rc", type=parse_values, default=[2.5])
+    parser.add_argument("--N", type=int, default=256)
+    parser.add_argument("--elem", default="Ar")
+    parser.add_argument("--steps", type=int, default=10000)
+    parser.add_argument("--dt", type=float, default=0.005)
+    parser.add_argument("--equilibration", type=int, default=2000)
+    parser.add_argument("--nu", type=float, default=5.0)
+    parser.add_argument("--method", default="cell")
+    parser.add_argument("--backend", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = vars(parser.parse_args(argv))
+
+    def report(row: NDArray):
+        print(
+            "point {index}: rho={rho:.4g} T={Tbath:.4g} rc={rc:.4g} "
+            "P={P:.4g} PE={PE:.4g} ({wall:.1f} s)".format(
+                **{name: row[name][0] for name in RESULTDTYPE.names}
+            ),
+            flush=True,
+        )
+
+    sweep(args.pop("filename"), on_result=report, **args)
+
+
+if __name__ == "__main__":
+    main()
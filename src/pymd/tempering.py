@@ -0,0 +1,432 @@
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+from nptyping import NDArray
+
+from pymd.atoms import Atoms
+from pymd.element import gen_element
+from pymd.state import NVEState, NVTAndersenState
+from pymd.sweep import init_worker
+
+# Shared arrays and replicas of a worker process, see attach
+_shared = {}
+_replicas = {}
+
+
+def shared_array(
+    shape: Tuple[int, ...], dtype: type
+) -> Tuple[shared_memory.SharedMemory, NDArray]:
+    """
+    Allocates an array in a new block of shared memory.
+
+    Args:
+        shape (Tuple[int, ...]): shape of the array
+        dtype (type): type of the array
+
+    Returns:
+        Tuple[SharedMemory, NDArray]: the block and the array on it
+    """
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def attach(specs: Dict[str, tuple], config: Dict):
+    """
+    Initializer of the worker processes: attaches to the shared arrays of
+    the configurations and sets the OpenMP threads, see
+    pymd.sweep.init_worker.
+
+    Args:
+        specs (Dict[str, tuple]): name of the block, shape and type of
+            every shared array
+        config (Dict): arguments of the replicas, see ParallelTempering
+    """
+    init_worker(config["threads"], config["backend"])
+    for key, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[key] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    _shared["config"] = config
+
+
+def replica(slot: int) -> NVTAndersenState:
+    """
+    State of a configuration in a worker process, built on the shared
+    arrays the first time the worker runs it. The forces are copied from
+    the shared array, as the configuration may have moved in another
+    worker since.
+
+    Args:
+        slot (int): index of the configuration
+
+    Returns:
+        NVTAndersenState: the state
+    """
+    r, v, f, i = (_shared[key][1][slot] for key in ("r", "v", "f", "i"))
+    state = _replicas.get(slot)
+    if state is None:
+        config = _shared["config"]
+        atoms = Atoms(
+            config["N"],
+            config["rho"],
+            gen_element(config["elem"]),
+            r=r,
+            v=v,
+            removedrift=False,
+        )
+        atoms.i = i
+        # T0=0 keeps the velocities of the shared array
+        state = NVTAndersenState(
+            atoms,
+            0,
+            0,
+            config["nu"],
+            config["rc"],
+            config["use_e_corr"],
+            method=config["method"],
+            backend=config["backend"],
+        )
+        _replicas[slot] = state
+    else:
+        state.f[...] = f
+    return state
+
+
+def run_segment(
+    slot: int,
+    Tbath: float,
+    scale: float,
+    nsteps: int,
+    dt: float,
+    seed: int,
+    key: Tuple[int, int],
+) -> Tuple[int, NDArray]:
+    """
+    Runs a configuration at a bath temperature between two exchanges, in
+    a worker process. The thermostat is seeded with the stream of the
+    configuration and segment, so the run doesn't depend on
+    the worker running it.
+
+    Args:
+        slot (int): index of the configuration
+        Tbath (float): bath temperature
+        scale (float): factor of the velocities, sqrt(Tnew/Told) after an
+            exchange
+        nsteps (int): number of timesteps
+        dt (float): timestep
+        seed (int): seed of the streams
+        key (Tuple[int, int]): configuration and segment of the stream
+
+    Returns:
+        Tuple[int, NDArray]: index of the configuration and its state
+            variables at the last step
+    """
+    state = replica(slot)
+    state.reseed(np.random.SeedSequence(seed, spawn_key=key))
+    state.Tbath = Tbath
+    if scale != 1.0:
+        state.atoms.v *= scale
+    out = state.run(nsteps, dt, nsteps)
+    _shared["f"][1][slot] = state.f
+    return slot, out[-1:]
+
+
+class ParallelTempering:
+    """
+    Parallel tempering (replica exchange) of M configurations of N atoms
+    of an element, each one an NVTAndersenState at a temperature of a
+    ladder, run in parallel in a pool of worker processes. Positions,
+    velocities, forces and box crossings of the configurations live in
+    shared memory, so the workers advance them in place, and an exchange
+    swaps the temperatures of two configurations, rescaling their
+    velocities, instead of copying arrays. Exchanges between neighbours
+    in the ladder are attempted alternately on even and odd pairs, with
+    the Metropolis criterion on their potential energies.
+
+    Attributes:
+        M (int): number of temperatures and configurations
+        N (int): number of atoms of every configuration
+        rho (float): density of every configuration
+        elem (Element): element of the atoms
+        temperatures (NDArray): temperature ladder, ascending
+        slot (NDArray): configuration at every temperature
+        index (NDArray): temperature of every configuration, as index in
+            the ladder
+        time (float): time of simulation
+        exchanges (int): exchange rounds done
+        attempts (NDArray): exchanges attempted between every pair of
+            neighbour temperatures
+        accepted (NDArray): exchanges accepted between every pair
+        round_trips (List[float]): times of the round trips of the
+            configurations from the lowest temperature to the highest and
+            back
+        seed (int): seed of the random streams
+        rng (np.random.Generator): random generator of the exchanges
+        shared (Dict[str, Tuple[SharedMemory, NDArray]]): shared arrays
+            "r", "v", "f", "i", as (M,N,3)
+        pool (ProcessPoolExecutor): worker processes
+    """
+
+    OUTDTYPE = NVEState.OUTDTYPE
+
+    def __init__(
+        self,
+        N: int,
+        rho: float,
+        temperatures: List[float],
+        rc: float,
+        nu: float = 5.0,
+        elem: str = "Ar",
+        use_e_corr: bool = False,
+        method: str = "cell",
+        backend: str = None,
+        workers: int = None,
+        threads: int = 1,
+        seed: int = 0,
+    ):
+        """
+        Initialize ParallelTempering object, with the configurations on a
+        cubic grid and random velocities at the temperatures of the
+        ladder, and start the worker processes.
+
+        Args:
+            N (int): number of atoms
+            rho (float): density
+            temperatures (List[float]): temperature ladder
+            rc (float): cutoff radius
+            nu (float, optional): thermostat frequency. Defaults to 5.0.
+            elem (str, optional): element. Defaults to "Ar".
+            use_e_corr (bool, optional): Use energy corrections.
+                Defaults to False.
+            method (str, optional): force algorithm. Defaults to "cell".
+            backend (str, optional): kernels backend. Defaults to None, see
+                get_backend.
+            workers (int, optional): worker processes. Defaults to None,
+                see ProcessPoolExecutor.
+            threads (int, optional): OpenMP threads per worker. Defaults to 1.
+            seed (int, optional): seed of the random streams. Defaults to 0.
+
+        Raises:
+            ValueError: if there are less than two temperatures
+            ValueError: if cutoff radius is greater than half box length
+        """
+        self.temperatures = np.sort(np.asarray(temperatures, dtype=float))
+        self.M = len(self.temperatures)
+        if self.M < 2:
+            raise ValueError("Parallel tempering needs two temperatures")
+        if rc > np.cbrt(N / rho) / 2:
+            raise ValueError(
+                "Cutoff radius can't be greater than half box length"
+            )
+        self.N = N
+        self.rho = rho
+        self.elem = gen_element(elem)
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.shared = {}
+        for key, dtype in (
+            ("r", np.float64),
+            ("v", np.float64),
+            ("f", np.float64),
+            ("i", np.int16),
+        ):
+            self.shared[key] = shared_array((self.M, N, 3), dtype)
+        r, v, i = (self.shared[key][1] for key in ("r", "v", "i"))
+        # Velocities from the global generator, seeded for them, and then
+        # given back to the caller in its state
+        state = np.random.get_state()
+        np.random.seed(np.random.SeedSequence(seed).generate_state(4))
+        try:
+            for m, T in enumerate(self.temperatures):
+                atoms = Atoms(N, rho, self.elem)
+                r[m] = atoms.r
+                v2 = np.sum(atoms.v * atoms.v)
+                v[m] = atoms.v * np.sqrt(T / (v2 / 3.0 / N))
+                i[m] = 0
+        finally:
+            np.random.set_state(state)
+        self.slot = np.arange(self.M)
+        self.index = np.arange(self.M)
+        self.scale = np.ones(self.M)
+        self.time = 0.0
+        self.exchanges = 0
+        self.attempts = np.zeros(self.M - 1, dtype=int)
+        self.accepted = np.zeros(self.M - 1, dtype=int)
+        self.round_trips = []
+        self.direction = np.zeros(self.M, dtype=int)
+        self.trip_start = np.zeros(self.M)
+        self.track_round_trips()
+        config = {
+            "N": N,
+            "rho": rho,
+            "elem": self.elem.name,
+            "rc": rc,
+            "nu": nu,
+            "use_e_corr": use_e_corr,
+            "method": method,
+            "backend": backend,
+            "threads": threads,
+        }
+        specs = {
+            key: (shm.name, array.shape, array.dtype.str)
+            for key, (shm, array) in self.shared.items()
+        }
+        self.pool = ProcessPoolExecutor(
+            workers, initializer=attach, initargs=(specs, config)
+        )
+
+    def run(self, nexchanges: int, nsteps: int, dt: float) -> NDArray:
+        """
+        Runs all the configurations for nsteps timesteps, then attempts
+        the exchanges, nexchanges times.
+
+        Args:
+            nexchanges (int): number of exchange rounds
+            nsteps (int): timesteps between two exchanges
+            dt (float): timestep
+
+        Returns:
+            NDArray: output array with the state variables at every
+                temperature before every exchange, as (M,nexchanges)
+                [time, KE, PE, TE, drift, T, P]
+        """
+        out = np.empty((self.M, nexchanges), dtype=self.OUTDTYPE)
+        for n in range(nexchanges):
+            futures = [
+                self.pool.submit(
+                    run_segment,
+                    slot,
+                    self.temperatures[self.index[slot]],
+                    self.scale[slot],
+                    nsteps,
+                    dt,
+                    self.seed,
+                    (slot, self.exchanges),
+                )
+                for slot in range(self.M)
+            ]
+            for future in futures:
+                slot, row = future.result()
+                out[self.index[slot], n] = row[0]
+            self.time += nsteps * dt
+            out["time"][:, n] = self.time
+            self.exchange(out["PE"][:, n])
+        return out
+
+    def exchange(self, PE: NDArray):
+        """
+        Attempts the exchanges of the configurations at neighbour
+        temperatures k and k+1, for even k on even rounds and odd k on odd
+        rounds, accepted with probability
+        min(1, exp((1/T[k] - 1/T[k+1]) * (PE[k] - PE[k+1]))).
+
+        Args:
+            PE (NDArray): potential energy at every temperature
+        """
+        self.scale[:] = 1.0
+        beta = 1.0 / self.temperatures
+        for k in range(self.exchanges % 2, self.M - 1, 2):
+            self.attempts[k] += 1
+            delta = (beta[k] - beta[k + 1]) * (PE[k] - PE[k + 1])
+            if delta >= 0 or self.rng.uniform() < np.exp(delta):
+                self.accepted[k] += 1
+                a, b = self.slot[k], self.slot[k + 1]
+                self.slot[k], self.slot[k + 1] = b, a
+                self.index[a], self.index[b] = k + 1, k
+                ratio = np.sqrt(beta[k] / beta[k + 1])
+                self.scale[a] = ratio
+                self.scale[b] = 1 / ratio
+        self.exchanges += 1
+        self.track_round_trips()
+
+    def track_round_trips(self):
+        """
+        Records the round trips: a configuration starts one when it reaches
+        the lowest temperature after the highest, or for the first time,
+        and completes it when it gets back there after the highest.
+        """
+        for slot, k in enumerate(self.index):
+            if k == 0 and self.direction[slot] != 1:
+                if self.direction[slot] == -1:
+                    self.round_trips.append(self.time - self.trip_start[slot])
+                self.direction[slot] = 1
+                self.trip_start[slot] = self.time
+            elif k == self.M - 1 and self.direction[slot] == 1:
+                self.direction[slot] = -1
+
+    @property
+    def acceptance(self) -> NDArray:
+        """
+        Acceptance rate of the exchanges between every pair of neighbour
+        temperatures.
+        """
+        return self.accepted / np.maximum(self.attempts, 1)
+
+    @property
+    def mean_round_trip(self) -> float:
+        """
+        Mean time of the round trips, NaN if there are none yet.
+        """
+        return np.mean(self.round_trips) if self.round_trips else np.nan
+
+    def configuration(self, k: int) -> Atoms:
+        """
+        Copy of the configuration at a temperature of the ladder.
+
+        Args:
+            k (int): index of the temperature
+
+        Returns:
+            Atoms: the configuration
+        """
+        slot = self.slot[k]
+        r, v, i = (self.shared[key][1][slot] for key in ("r", "v", "i"))
+        atoms = Atoms(
+            self.N,
+            self.rho,
+            self.elem,
+            r=r.copy(),
+            v=v.copy(),
+            removedrift=False,
+        )
+        atoms.i = i.copy()
+        return atoms
+
+    def report(self) -> str:
+        """
+        Acceptance rates of the exchanges and round trip times.
+
+        Returns:
+            str: a table of the acceptance rates and the round trips
+        """
+        lines = ["T_k\tT_k+1\taccept"]
+        for k, rate in enumerate(self.acceptance):
+            lines.append(
+                f"{self.temperatures[k]:.4g}\t"
+                f"{self.temperatures[k + 1]:.4g}\t{rate:.3f}"
+            )
+        lines.append(
+            f"round trips: {len(self.round_trips)}, "
+            f"mean time {self.mean_round_trip:.4g}"
+        )
+        return "\n".join(lines)
+
+    def close(self):
+        """
+        Shuts down the worker processes and frees the shared memory.
+        """
+        self.pool.shutdown()
+        blocks = [shm for shm, _ in self.shared.values()]
+        # The arrays must go before their blocks are closed
+        self.shared = {}
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self) -> "ParallelTempering":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
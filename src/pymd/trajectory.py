@@ -0,0 +1,1017 @@
+import hashlib
+import lzma
+import os
+import queue
+import threading
+import zlib
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+from nptyping import NDArray
+
+from pymd.atoms import Atoms, species_types
+from pymd.element import gen_element
+from pymd.util import (
+    trj_frame_dtype,
+    trj_header,
+    trj_header_bytes,
+    xyz_frames,
+    xyz_index,
+    xyz_parse,
+)
+
+# First bytes of a chunked trajectory, and last bytes of its index
+CTRJ_MAGIC = b"PYMDCTR1"
+INDEX_MAGIC = b"PYMDIDX1"
+# Prefix of a chunk: its first bytes, compressed size, frames and CRC-32
+CHUNK_MAGIC = b"PYMDCHK1"
+CHUNK_PREFIX = np.dtype(
+    [("magic", "S8"), ("size", "<u8"), ("frames", "<u4"), ("crc", "<u4")]
+)
+# Compressors of the chunks, with their default level
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompress, 6),
+    "lzma": (
+        lambda data, level: lzma.compress(data, preset=level),
+        lzma.decompress,
+        6,
+    ),
+}
+
+
+class Trajectory:
+    """
+    Binary trajectory, see pymd.util.trj_out, mapped in memory: the frames
+    are a np.memmap, so positions, velocities and box crossings of all the
+    frames are (frames,N,3) views of the file, read only when used.
+    Indexing gives the frames as Atoms objects.
+
+    Attributes:
+        filename (str): filename of the trajectory
+        header (Dict): header of the file
+        N (int): number of atoms
+        rho (float): density of atoms
+        L (float): box length
+        species (List[Element]): Element objects of the species
+        types (NDArray): species of every atom, as index in species
+        precision (str): precision of positions and velocities
+        fields (List[str]): fields of the frames, among "r", "v", "i"
+        frames (NDArray): memory map of the frames, as a structured array
+            of the fields
+    """
+
+    def __init__(self, filename: str):
+        """
+        Initialize Trajectory object, mapping the complete frames of the
+        file; a frame still being written is left out.
+
+        Args:
+            filename (str): filename of the .trj file
+
+        Raises:
+            ValueError: if the file is not a binary trajectory
+        """
+        self.filename = filename
+        with open(filename, "rb") as f:
+            header, offset = trj_header(f)
+        self.set_header(header)
+        dtype = trj_frame_dtype(self.N, self.header["dtype"], self.fields)
+        nframes = (os.path.getsize(filename) - offset) // dtype.itemsize
+        if nframes:
+            self.frames = np.memmap(
+                filename, dtype=dtype, mode="r", offset=offset, shape=nframes
+            )
+        else:
+            self.frames = np.zeros(0, dtype=dtype)
+
+    def set_header(self, header: Dict):
+        """
+        Sets the attributes of the trajectory from the header of the file.
+
+        Args:
+            header (Dict): header, see pymd.util.trj_out
+        """
+        self.header = header
+        self.N = header["N"]
+        self.rho = header["rho"]
+        self.L = header["L"]
+        self.species = [gen_element(name) for name in header["elem"]]
+        self.types = header["types"]
+        if self.types is not None:
+            self.types = np.array(self.types, dtype=np.intc)
+        self.precision = "single" if header["dtype"] == "<f4" else "double"
+        self.fields = header["fields"]
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Atoms, List[Atoms]]:
+        """
+        Frames as Atoms objects, reading only them from the file.
+
+        Args:
+            key (Union[int, slice]): index or slice of the frames
+
+        Returns:
+            Union[Atoms, List[Atoms]]: the frame, or a list of the frames
+        """
+        if isinstance(key, slice):
+            return [self.atoms(k) for k in range(*key.indices(len(self)))]
+        return self.atoms(key)
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.atoms(k)
+
+    @property
+    def r(self) -> NDArray:
+        """
+        Positions of all the frames, as a (frames,N,3) view of the file.
+        """
+        return self.frames["r"]
+
+    @property
+    def v(self) -> NDArray:
+        """
+        Velocities of all the frames, as a (frames,N,3) view of the file.
+        """
+        return self.frames["v"]
+
+    @property
+    def i(self) -> NDArray:
+        """
+        Box crossings of all the frames, as a (frames,N,3) view of the file.
+        """
+        return self.frames["i"]
+
+    def unfolded(self, k: int) -> NDArray:
+        """
+        Unfolded positions of a frame, r+i*L.
+
+        Args:
+            k (int): index of the frame
+
+        Returns:
+            NDArray: positions, as (N,3)
+        """
+        frame = self.frame(k)
+        return frame["r"] + frame["i"] * self.L
+
+    def frame(self, k: int) -> NDArray:
+        """
+        Arrays of a frame.
+
+        Args:
+            k (int): index of the frame
+
+        Returns:
+            NDArray: record of the fields of the frame, as (N,3) arrays
+        """
+        return self.frames[k]
+
+    def atoms(self, k: int, **kwargs) -> Atoms:
+        """
+        Frame as an Atoms object, with copies of its arrays. Without
+        velocities in the file, they are random and without drift, as
+        with .xyz files.
+
+        Args:
+            k (int): index of the frame
+            **kwargs: additional arguments of Atoms
+
+        Returns:
+            Atoms: Atoms object
+        """
+        frame = self.frame(k)
+        atoms = Atoms(
+            self.N,
+            self.rho,
+            self.species,
+            np.array(frame["r"], dtype=np.float64),
+            np.array(frame["v"], dtype=np.float64)
+            if "v" in self.fields
+            else None,
+            types=self.types,
+            **{
+                "precision": self.precision,
+                "removedrift": "v" not in self.fields,
+                **kwargs,
+            },
+        )
+        atoms.i = np.array(frame["i"])
+        return atoms
+
+    def atomslist(self, **kwargs) -> List[Atoms]:
+        """
+        All the frames as Atoms objects, see atoms.
+
+        Args:
+            **kwargs: additional arguments of Atoms
+
+        Returns:
+            List[Atoms]: List of Atoms objects
+        """
+        return [self.atoms(k, **kwargs) for k in range(len(self))]
+
+
+class XYZTrajectory(Trajectory):
+    """
+    Frames of an .xyz file read lazily, see Trajectory. The byte offsets
+    of the frames are found in a single pass, see pymd.util.xyz_index,
+    and cached in a sidecar file, filename + ".idx", valid while the file
+    is unchanged; when the file has grown, it is assumed appended to,
+    and only the new frames are indexed. A frame is read and parsed only
+    when requested, see pymd.util.xyz_parse, and the species of the first
+    frame are reused by the frames with the same elements.
+
+    Attributes:
+        offsets (NDArray): byte offset of every frame and of the end of
+            the last one
+        counts (NDArray): number of atoms of every frame
+        elems (NDArray): elements of the atoms of the first frame
+    """
+
+    def __init__(self, filename: str, rho: float, cache: bool = True):
+        """
+        Initialize XYZTrajectory object, indexing the frames.
+
+        Args:
+            filename (str): filename of the .xyz file
+            rho (float): density of atoms
+            cache (bool, optional): if True, reads and writes the index in
+                the sidecar file. Defaults to True.
+        """
+        self.filename = filename
+        self.rho = rho
+        self.offsets, self.counts = self.index(cache)
+        self.N = int(self.counts[0]) if len(self.counts) else 0
+        self.L = np.cbrt(self.N / self.rho)
+        self.precision = "double"
+        self.fields = ["r", "v"]
+        self.elems = None
+        if len(self):
+            _, self.elems, _, _ = xyz_parse(self.read(0))
+            self.species, self.types = species_types(self.elems)
+
+    def index(self, cache: bool) -> tuple:
+        """
+        Index of the frames, from the sidecar file if it is valid. When
+        the file has grown, the index is extended only if the first and
+        the last frames indexed are unchanged, see digest, otherwise the
+        file was overwritten and it is indexed again.
+
+        Args:
+            cache (bool): if True, reads and writes the sidecar file
+
+        Returns:
+            tuple: byte offsets and number of atoms of the frames
+        """
+        sidecar = self.filename + ".idx"
+        stat = os.stat(self.filename)
+        offsets, counts = None, None
+        if cache and os.path.exists(sidecar):
+            try:
+                with np.load(sidecar) as index:
+                    size, mtime = index["size"], index["mtime"]
+                    offsets, counts = index["offsets"], index["counts"]
+                    digest = str(index["digest"])
+                if size == stat.st_size and mtime == stat.st_mtime_ns:
+                    return offsets, counts
+                if size < stat.st_size and self.digest(offsets) == digest:
+                    new, added = xyz_index(self.filename, int(offsets[-1]))
+                    offsets = np.concatenate([offsets[:-1], new])
+                    counts = np.concatenate([counts, added])
+                else:
+                    offsets = None
+            except (OSError, KeyError, ValueError):
+                offsets = None
+        if offsets is None:
+            offsets, counts = xyz_index(self.filename)
+        if cache:
+            try:
+                with open(sidecar, "wb") as f:
+                    np.savez(
+                        f,
+                        offsets=offsets,
+                        counts=counts,
+                        size=stat.st_size,
+                        mtime=stat.st_mtime_ns,
+                        digest=self.digest(offsets),
+                    )
+            except OSError:
+                pass
+        return offsets, counts
+
+    def digest(self, offsets: NDArray) -> str:
+        """
+        Hash of the bytes of the first and the last frames of an index,
+        which are the same if the file was only appended to.
+
+        Args:
+            offsets (NDArray): byte offsets of the frames, see index
+
+        Returns:
+            str: the hash, as hexadecimal digits
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        with open(self.filename, "rb") as f:
+            for k in sorted({0, len(offsets) - 2}):
+                if k >= 0:
+                    f.seek(offsets[k])
+                    digest.update(f.read(offsets[k + 1] - offsets[k]))
+        return digest.hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def read(self, k: int) -> bytes:
+        """
+        Bytes of a frame.
+
+        Args:
+            k (int): index of the frame
+
+        Returns:
+            bytes: the frame
+        """
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("Frame index out of range")
+        with open(self.filename, "rb") as f:
+            f.seek(self.offsets[k])
+            return f.read(self.offsets[k + 1] - self.offsets[k])
+
+    def frame(self, k: int) -> Dict[str, NDArray]:
+        """
+        Arrays of a frame, parsing it.
+
+        Args:
+            k (int): index of the frame
+
+        Returns:
+            Dict[str, NDArray]: elements, positions and velocities
+        """
+        _, elems, r, v = xyz_parse(self.read(k))
+        return {"elems": elems, "r": r, "v": v}
+
+    def parse_all(self) -> Tuple[NDArray, NDArray]:
+        """
+        Positions and velocities of all the frames, parsing all the file
+        into arrays of all the frames, see pymd.util.xyz_frames.
+
+        Raises:
+            ValueError: if the frames have different numbers of atoms
+
+        Returns:
+            Tuple[NDArray, NDArray]: r, v arrays, as (frames,N,3)
+        """
+        if np.any(self.counts != self.N):
+            raise ValueError("Frames have different numbers of atoms")
+        start = int(self.offsets[0])
+        with open(self.filename, "rb") as f:
+            f.seek(start)
+            data = f.read(int(self.offsets[-1]) - start)
+        return xyz_frames(data, self.offsets[:-1] - start, self.N)
+
+    @property
+    def r(self) -> NDArray:
+        """
+        Positions of all the frames, as (frames,N,3), parsing all the file.
+        """
+        return self.parse_all()[0]
+
+    @property
+    def v(self) -> NDArray:
+        """
+        Velocities of all the frames, as (frames,N,3), parsing all the
+        file.
+        """
+        return self.parse_all()[1]
+
+    def atoms(self, k: int, **kwargs) -> Atoms:
+        """
+        Frame as an Atoms object, as fromfile.
+
+        Args:
+            k (int): index of the frame
+            **kwargs: additional arguments of Atoms
+
+        Returns:
+            Atoms: Atoms object
+        """
+        frame = self.frame(k)
+        elems = frame["elems"]
+        if np.array_equal(elems, self.elems):
+            species, types = self.species, self.types
+        else:
+            species, types = species_types(elems)
+        return Atoms(
+            len(elems),
+            self.rho,
+            species,
+            frame["r"],
+            frame["v"],
+            types=types,
+            **kwargs,
+        )
+
+
+class ChunkedWriter:
+    """
+    Writer of a chunked, compressed trajectory. Frames are buffered and
+    written in chunks of a given number of frames, every chunk compressed
+    on its own, with zlib or lzma, and its fields stored one after the
+    other, so that similar data are compressed together. Optionally,
+    positions are quantized to integer multiples of quantum and stored
+    as differences with the previous frame of the chunk, like XTC files.
+    The file has the header of pymd.util.trj_out with the chunk size,
+    codec and quantum, then the chunks, every one after a prefix with
+    CHUNK_MAGIC, its compressed size, its frames and the CRC-32 of its
+    data, then an index with the byte offset and frames of every chunk,
+    the number of chunks, the offset of the index as uint64 and
+    INDEX_MAGIC. A frame is read decompressing only its chunk. The index
+    is cut before a chunk is written, and written again after it, so if
+    the writer is killed in between, the index is rebuilt scanning the
+    prefixes of the chunks, and the chunks written before are kept.
+
+    Attributes:
+        filename (str): filename of the trajectory
+        header (Dict): header of the file
+        chunk (int): frames per chunk
+        codec (str): compressor of the chunks, "zlib" or "lzma"
+        level (int): compression level
+        quantum (float): quantum of the positions, None to store them
+            exactly
+        index (List[Tuple[int, int]]): byte offset and frames of every
+            chunk written
+        buffer (Dict[str, NDArray]): frames of the current chunk, as
+            (chunk,N,3) arrays of every field
+        count (int): frames in the buffer
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        atoms: Atoms,
+        chunk: int = 100,
+        codec: str = "zlib",
+        level: int = None,
+        quantum: float = None,
+        put_vel: bool = True,
+        append: bool = False,
+    ):
+        """
+        Initialize ChunkedWriter object, writing the header of the atoms,
+        or opening an existing trajectory to append chunks.
+
+        Args:
+            filename (str): filename of the .ctrj file
+            atoms (Atoms): Atoms object, giving size, species and precision
+            chunk (int, optional): frames per chunk. Defaults to 100.
+            codec (str, optional): "zlib" or "lzma". Defaults to "zlib".
+            level (int, optional): compression level. Defaults to None, 6.
+            quantum (float, optional): quantum of the positions, as 1e-3
+                for a precision of sigma/1000. Defaults to None, exact.
+            put_vel (bool, optional): if True, puts velocities into the
+                file. Defaults to True.
+            append (bool, optional): if True, appends to an existing file.
+                Defaults to False.
+
+        Raises:
+            ValueError: if codec is not a known compressor
+            ValueError: if appending to a trajectory with a different
+                header
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec}")
+        self.filename = filename
+        idx = np.argsort(atoms.order)
+        self.header = {
+            "N": atoms.N,
+            "rho": atoms.rho,
+            "L": float(atoms.L),
+            "elem": [elem.name for elem in atoms.species],
+            "types": atoms.types[idx].tolist() if atoms.ntypes > 1 else None,
+            "dtype": np.dtype(atoms.dtype).newbyteorder("<").str,
+            "fields": ["r", "v", "i"] if put_vel else ["r", "i"],
+            "chunk": chunk,
+            "codec": codec,
+            "quantum": quantum,
+        }
+        self.index = []
+        if append and os.path.exists(filename):
+            reader = ChunkedTrajectory(filename)
+            if any(
+                reader.header[key] != self.header[key]
+                for key in (
+                    "N",
+                    "rho",
+                    "elem",
+                    "types",
+                    "dtype",
+                    "fields",
+                    "codec",
+                    "quantum",
+                )
+            ):
+                raise ValueError(
+                    f"Frames don't match the header of {filename}"
+                )
+            self.header = reader.header
+            self.index = reader.index[:, :2].tolist()
+            self.file = open(filename, "r+b")
+            self.offset = reader.end
+        else:
+            self.file = open(filename, "wb")
+            self.file.write(trj_header_bytes(self.header, CTRJ_MAGIC))
+            self.offset = self.file.tell()
+        self.write_index()
+        self.chunk = self.header["chunk"]
+        self.codec = codec
+        self.level = CODECS[codec][2] if level is None else level
+        self.quantum = quantum
+        self.buffer = {
+            name: np.empty(
+                (self.chunk, atoms.N, 3),
+                dtype=np.int16 if name == "i" else atoms.dtype,
+            )
+            for name in self.header["fields"]
+        }
+        self.count = 0
+
+    def write(self, atoms: Atoms):
+        """
+        Adds a frame, in the original order of the atoms, writing the chunk
+        when it is full.
+
+        Args:
+            atoms (Atoms): Atoms object
+        """
+        idx = np.argsort(atoms.order)
+        for name, frames in self.buffer.items():
+            frames[self.count] = getattr(atoms, name)[idx]
+        self.count += 1
+        if self.count == self.chunk:
+            self.flush()
+
+    def encode(self) -> bytes:
+        """
+        Compressed chunk of the frames in the buffer.
+
+        Returns:
+            bytes: the chunk
+        """
+        parts = []
+        for name, frames in self.buffer.items():
+            data = frames[: self.count]
+            if name == "r" and self.quantum is not None:
+                data = np.rint(data / self.quantum).astype("<i4")
+                data[1:] -= data[:-1].copy()
+            parts.append(np.ascontiguousarray(data).tobytes())
+        return CODECS[self.codec][0](b"".join(parts), self.level)
+
+    def flush(self):
+        """
+        Writes the frames in the buffer as a chunk, over the index, and the
+        index after it.
+        """
+        if not self.count:
+            return
+        data = self.encode()
+        prefix = np.array(
+            (CHUNK_MAGIC, len(data), self.count, zlib.crc32(data)),
+            dtype=CHUNK_PREFIX,
+        )
+        self.file.seek(self.offset)
+        self.file.truncate()
+        self.file.write(prefix.tobytes())
+        self.file.write(data)
+        self.index.append((self.offset, self.count))
+        self.offset += CHUNK_PREFIX.itemsize + len(data)
+        self.count = 0
+        self.write_index()
+
+    def write_index(self):
+        """
+        Writes the index of the chunks at the end of the file.
+        """
+        self.file.seek(self.offset)
+        index = np.array(self.index, dtype="<u8").reshape(-1, 2)
+        self.file.write(index.tobytes())
+        self.file.write(
+            np.array([len(index), self.offset], dtype="<u8").tobytes()
+        )
+        self.file.write(INDEX_MAGIC)
+        self.file.truncate()
+        self.file.flush()
+
+    def close(self):
+        """
+        Writes the last chunk and closes the file.
+        """
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self) -> "ChunkedWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChunkedTrajectory(Trajectory):
+    """
+    Chunked, compressed trajectory, see ChunkedWriter. A frame is read
+    decompressing only its chunk, and the last chunk read is kept, so
+    consecutive frames are read once. If the index is missing, as the
+    writer was killed while writing a chunk, it is rebuilt from the
+    chunks that are complete.
+
+    Attributes:
+        index (NDArray): byte offset, frames and first frame of every
+            chunk
+        end (int): byte offset of the end of the chunks
+        cache (Tuple[int, Dict[str, NDArray]]): last chunk read, and its
+            frames
+    """
+
+    def __init__(self, filename: str):
+        """
+        Initialize ChunkedTrajectory object, reading header and index, or
+        scanning the chunks if the index is missing.
+
+        Args:
+            filename (str): filename of the .ctrj file
+
+        Raises:
+            ValueError: if the file is not a chunked trajectory
+        """
+        self.filename = filename
+        with open(filename, "rb") as f:
+            header, offset = trj_header(f, CTRJ_MAGIC)
+            footer = 16 + len(INDEX_MAGIC)
+            if f.seek(0, os.SEEK_END) >= offset + footer:
+                f.seek(-footer, os.SEEK_END)
+                nchunks, self.end = np.frombuffer(f.read(16), dtype="<u8")
+                complete = f.read() == INDEX_MAGIC
+            else:
+                complete = False
+            if complete:
+                f.seek(int(self.end))
+                index = np.frombuffer(f.read(16 * int(nchunks)), dtype="<u8")
+            else:
+                index, self.end = self.scan_chunks(f, offset)
+        self.end = int(self.end)
+        self.set_header(header)
+        index = np.array(index, dtype=np.int64).reshape(-1, 2)
+        first = np.concatenate([[0], np.cumsum(index[:, 1])])
+        self.index = np.column_stack([index, first[:-1]])
+        self.nframes = int(first[-1])
+        self.cache = (None, None)
+
+    def __len__(self) -> int:
+        return self.nframes
+
+    @staticmethod
+    def scan_chunks(file, offset: int) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        Index of the chunks of a file, read from their prefixes, up to the
+        first chunk that is truncated or doesn't match its CRC-32.
+
+        Args:
+            file (BinaryIO): file stream
+            offset (int): byte offset of the first chunk
+
+        Returns:
+            Tuple[List[Tuple[int, int]], int]: byte offset and frames of
+                every chunk, and byte offset of the end of the last one
+        """
+        index = []
+        while True:
+            file.seek(offset)
+            data = file.read(CHUNK_PREFIX.itemsize)
+            if len(data) < CHUNK_PREFIX.itemsize:
+                break
+            prefix = np.frombuffer(data, dtype=CHUNK_PREFIX)[0]
+            if prefix["magic"] != CHUNK_MAGIC:
+                break
+            data = file.read(int(prefix["size"]))
+            if len(data) < prefix["size"] or zlib.crc32(data) != prefix["crc"]:
+                break
+            index.append((offset, int(prefix["frames"])))
+            offset += CHUNK_PREFIX.itemsize + len(data)
+        return index, offset
+
+    def read_chunk(self, c: int) -> Dict[str, NDArray]:
+        """
+        Reads and decompresses a chunk.
+
+        Args:
+            c (int): index of the chunk
+
+        Returns:
+            Dict[str, NDArray]: frames of the chunk, as (frames,N,3) arrays
+                of every field
+        """
+        if self.cache[0] == c:
+            return self.cache[1]
+        offset, count, _ = self.index[c]
+        with open(self.filename, "rb") as f:
+            f.seek(offset)
+            prefix = np.frombuffer(f.read(CHUNK_PREFIX.itemsize), CHUNK_PREFIX)
+            data = f.read(int(prefix["size"][0]))
+        data = CODECS[self.header["codec"]][1](data)
+        quantum = self.header["quantum"]
+        frames = {}
+        start = 0
+        for name in self.fields:
+            dtype = np.dtype("<i2" if name == "i" else self.header["dtype"])
+            if name == "r" and quantum is not None:
+                dtype = np.dtype("<i4")
+            size = count * self.N * 3 * dtype.itemsize
+            array = np.frombuffer(data[start : start + size], dtype=dtype)
+            array = array.reshape(count, self.N, 3)
+            start += size
+            if name == "r" and quantum is not None:
+                array = np.cumsum(array, axis=0) * quantum
+                array = array.astype(self.header["dtype"])
+            frames[name] = array
+        self.cache = (c, frames)
+        return frames
+
+    def frame(self, k: int) -> Dict[str, NDArray]:
+        """
+        Arrays of a frame, decompressing its chunk.
+
+        Args:
+            k (int): index of the frame
+
+        Returns:
+            Dict[str, NDArray]: (N,3) arrays of the fields of the frame
+        """
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("Frame index out of range")
+        c = np.searchsorted(self.index[:, 2], k, side="right") - 1
+        frames = self.read_chunk(c)
+        return {
+            name: array[k - self.index[c, 2]] for name, array in frames.items()
+        }
+
+    def field(self, name: str) -> NDArray:
+        """
+        A field of all the frames, decompressing all the chunks.
+
+        Args:
+            name (str): "r", "v" or "i"
+
+        Returns:
+            NDArray: the field, as (frames,N,3)
+        """
+        dtype = np.int16 if name == "i" else self.header["dtype"]
+        out = np.empty((len(self), self.N, 3), dtype=dtype)
+        for c, (_, count, first) in enumerate(self.index):
+            out[first : first + count] = self.read_chunk(c)[name]
+        return out
+
+    @property
+    def r(self) -> NDArray:
+        """
+        Positions of all the frames, as (frames,N,3).
+        """
+        return self.field("r")
+
+    @property
+    def v(self) -> NDArray:
+        """
+        Velocities of all the frames, as (frames,N,3).
+        """
+        return self.field("v")
+
+    @property
+    def i(self) -> NDArray:
+        """
+        Box crossings of all the frames, as (frames,N,3).
+        """
+        return self.field("i")
+
+
+class SnapshotWriter:
+    """
+    Saves snapshots of atoms to files in a format: "xyz" text, see
+    Atoms.write_xyz, "trj" binary trajectory, see Atoms.write_trj, or
+    "ctrj" chunked, compressed trajectory, see ChunkedWriter, whose
+    writer of the current file is kept open, to fill its chunks, until
+    another file is written or close.
+
+    Attributes:
+        atoms (Atoms): Atoms object
+        fmt (str): format of the files
+        unfold (bool): unfold the coordinates of .xyz files
+        options (Dict): additional arguments of ChunkedWriter
+        writer (ChunkedWriter): writer of the current .ctrj file
+    """
+
+    FORMATS = ("xyz", "trj", "ctrj")
+
+    def __init__(
+        self, atoms: Atoms, fmt: str = "xyz", unfold: bool = False, **options
+    ):
+        """
+        Initialize SnapshotWriter object.
+
+        Args:
+            atoms (Atoms): Atoms object
+            fmt (str, optional): "xyz", "trj" or "ctrj". Defaults to "xyz".
+            unfold (bool, optional): unfold the coordinates of .xyz files.
+                Defaults to False.
+            **options: additional arguments of ChunkedWriter
+
+        Raises:
+            ValueError: if fmt is not a known format
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown trajectory format {fmt}")
+        self.atoms = atoms
+        self.fmt = fmt
+        self.unfold = unfold
+        self.options = options
+        self.writer = None
+
+    def __call__(
+        self, filename: str, append: bool = False, atoms: Atoms = None
+    ):
+        """
+        Saves a snapshot of the atoms.
+
+        Args:
+            filename (str): filename, with the extension of the format
+            append (bool, optional): if True, appends to an existing file.
+                Defaults to False.
+            atoms (Atoms, optional): snapshot to save instead of the atoms,
+                as a copy of them. Defaults to None.
+        """
+        if atoms is None:
+            atoms = self.atoms
+        if self.fmt == "xyz":
+            atoms.write_xyz(filename, append=append, unfold=self.unfold)
+        elif self.fmt == "trj":
+            atoms.write_trj(filename, append=append)
+        else:
+            if (
+                self.writer is None
+                or self.writer.filename != filename
+                or not append
+            ):
+                self.close_file()
+                self.writer = ChunkedWriter(
+                    filename, atoms, append=append, **self.options
+                )
+            self.writer.write(atoms)
+
+    def close_file(self):
+        """
+        Writes the frames still buffered and closes the current file.
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close(self):
+        """
+        Writes the frames still buffered and closes the files.
+        """
+        self.close_file()
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncSnapshotWriter(SnapshotWriter):
+    """
+    SnapshotWriter doing formatting, compression and writes in a
+    background thread, off the simulation loop: snapshots are copies of
+    the atoms passed through a bounded queue, so when the disk falls
+    behind, saving a snapshot waits for a free place instead of piling
+    up copies in memory. The thread can also run other writes, as the
+    rows of the state variables, see submit. close, or leaving the with
+    block, also after an exception or a cancelled run, writes everything
+    queued before returning; an exception of the thread is raised in the
+    simulation at the next snapshot, or at close.
+
+    Attributes:
+        queue (queue.Queue): writes waiting for the thread
+        thread (threading.Thread): writer thread
+        error (BaseException): exception of the thread, None if any
+        reported (bool): if the exception was raised in the simulation
+    """
+
+    def __init__(
+        self,
+        atoms: Atoms,
+        fmt: str = "xyz",
+        unfold: bool = False,
+        maxsize: int = 8,
+        **options,
+    ):
+        """
+        Initialize AsyncSnapshotWriter object, starting the thread.
+
+        Args:
+            atoms (Atoms): Atoms object
+            fmt (str, optional): "xyz", "trj" or "ctrj". Defaults to "xyz".
+            unfold (bool, optional): unfold the coordinates of .xyz files.
+                Defaults to False.
+            maxsize (int, optional): writes in the queue before saving a
+                snapshot waits. Defaults to 8.
+            **options: additional arguments of ChunkedWriter
+        """
+        super().__init__(atoms, fmt, unfold, **options)
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self.reported = False
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        """
+        Loop of the thread, running the writes in order until close. After
+        an exception, the writes left are dropped.
+        """
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            if self.error is None:
+                func, args, kwargs = task
+                try:
+                    func(*args, **kwargs)
+                except BaseException as error:
+                    self.error = error
+
+    def submit(self, func: Callable, *args, **kwargs):
+        """
+        Queues a write, waiting if the queue is full.
+
+        Args:
+            func (Callable): write function
+            *args, **kwargs: its arguments, that must not change until it
+                runs
+
+        Raises:
+            RuntimeError: if the writer is closed
+            BaseException: the exception of a previous write
+        """
+        if not self.thread.is_alive():
+            raise RuntimeError("Writer is closed")
+        if self.error is not None:
+            self.reported = True
+            raise self.error
+        self.queue.put((func, args, kwargs))
+
+    def __call__(
+        self, filename: str, append: bool = False, atoms: Atoms = None
+    ):
+        """
+        Queues a snapshot of the atoms.
+
+        Args:
+            filename (str): filename, with the extension of the format
+            append (bool, optional): if True, appends to an existing file.
+                Defaults to False.
+            atoms (Atoms, optional): snapshot to save, that must not change
+                afterwards. Defaults to None, a copy of the atoms.
+        """
+        if atoms is None:
+            atoms = self.atoms.copy()
+        self.submit(super().__call__, filename, append, atoms)
+
+    def close(self):
+        """
+        Waits for the writes queued, then writes the frames still buffered
+        and closes the files.
+
+        Raises:
+            BaseException: the exception of a write, if not raised yet
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        super().close()
+        if self.error is not None and not self.reported:
+            self.reported = True
+            raise self.error
+
+    def __exit__(self, exc_type, *exc):
+        try:
+            self.close()
+        except BaseException:
+            # Don't hide the exception of the simulation
+            if exc_type is None:
+                raise
@@ -1,11 +1,54 @@
-from typing import TextIO, Tuple
+import io
+import itertools
+import json
+import os
+import threading
+from typing import Dict, List, TextIO, Tuple, Union
 
 import numpy as np
 
+try:
+    from pymd import xyz_io
+except ImportError:
+    # Without the compiled parser and formatter, .xyz files are read with
+    # np.loadtxt and written with np.savetxt
+    xyz_io = None
+
+# First bytes of a binary trajectory, see trj_out
+TRJ_MAGIC = b"PYMDTRJ1"
+
+# Bytes of the element of an atom in the compiled .xyz parser and formatter
+XYZ_ELEM_WIDTH = 8
+
+# Output buffer of xyz_out, reused for every frame, one for thread
+_xyz_buffers = threading.local()
+
 
 def xyz_in(file: TextIO) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
     """
     Read and parse .xyz file to array of position and velocity vectors.
+    The lines of the frame are parsed by the compiled parser, see
+    xyz_parse, or by xyz_loadtxt without it.
+
+    Args:
+        file (TextIO): file stream
+
+    Returns:
+        Tuple[int, np.ndarray, np.ndarray, np.ndarray]: N of atoms, r, v arrays
+    """
+    if xyz_io is None:
+        return xyz_loadtxt(file)
+    header = next(file)
+    N = int(header.split()[0])
+    text = header + "".join(itertools.islice(file, N + 1))
+    return xyz_parse(text.encode())
+
+
+def xyz_loadtxt(
+    file: TextIO,
+) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Read and parse .xyz file with np.loadtxt, see xyz_in.
 
     Args:
         file (TextIO): file stream
@@ -49,23 +92,150 @@ def xyz_in(file: TextIO) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
         )
         elems = data[0]
         r = np.array(data[1:4]).T
-        v = np.random.exponential(size=(N, 3), dtype=np.float64)
+        v = np.random.exponential(size=(N, 3))
     # Return positions and velocities
     return N, elems, r, v
 
 
+def xyz_index(
+    filename: str, start: int = 0, block: int = 1 << 24
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Index of the frames of an .xyz file, in a single pass: the file is
+    read in blocks, where the ends of the lines are found at once, and
+    every frame takes the line of N and has_vel, a comment line and N
+    lines of atoms. An incomplete last frame is left out.
+
+    Args:
+        filename (str): filename of the .xyz file
+        start (int, optional): byte offset of the first frame to index.
+            Defaults to 0.
+        block (int, optional): bytes read at once. Defaults to 16 MiB.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: byte offset of every frame and of
+            the end of the last one, N of atoms of every frame
+    """
+    offsets = []
+    atoms = []
+    with open(filename, "rb") as f, open(filename, "rb") as peek:
+
+        def lines(offset: int) -> int:
+            # Lines of the frame at offset, 0 at the end of the file
+            peek.seek(offset)
+            header = peek.readline().split()
+            if not header:
+                return 0
+            atoms.append(int(header[0]))
+            return atoms[-1] + 2
+
+        remaining = lines(start)
+        f.seek(start)
+        base = start
+        while remaining:
+            data = f.read(block)
+            if not data:
+                break
+            ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)
+            done = 0
+            while remaining and len(ends) - done >= remaining:
+                done += remaining
+                offsets.append(start)
+                start = base + int(ends[done - 1]) + 1
+                remaining = lines(start)
+            remaining -= len(ends) - done
+            base += len(data)
+    offsets.append(start)
+    return (
+        np.array(offsets, dtype=np.int64),
+        np.array(atoms[: len(offsets) - 1], dtype=np.int64),
+    )
+
+
+def xyz_parse(data: bytes) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse a frame of an .xyz file from its bytes, see xyz_in. The
+    compiled parser, pymd.xyz_io, converts the coordinates straight into
+    the arrays, without np.loadtxt.
+
+    Args:
+        data (bytes): the frame, see xyz_index
+
+    Returns:
+        Tuple[int, np.ndarray, np.ndarray, np.ndarray]: N of atoms,
+            elements, r, v arrays
+    """
+    if xyz_io is None:
+        return xyz_loadtxt(io.StringIO(data.decode()))
+    N = int(data[:64].split()[0])
+    r = np.empty((N, 3))
+    v = np.empty((N, 3))
+    elems = np.empty((N, XYZ_ELEM_WIDTH), dtype=np.uint8)
+    _, has_vel, _ = xyz_io.parse_frame(data, 0, r, v, elems)
+    if not has_vel:
+        v = np.random.exponential(size=(N, 3))
+    return N, xyz_elems(elems), r, v
+
+
+def xyz_frames(
+    data: bytes, offsets: np.ndarray, N: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse consecutive frames of an .xyz file with the same number of
+    atoms, into preallocated arrays of all the frames.
+
+    Args:
+        data (bytes): the frames
+        offsets (np.ndarray): byte offset of every frame in data
+        N (int): N of atoms of every frame
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: r, v arrays, as (frames,N,3)
+    """
+    r = np.empty((len(offsets), N, 3))
+    v = np.empty((len(offsets), N, 3))
+    if xyz_io is None:
+        for k, start in enumerate(offsets):
+            end = offsets[k + 1] if k + 1 < len(offsets) else len(data)
+            _, _, r[k], v[k] = xyz_parse(data[start:end])
+        return r, v
+    elems = np.empty((N, XYZ_ELEM_WIDTH), dtype=np.uint8)
+    for k, start in enumerate(offsets):
+        _, has_vel, _ = xyz_io.parse_frame(data, start, r[k], v[k], elems)
+        if not has_vel:
+            v[k] = np.random.exponential(size=(N, 3))
+    return r, v
+
+
+def xyz_elems(elems: np.ndarray) -> np.ndarray:
+    """
+    Elements of the compiled parser as strings.
+
+    Args:
+        elems (np.ndarray): element of every atom, as bytes padded with
+            zeros, as (N,XYZ_ELEM_WIDTH)
+
+    Returns:
+        np.ndarray: element of every atom
+    """
+    return elems.view(f"S{elems.shape[1]}")[:, 0].astype(str)
+
+
 def xyz_out(
     datafile: TextIO,
     r: np.ndarray,
     v: np.ndarray,
     i: np.ndarray,
     L: float,
-    elem: str = "Ar",
+    elem: Union[str, np.ndarray] = "Ar",
     put_vel: bool = True,
     unfold: bool = False,
 ):
     """
-    Outputs array of position and velocity vectors to file in .xyz format
+    Outputs array of position and velocity vectors to file in .xyz format.
+    The frame is formatted by the compiled formatter, pymd.xyz_io, into a
+    buffer reused by every call, or by xyz_savetxt without it; the text
+    is the same.
 
     Args:
         datafile (TextIO): file stream
@@ -73,12 +243,56 @@ def xyz_out(
         v (np.ndarray): array of velocity vectors
         i (np.ndarray): array of periodic boundary crossing vectors
         L (float): box dimension
-        elem (str, optional): atomic specie. Defaults to "Ar".
+        elem (Union[str, np.ndarray], optional): atomic specie, or array
+            with the specie of every atom. Defaults to "Ar".
         put_vel (bool, optional): choice if put velocities in .xyz file.
                                   Defaults to True.
         unfold (bool, optional): choice to unfold the coordinates, the unfolded
                                  coordinate is r[i]+i[i]*L. Defaults to False.
     """
+    if xyz_io is None:
+        xyz_savetxt(datafile, r, v, i, L, elem, put_vel, unfold)
+        return
+    data = r + i * L if unfold else r
+    data = np.ascontiguousarray(data)
+    v = np.ascontiguousarray(v if put_vel else data[:0], dtype=data.dtype)
+    names = np.asarray([elem] if isinstance(elem, str) else elem)
+    names = names.astype(f"S{XYZ_ELEM_WIDTH}")
+    names = names.view(np.uint8).reshape(len(names), XYZ_ELEM_WIDTH)
+    size = xyz_io.frame_size(len(data), XYZ_ELEM_WIDTH, put_vel)
+    buf = getattr(_xyz_buffers, "buf", None)
+    if buf is None or len(buf) < size:
+        buf = _xyz_buffers.buf = np.empty(size, dtype=np.uint8)
+    n = xyz_io.format_frame(data, v, names, buf)
+    datafile.write(buf[:n].tobytes().decode())
+
+
+def xyz_savetxt(
+    datafile: TextIO,
+    r: np.ndarray,
+    v: np.ndarray,
+    i: np.ndarray,
+    L: float,
+    elem: Union[str, np.ndarray] = "Ar",
+    put_vel: bool = True,
+    unfold: bool = False,
+):
+    """
+    Outputs a frame to file in .xyz format with np.savetxt, see xyz_out.
+
+    Args:
+        datafile (TextIO): file stream
+        r (np.ndarray): array of position vectors
+        v (np.ndarray): array of velocity vectors
+        i (np.ndarray): array of periodic boundary crossing vectors
+        L (float): box dimension
+        elem (Union[str, np.ndarray], optional): atomic specie, or array
+            with the specie of every atom. Defaults to "Ar".
+        put_vel (bool, optional): choice if put velocities in .xyz file.
+            Defaults to True.
+        unfold (bool, optional): choice to unfold the coordinates.
+            Defaults to False.
+    """
     # Get N of particles
     N = r.shape[0]
     # Unfold positions
@@ -86,7 +300,12 @@ def xyz_out(
     # Put velocities
     data = np.hstack([data, v]) if put_vel else data
     # Save the file using numpy fast function
-    formatstr = elem + data.shape[1] * " %.8f"
+    if isinstance(elem, str):
+        formatstr = elem + data.shape[1] * " %.8f"
+    else:
+        # A column of species, the rows are formatted one by one
+        formatstr = "%s" + data.shape[1] * " %.8f"
+        data = np.column_stack([np.asarray(elem, dtype=object), data])
     np.savetxt(
         datafile,
         data,
@@ -96,6 +315,138 @@ def xyz_out(
     )
 
 
+def trj_frame_dtype(N: int, dtype: str, fields: List[str]) -> np.dtype:
+    """
+    Type of a frame of a binary trajectory: a record with the (N,3)
+    arrays of the fields, positions and velocities in the precision of
+    the atoms and box crossings as int16.
+
+    Args:
+        N (int): number of atoms
+        dtype (str): type of positions and velocities, as "<f8" or "<f4"
+        fields (List[str]): fields of the frames, among "r", "v", "i"
+
+    Returns:
+        np.dtype: type of a frame
+    """
+    types = {"r": dtype, "v": dtype, "i": "<i2"}
+    return np.dtype([(name, types[name], (N, 3)) for name in fields])
+
+
+def trj_header(file, magic: bytes = TRJ_MAGIC) -> Tuple[Dict, int]:
+    """
+    Reads the header of a binary trajectory.
+
+    Args:
+        file (BinaryIO): file stream, at the start of the file
+        magic (bytes, optional): first bytes of the format.
+            Defaults to TRJ_MAGIC.
+
+    Raises:
+        ValueError: if the file is not a binary trajectory
+
+    Returns:
+        Tuple[Dict, int]: header, and offset of the first frame
+    """
+    if file.read(len(magic)) != magic:
+        raise ValueError("Not a pymd binary trajectory")
+    offset = int(np.frombuffer(file.read(8), dtype="<u8")[0])
+    header = json.loads(file.read(offset - len(magic) - 8))
+    return header, offset
+
+
+def trj_header_bytes(header: Dict, magic: bytes = TRJ_MAGIC) -> bytes:
+    """
+    Header of a binary trajectory: the magic bytes, the offset of the
+    first frame as uint64 and the header as JSON, padded so that frames
+    start at a multiple of 64 bytes.
+
+    Args:
+        header (Dict): header
+        magic (bytes, optional): first bytes of the format.
+            Defaults to TRJ_MAGIC.
+
+    Returns:
+        bytes: the header
+    """
+    text = json.dumps(header).encode()
+    size = -(-(len(magic) + 8 + len(text)) // 64) * 64
+    text = text.ljust(size - len(magic) - 8)
+    return magic + np.array(size, dtype="<u8").tobytes() + text
+
+
+def trj_out(
+    filename: str,
+    r: np.ndarray,
+    v: np.ndarray,
+    i: np.ndarray,
+    rho: float,
+    elem: Union[str, List[str]] = "Ar",
+    types: np.ndarray = None,
+    put_vel: bool = True,
+    append: bool = False,
+):
+    """
+    Outputs a frame of position, velocity and box crossing vectors to a
+    binary trajectory. The file starts with TRJ_MAGIC, the offset of the
+    first frame as uint64 and a JSON header with N, rho, L, the species
+    and types of the atoms, the type of positions and velocities and the
+    fields of the frames; then fixed size frames follow, see
+    trj_frame_dtype, so that appending a frame is a single write and the
+    file maps to an array without parsing. Positions are folded in the
+    box, unfolded ones are r+i*L.
+
+    Args:
+        filename (str): filename of the trajectory
+        r (np.ndarray): array of position vectors
+        v (np.ndarray): array of velocity vectors
+        i (np.ndarray): array of periodic boundary crossing vectors
+        rho (float): density of atoms
+        elem (Union[str, List[str]], optional): atomic specie, or list of
+            the species of a mixture. Defaults to "Ar".
+        types (np.ndarray, optional): species of every atom, as index in
+            elem. Defaults to None, all the first one.
+        put_vel (bool, optional): choice if put velocities in the frames.
+            Defaults to True.
+        append (bool, optional): if True, appends the frame to an existing
+            trajectory with the same header. Defaults to False.
+
+    Raises:
+        ValueError: if appending to a trajectory with a different header
+    """
+    N = r.shape[0]
+    header = {
+        "N": N,
+        "rho": rho,
+        "L": float(np.cbrt(N / rho)),
+        "elem": [elem] if isinstance(elem, str) else list(elem),
+        "types": None if types is None else np.asarray(types).tolist(),
+        "dtype": np.dtype(r.dtype).newbyteorder("<").str,
+        "fields": ["r", "v", "i"] if put_vel else ["r", "i"],
+    }
+    if append and os.path.exists(filename):
+        with open(filename, "rb") as f:
+            old, _ = trj_header(f)
+        keys = ("N", "rho", "elem", "types", "dtype", "fields")
+        if any(old[key] != header[key] for key in keys):
+            raise ValueError(f"Frame doesn't match the header of {filename}")
+        header = old
+        mode = "ab"
+    else:
+        mode = "wb"
+    frame = np.empty(
+        1, dtype=trj_frame_dtype(N, header["dtype"], header["fields"])
+    )
+    frame["r"] = r
+    frame["i"] = i
+    if put_vel:
+        frame["v"] = v
+    with open(filename, mode) as f:
+        if mode == "wb":
+            f.write(trj_header_bytes(header))
+        frame.tofile(f)
+
+
 def gen_cubic_grid(N: int) -> np.ndarray:
     """
     Generate the smallest cubic grid housing N particles,
@@ -116,3 +467,94 @@ def gen_cubic_grid(N: int) -> np.ndarray:
     # N.B USO ORDINE INVERSO, PER ORA, PER COMPATIBILITA
     grid = np.array([z, y, x]).reshape(3, n3 ** 3).T
     return (grid + 0.5) / n3
+
+
+def interleave_bits(X: np.ndarray, bits: int) -> np.ndarray:
+    """
+    Interleave the bits of integer coordinates, from the most
+    significant one: the key of (x, y, z) is x_b y_b z_b ... x_0 y_0 z_0.
+
+    Args:
+        X (np.ndarray): (N,3) array of integer coordinates
+        bits (int): bits per coordinate
+
+    Returns:
+        np.ndarray: array of N keys
+    """
+    key = np.zeros(X.shape[0], dtype=np.int64)
+    for b in range(bits - 1, -1, -1):
+        for d in range(3):
+            key = (key << 1) | ((X[:, d] >> b) & 1)
+    return key
+
+
+def hilbert_keys(X: np.ndarray, bits: int) -> np.ndarray:
+    """
+    Position of integer coordinates along the 3D Hilbert curve, using
+    Skilling's transform (AIP Conf. Proc. 707, 381 (2004)).
+
+    Args:
+        X (np.ndarray): (N,3) array of integer coordinates
+        bits (int): bits per coordinate
+
+    Returns:
+        np.ndarray: array of N keys
+    """
+    X = np.array(X, dtype=np.int64)
+    # Inverse undo excess work
+    Q = 1 << (bits - 1)
+    while Q > 1:
+        P = Q - 1
+        for d in range(3):
+            high = (X[:, d] & Q) != 0
+            # Invert the low bits of x where the bit is set
+            X[high, 0] ^= P
+            # Exchange the low bits of x and X[d] elsewhere
+            t = (X[~high, 0] ^ X[~high, d]) & P
+            X[~high, 0] ^= t
+            X[~high, d] ^= t
+        Q >>= 1
+    # Gray encode
+    X[:, 1] ^= X[:, 0]
+    X[:, 2] ^= X[:, 1]
+    t = np.zeros(X.shape[0], dtype=np.int64)
+    Q = 1 << (bits - 1)
+    while Q > 1:
+        t[(X[:, 2] & Q) != 0] ^= Q - 1
+        Q >>= 1
+    X ^= t[:, None]
+    return interleave_bits(X, bits)
+
+
+def space_filling_order(
+    r: np.ndarray, L: float, curve: str = "hilbert", bits: int = 10
+) -> np.ndarray:
+    """
+    Order of the atoms along a space filling curve: atoms close in the
+    order are close in space. The box is divided in 2^bits cells per
+    side, atoms in the same cell keep their relative order.
+
+    Args:
+        r (np.ndarray): array of positions, in the box
+        L (float): box length
+        curve (str, optional): "hilbert" or "morton" (Z-order).
+            Defaults to "hilbert".
+        bits (int, optional): bits per coordinate, at most 21.
+            Defaults to 10.
+
+    Raises:
+        ValueError: if the curve is unknown
+
+    Returns:
+        np.ndarray: permutation sorting the atoms along the curve
+    """
+    if curve not in ("hilbert", "morton"):
+        raise ValueError(f"Unknown space filling curve {curve}")
+    n = 1 << bits
+    X = np.clip((r * (n / L)).astype(np.int64), 0, n - 1)
+    key = (
+        hilbert_keys(X, bits)
+        if curve == "hilbert"
+        else interleave_bits(X, bits)
+    )
+    return np.argsort(key, kind="stable")
@@ -0,0 +1,43 @@
+import numpy as np
+
+from pymd.atoms import Atoms
+from pymd.batch import BatchState
+from pymd.element import gen_element
+
+N = 108
+RHO = 0.8
+TBATH = [1.0, 1.5, 2.0]
+DT = 0.005
+
+
+def batch(seed: int, block: int = 10) -> BatchState:
+    rng = np.random.default_rng(0)
+    replicas = [
+        Atoms(N, RHO, gen_element("Ar"), v=rng.standard_normal((N, 3)))
+        for _ in TBATH
+    ]
+    return BatchState(
+        replicas, 1.0, 2.5, TBATH, nu=5.0, seed=seed, block=block
+    )
+
+
+def test_batch_seed():
+    # Runs across blocks of collisions give the same output for a seed
+    first, second, other = batch(7), batch(7), batch(8)
+    out = first.run(25, DT)
+    np.testing.assert_array_equal(second.run(25, DT), out)
+    np.testing.assert_array_equal(second.v, first.v)
+    other.run(25, DT)
+    assert not np.array_equal(other.v, first.v)
+
+
+def test_batch_collisions():
+    state = batch(7, block=1000)
+    state.run(1, DT)
+    collisions = state.collisions["bounds"][-1]
+    expected = len(TBATH) * N * state.nu * DT * state.block
+    assert abs(collisions - expected) < 5 * np.sqrt(expected)
+    replicas = state.collisions["atoms"] // N
+    np.testing.assert_allclose(
+        np.bincount(replicas), expected / len(TBATH), rtol=0.1
+    )
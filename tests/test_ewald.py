@@ -0,0 +1,31 @@
+from math import log, pi, sqrt
+
+import numpy as np
+import pytest
+
+from pymd.ewald import ERROR_TRUNCATION, SPME, ewald_sum
+
+N = 100
+L = 5.0
+RC = 2.4
+
+
+@pytest.mark.parametrize("tol", [1e-4, 1e-5])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_spme_tuned(tol, seed):
+    # Neutral system of alternating unit charges at random positions
+    rng = np.random.default_rng(seed)
+    r = rng.uniform(0, L, size=(N, 3))
+    q = np.where(np.arange(N) % 2 == 0, 1.0, -1.0)
+    spme = SPME.tuned(L, RC, tol=tol, q=q)
+    kmax = int(np.ceil(spme.alpha * sqrt(-log(ERROR_TRUNCATION)) / pi * L))
+    fref, eref, virref = ewald_sum(r, q, L, spme.alpha, 0.0, kmax)
+
+    eatom = np.zeros(N)
+    W = np.zeros((3, 3))
+    f, e, vir = spme.compute(r, q, eatom=eatom, W=W)
+    assert np.sqrt(np.mean(np.sum((f - fref) ** 2, 1))) <= tol
+    assert abs(e - eref) / N <= tol
+    assert abs(vir - virref) / N <= tol
+    assert eatom.sum() == pytest.approx(e, rel=1e-12)
+    assert np.trace(W) == pytest.approx(vir, rel=1e-12)
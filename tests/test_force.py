@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from pymd.backend import available_backends, get_backend
+
+RC = 2.5
+ECUT = 4 * (RC ** -12 - RC ** -6)
+
+
+def configuration(N: int, rho: float, seed: int) -> tuple:
+    """
+    Random configuration of N atoms at density rho: a cubic grid with
+    random displacements, so that no two atoms overlap.
+
+    Returns:
+        tuple: positions, as (N,3), and box length
+    """
+    rng = np.random.default_rng(seed)
+    L = np.cbrt(N / rho)
+    side = int(np.ceil(np.cbrt(N)))
+    grid = np.stack(
+        np.meshgrid(*3 * [np.arange(side)], indexing="ij"), -1
+    ).reshape(-1, 3)
+    r = (grid[rng.permutation(len(grid))[:N]] + 0.5) * (L / side)
+    r += rng.uniform(-0.1, 0.1, size=r.shape)
+    return np.ascontiguousarray(np.mod(r, L)), L
+
+
+# (N, rho): boxes with 2 cells per side, where force_cell falls back to
+# the N^2 loop, and with 3 and 4 cells per side
+SYSTEMS = [(108, 0.8), (500, 0.8), (864, 0.6)]
+
+
+@pytest.fixture(params=available_backends())
+def backend(request):
+    return get_backend(request.param)
+
+
+def assert_same(result, reference):
+    f, e, vir = result
+    fref, eref, virref = reference
+    np.testing.assert_allclose(f, fref, rtol=1e-9, atol=1e-9)
+    assert e == pytest.approx(eref, rel=1e-10)
+    assert vir == pytest.approx(virref, rel=1e-10)
+
+
+@pytest.mark.parametrize("N,rho", SYSTEMS)
+@pytest.mark.parametrize("seed", [0, 1])
+def test_force_cell(backend, N, rho, seed):
+    r, L = configuration(N, rho, seed)
+    assert_same(
+        backend.force_cell(r, L, RC, 0.0, ECUT),
+        backend.force(r, L, RC, 0.0, ECUT),
+    )
+
+
+@pytest.mark.parametrize("N,rho", SYSTEMS)
+@pytest.mark.parametrize("skin", [0.0, 0.3])
+def test_force_neighbors(backend, N, rho, skin):
+    r, L = configuration(N, rho, 2)
+    start, nbr, _ = backend.build_neighbors(r, L, RC + skin)
+    assert_same(
+        backend.force_neighbors(r, L, RC, 0.0, ECUT, start, nbr),
+        backend.force(r, L, RC, 0.0, ECUT),
+    )
+
+
+@pytest.mark.parametrize("N,rho", SYSTEMS)
+def test_force_backends(backend, N, rho):
+    r, L = configuration(N, rho, 3)
+    assert_same(
+        backend.force(r, L, RC, 0.0, ECUT),
+        get_backend("numpy").force(r, L, RC, 0.0, ECUT),
+    )
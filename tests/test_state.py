@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+import pytest
+
+from pymd.atoms import Atoms
+from pymd.element import gen_element
+from pymd.state import NVTAndersenState
+
+N = 108
+RHO = 0.8
+DT = 0.005
+BLOCK = 10
+
+
+def andersen(v: np.ndarray, seed: int) -> NVTAndersenState:
+    atoms = Atoms(N, RHO, gen_element("Ar"), v=v.copy(), removedrift=False)
+    return NVTAndersenState(atoms, 1.0, 1.5, 5.0, 2.5, seed=seed, block=BLOCK)
+
+
+def velocities(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((N, 3))
+
+
+@pytest.mark.parametrize("saved", [0, BLOCK // 2, BLOCK, 2 * BLOCK])
+def test_andersen_restart(saved):
+    nsteps = 3 * BLOCK
+    v0 = velocities(0)
+    reference = andersen(v0, seed=7)
+    for _ in range(nsteps):
+        reference.step(DT)
+
+    state = andersen(v0, seed=7)
+    for _ in range(saved):
+        state.step(DT)
+    rng_state = json.loads(json.dumps(state.rng_state))
+    restarted = andersen(velocities(1), seed=99)
+    restarted.atoms.r[:] = state.atoms.r
+    restarted.atoms.v[:] = state.atoms.v
+    restarted.f[:] = state.f
+    restarted.rng_state = rng_state
+    for _ in range(nsteps - saved):
+        restarted.step(DT)
+    np.testing.assert_allclose(
+        restarted.atoms.v, reference.atoms.v, rtol=1e-10, atol=1e-10
+    )
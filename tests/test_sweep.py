@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from pymd.sweep import RESULTDTYPE, load_results, sweep
+
+GRID = {"rho": [0.8], "T": [1.0, 1.5], "rc": [2.5]}
+CONFIG = {"N": 108, "steps": 20, "equilibration": 10, "workers": 1}
+# Columns of a result row that depend only on the sweep
+COLUMNS = [name for name in RESULTDTYPE.names if name != "wall"]
+
+
+def test_sweep_restart(tmp_path):
+    filename = str(tmp_path / "sweep.txt")
+    results = sweep(filename, **GRID, **CONFIG)
+    assert results["index"].tolist() == [0, 1]
+    with open(filename) as f:
+        lines = f.readlines()
+    # Indices written as integers
+    assert {line.split("\t")[0] for line in lines[2:]} == {"0", "1"}
+
+    # Interrupted after the first point done
+    with open(filename, "w") as f:
+        f.writelines(lines[:3])
+    done = int(lines[2].split("\t")[0])
+    rerun = []
+    restarted = sweep(filename, **GRID, **CONFIG, on_result=rerun.append)
+    assert [row["index"][0] for row in rerun] == [1 - done]
+    np.testing.assert_array_equal(
+        restarted[COLUMNS], load_results(filename)[COLUMNS]
+    )
+    np.testing.assert_array_equal(restarted[COLUMNS], results[COLUMNS])
+
+    with pytest.raises(ValueError):
+        sweep(filename, **GRID, **CONFIG, seed=1)
+    with pytest.raises(ValueError):
+        sweep(filename, **{**GRID, "T": [1.0, 2.0]}, **CONFIG)
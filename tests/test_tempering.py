@@ -0,0 +1,24 @@
+import numpy as np
+
+from pymd.tempering import ParallelTempering
+
+TEMPERATURES = [0.8, 1.0, 1.2]
+
+
+def velocities(seed: int) -> np.ndarray:
+    with ParallelTempering(
+        108, 0.8, TEMPERATURES, 2.5, workers=1, seed=seed
+    ) as pt:
+        return pt.shared["v"][1].copy()
+
+
+def test_tempering_global_rng():
+    # The initial velocities depend only on the seed, and the global
+    # generator of the caller is left as it was
+    np.random.seed(42)
+    expected = np.random.random(4)
+    np.random.seed(42)
+    v = velocities(3)
+    np.testing.assert_array_equal(np.random.random(4), expected)
+    np.testing.assert_array_equal(velocities(3), v)
+    assert not np.array_equal(velocities(4), v)
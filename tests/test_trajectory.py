@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from pymd.atoms import Atoms
+from pymd.element import gen_element
+from pymd.trajectory import (
+    ChunkedTrajectory,
+    ChunkedWriter,
+    Trajectory,
+    XYZTrajectory,
+)
+
+N = 32
+RHO = 0.8
+TYPES = np.arange(N) % 2
+# Atoms that can't be appended to a trajectory of a mixture of Ar and Kr
+# with TYPES: other density, species or types
+MISMATCHED = [
+    {"rho": 0.7},
+    {"elem": ("Ar", "Ne")},
+    {"types": 1 - TYPES},
+]
+
+
+def mixture(rho=RHO, elem=("Ar", "Kr"), types=TYPES) -> Atoms:
+    species = [gen_element(name) for name in elem]
+    return Atoms(N, rho, species, types=types, removedrift=False)
+
+
+def frames(n: int, seed: int):
+    """
+    Atoms with random positions and velocities, changed in place for every
+    one of n frames; yields them with a copy of their positions.
+    """
+    rng = np.random.default_rng(seed)
+    atoms = Atoms(N, RHO, gen_element("Ar"), removedrift=False)
+    for _ in range(n):
+        atoms.r[:] = rng.uniform(0, atoms.L, size=(N, 3))
+        atoms.v[:] = rng.standard_normal((N, 3))
+        yield atoms, atoms.r.copy()
+
+
+def write_chunked(filename, n: int, seed: int, **kwargs) -> list:
+    positions = []
+    writer = None
+    for atoms, r in frames(n, seed):
+        if writer is None:
+            writer = ChunkedWriter(filename, atoms, chunk=4, **kwargs)
+        writer.write(atoms)
+        positions.append(r)
+    writer.close()
+    return positions
+
+
+def assert_positions(trajectory, positions):
+    assert len(trajectory) == len(positions)
+    for k, r in enumerate(positions):
+        np.testing.assert_array_equal(trajectory.frame(k)["r"], r)
+
+
+def test_chunked_roundtrip(tmp_path):
+    filename = tmp_path / "run.ctrj"
+    positions = write_chunked(filename, 10, seed=0)
+    trajectory = ChunkedTrajectory(filename)
+    assert trajectory.index[:, 1].tolist() == [4, 4, 2]
+    assert_positions(trajectory, positions)
+
+
+@pytest.mark.parametrize("cut", ["index", "chunk"])
+def test_chunked_recover(tmp_path, cut):
+    # A writer killed after cutting the index, before or after writing
+    # the last chunk
+    filename = tmp_path / "run.ctrj"
+    positions = write_chunked(filename, 10, seed=0)
+    trajectory = ChunkedTrajectory(filename)
+    if cut == "index":
+        size = trajectory.end
+    else:
+        size = trajectory.index[-1, 0] + 30
+        positions = positions[:8]
+    with open(filename, "r+b") as f:
+        f.truncate(size)
+    assert_positions(ChunkedTrajectory(filename), positions)
+
+    positions += write_chunked(filename, 3, seed=1, append=True)
+    trajectory = ChunkedTrajectory(filename)
+    assert_positions(trajectory, positions)
+    assert trajectory.end + 24 + 16 * len(trajectory.index) == (
+        filename.stat().st_size
+    )
+
+
+@pytest.mark.parametrize("changed", MISMATCHED)
+def test_chunked_append_mismatch(tmp_path, changed):
+    filename = tmp_path / "run.ctrj"
+    with ChunkedWriter(filename, mixture()) as writer:
+        writer.write(mixture())
+    with pytest.raises(ValueError):
+        ChunkedWriter(filename, mixture(**changed), append=True)
+    with ChunkedWriter(filename, mixture(), append=True) as writer:
+        writer.write(mixture())
+    assert len(ChunkedTrajectory(filename)) == 2
+
+
+@pytest.mark.parametrize("changed", MISMATCHED)
+def test_trj_append_mismatch(tmp_path, changed):
+    filename = str(tmp_path / "run.trj")
+    mixture().write_trj(filename)
+    with pytest.raises(ValueError):
+        mixture(**changed).write_trj(filename, append=True)
+    mixture().write_trj(filename, append=True)
+    assert len(Trajectory(filename)) == 2
+
+
+def xyz_frame(n: int, comment: str = "") -> str:
+    return f"{n} 0\n{comment}\n" + "Ar 1.0 2.0 3.0\n" * n
+
+
+def assert_xyz_index(filename):
+    cached = XYZTrajectory(str(filename), RHO)
+    fresh = XYZTrajectory(str(filename), RHO, cache=False)
+    np.testing.assert_array_equal(cached.offsets, fresh.offsets)
+    np.testing.assert_array_equal(cached.counts, fresh.counts)
+    return cached
+
+
+def test_xyz_index_overwritten(tmp_path):
+    # Two frames of 2 atoms overwritten by three frames of 4 atoms, the
+    # first padded so that a frame starts at the old end of the file
+    filename = tmp_path / "run.xyz"
+    old = 2 * xyz_frame(2)
+    filename.write_text(old)
+    assert len(assert_xyz_index(filename)) == 2
+    pad = "x" * (len(old) - len(xyz_frame(4)))
+    filename.write_text(xyz_frame(4, pad) + 2 * xyz_frame(4))
+    trajectory = assert_xyz_index(filename)
+    assert trajectory.counts.tolist() == [4, 4, 4]
+    assert len(old) in trajectory.offsets
+
+
+def test_xyz_index_appended(tmp_path):
+    filename = tmp_path / "run.xyz"
+    filename.write_text(2 * xyz_frame(2))
+    assert len(assert_xyz_index(filename)) == 2
+    # A frame being written is left out, until it is complete
+    partial = xyz_frame(3)
+    with open(filename, "a") as f:
+        f.write(partial[:10])
+    assert len(assert_xyz_index(filename)) == 2
+    with open(filename, "a") as f:
+        f.write(partial[10:] + xyz_frame(2))
+    trajectory = assert_xyz_index(filename)
+    assert trajectory.counts.tolist() == [2, 2, 3, 2]